@@ -0,0 +1,479 @@
+#!/usr/bin/env python3
+"""
+On-disk job artifact
+Columnar row tables and a memory-mapped image blob store between the pipeline stages
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+from collections.abc import Mapping
+
+from images import ImageStore
+
+TABLE_VERSION = 1
+TABLE_MAGIC = b"QTBL"
+ROW_GROUP_SIZE = 1024       # Rows held in memory while writing or reading a table
+ROWS_TABLE = "rows.table"
+ITEMS_TABLE = "items.table"
+BLOBS_FILE = "images.blobs"
+BLOBS_INDEX = "images.index.json"
+SOURCE_ROW_KEY = "source_row"  # Items point back at the extracted row they came from
+STAGES = ["extract", "normalize", "generate"]
+
+
+class TableWriter:
+    """Columnar table written in row groups
+
+    Each group stores every column as one zlib-compressed JSON array, so a
+    reader can load one column without the others and never needs more
+    than one group in memory. The footer (JSON, then its length and the
+    magic bytes) indexes the column chunks of every group. null_value is
+    stored as a real null and restored on read (extracted rows use the
+    string "null" for empty cells). The file only appears under its name
+    once close() has written the footer.
+    """
+
+    def __init__(self, path, group_size=ROW_GROUP_SIZE, null_value=None):
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        self.group_size = group_size
+        self.null_value = null_value
+        self.file = open(self.tmp_path, "wb")
+        self.file.write(TABLE_MAGIC)
+        self.columns = []
+        self.groups = []
+        self.pending = []
+        self.rows = 0
+
+    def __len__(self):
+        return self.rows + len(self.pending)
+
+    def append(self, row):
+        for key in row:
+            if key not in self.columns:
+                self.columns.append(key)
+        self.pending.append(row)
+        if len(self.pending) >= self.group_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        chunks = {}
+        for column in self.columns:
+            values = [row.get(column) for row in self.pending]
+            if self.null_value is not None:
+                values = [None if value == self.null_value else value for value in values]
+            data = zlib.compress(json.dumps(values, ensure_ascii=False, default=str).encode("utf-8"), 1)
+            chunks[column] = [self.file.tell(), len(data)]
+            self.file.write(data)
+        self.groups.append({"rows": len(self.pending), "columns": chunks})
+        self.rows += len(self.pending)
+        self.pending = []
+
+    def close(self, meta=None):
+        """Write the footer and move the table into place"""
+        self.flush()
+        footer = json.dumps({
+            "version": TABLE_VERSION, "rows": self.rows, "columns": self.columns, "groups": self.groups,
+            "null_value": self.null_value, "meta": meta or {},
+        }, ensure_ascii=False).encode("utf-8")
+        self.file.write(footer)
+        self.file.write(struct.pack("<Q", len(footer)) + TABLE_MAGIC)
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        self.file.close()
+        os.remove(self.tmp_path)
+
+
+class TableReader:
+    """Reads a TableWriter file through mmap, one row group at a time"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:4] != TABLE_MAGIC or self.mm[-4:] != TABLE_MAGIC:
+            raise ValueError(f"{path} is not a complete row table")
+        (footer_len,) = struct.unpack("<Q", self.mm[-12:-4])
+        footer = json.loads(self.mm[-12 - footer_len:-12])
+        if footer["version"] != TABLE_VERSION:
+            raise ValueError(f"{path} has table version {footer['version']}, expected {TABLE_VERSION}")
+        self.columns = footer["columns"]
+        self.groups = footer["groups"]
+        self.rows = footer["rows"]
+        self.null_value = footer["null_value"]
+        self.meta = footer["meta"]
+
+    def __len__(self):
+        return self.rows
+
+    def read_chunk(self, group, column):
+        if column not in group["columns"]:
+            return [None] * group["rows"]
+        offset, length = group["columns"][column]
+        values = json.loads(zlib.decompress(self.mm[offset:offset + length]))
+        if self.null_value is not None:
+            values = [self.null_value if value is None else value for value in values]
+        return values
+
+    def column(self, name):
+        """All values of one column, without decoding the others"""
+        values = []
+        for group in self.groups:
+            values.extend(self.read_chunk(group, name))
+        return values
+
+    def iter_rows(self):
+        """Rows as dicts (columns in first-seen order), streamed group by group"""
+        for group in self.groups:
+            columns = [(name, self.read_chunk(group, name)) for name in self.columns if name in group["columns"]]
+            for idx in range(group["rows"]):
+                yield {name: values[idx] for name, values in columns}
+
+    def close(self):
+        self.mm.close()
+
+
+class BlobWriter:
+    """Appends images to one blob file; the offset index is written by close()"""
+
+    def __init__(self, job_dir):
+        self.path = os.path.join(job_dir, BLOBS_FILE)
+        self.index_path = os.path.join(job_dir, BLOBS_INDEX)
+        self.file = open(f"{self.path}.tmp", "wb")
+        self.index = {}
+
+    def add(self, name, data):
+        self.index[name] = [self.file.tell(), len(data)]
+        self.file.write(data)
+
+    def abort(self):
+        self.file.close()
+        os.remove(f"{self.path}.tmp")
+
+    def close(self):
+        self.file.close()
+        os.replace(f"{self.path}.tmp", self.path)
+        with open(f"{self.index_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(self.index, f)
+        os.replace(f"{self.index_path}.tmp", self.index_path)
+
+
+class BlobReader(Mapping):
+    """Image name -> bytes, read on demand from the memory-mapped blob file
+
+    Works as the images mapping of the quote writer, so only the pages of
+    the images actually being embedded are loaded.
+    """
+
+    def __init__(self, job_dir):
+        with open(os.path.join(job_dir, BLOBS_INDEX), encoding="utf-8") as f:
+            self.index = json.load(f)
+        self.mm = None
+        if os.path.getsize(os.path.join(job_dir, BLOBS_FILE)):  # mmap refuses empty files
+            with open(os.path.join(job_dir, BLOBS_FILE), "rb") as f:
+                self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __getitem__(self, name):
+        offset, length = self.index[name]
+        return self.mm[offset:offset + length]
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+
+
+class BlobImageStore(ImageStore):
+    """ImageStore that puts each distinct image into a BlobWriter instead of a loose file"""
+
+    def __init__(self, blobs, **kwargs):
+        self.blobs = blobs
+        super().__init__(os.path.dirname(blobs.path), **kwargs)
+
+    def write(self, image_filename, data):
+        self.blobs.add(image_filename, data)
+
+
+def input_signature(input_file):
+    """Identifies the input version an artifact was built from"""
+    stat = os.stat(input_file)
+    return {"input": os.path.abspath(input_file), "size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def stage_done(job_dir, stage, input_file=None, merge_similar=False):
+    """True if the stage's output is complete (and, for extract, from this input and image merging)"""
+    if stage == "extract":
+        path = os.path.join(job_dir, ROWS_TABLE)
+        if not (os.path.exists(path) and os.path.exists(os.path.join(job_dir, BLOBS_INDEX))):
+            return False
+        if input_file is None:
+            return True
+        table = TableReader(path)
+        try:
+            return (table.meta.get("signature") == input_signature(input_file)
+                    and table.meta.get("merge_similar", False) == merge_similar)
+        finally:
+            table.close()
+    if stage == "normalize":
+        return os.path.exists(os.path.join(job_dir, ITEMS_TABLE))
+    return False  # generate always runs
+
+
+def extract_to_job(input_file, job_dir, merge_similar=False):
+    """Stage 1: stream the workbook into rows.table and the image blob store
+
+    With merge_similar, rows whose pictures are near-duplicates share one blob.
+    """
+    from unified import iter_customer_rows
+
+    os.makedirs(job_dir, exist_ok=True)
+    blobs = BlobWriter(job_dir)
+    store = BlobImageStore(blobs, merge_similar=merge_similar)
+    table = TableWriter(os.path.join(job_dir, ROWS_TABLE), null_value="null")
+    try:
+        for row in iter_customer_rows(input_file, job_dir, store=store):
+            table.append(row)
+    except BaseException:
+        table.abort()
+        blobs.abort()
+        raise
+    blobs.close()
+    table.close(meta={"signature": input_signature(input_file), "merge_similar": merge_similar,
+                      "images": store.summary()})
+    return table.rows
+
+
+def head_rows(table):
+    """The first rows, enough to find the header layout"""
+    from header_map import HEADER_SEARCH_ROWS
+
+    head = []
+    for row in table.iter_rows():
+        head.append(row)
+        if len(head) > HEADER_SEARCH_ROWS:
+            break
+    return head
+
+
+def normalize_job(job_dir, header_cache=None, response_cache=None):
+    """Stage 2: rows.table -> items.table, one row group at a time
+
+    The header layout comes from the first rows: known layouts are mapped
+    locally, otherwise the model is asked once for the mapping. Only if
+    that fails are the rows sent, group by group. Item values are cleaned
+    up with the local vocabularies; the values of a group they don't know
+    are asked about in one request (answers kept in response_cache, so a
+    value is only asked about once) and kept as they are without an API
+    key. Each item records the index of its source row. Returns the number
+    of items or None; without any items no table is left behind (not even
+    an earlier one), so the stage is not done.
+    """
+    import asyncio
+
+    from header_map import HeaderMappingCache, apply_mapping, find_local_mapping, mapping_columns, map_rows_with_answer
+    from llm import DEFAULT_MODEL, normalize_rows_async, request_header_mapping
+    from providers import configured_providers, open_pool
+    from values import normalize_values, resolve_values_async, unresolved_count
+
+    if header_cache is None:
+        header_cache = HeaderMappingCache()
+    value_stats = {"unresolved": 0, "resolved": 0}
+
+    async def store_group(client, items, group):
+        unresolved = normalize_values(group)
+        if unresolved:
+            value_stats["unresolved"] += unresolved_count(unresolved)
+            if client is not None:
+                try:
+                    value_stats["resolved"] += await resolve_values_async(group, unresolved, client, DEFAULT_MODEL,
+                                                                          response_cache)
+                except Exception as e:
+                    print(f"⚠️  Value normalization request failed ({e}), values kept as they are")
+        for item in group:
+            items.append(item)
+
+    async def map_locally(client, rows, items, found):
+        header_row, header_texts, mapping = found
+        group = []
+        for idx, row in enumerate(rows.iter_rows()):
+            mapped = apply_mapping([row], -1, header_texts, mapping) if idx > header_row else []
+            if mapped:
+                group.append(dict(mapped[0], **{SOURCE_ROW_KEY: idx}))
+                if len(group) >= ROW_GROUP_SIZE:
+                    await store_group(client, items, group)
+                    group = []
+        await store_group(client, items, group)
+        return True
+
+    async def send_groups(client, rows, items):
+        start, group = 0, []
+        for row in rows.iter_rows():
+            group.append(row)
+            if len(group) >= ROW_GROUP_SIZE:
+                if not await send(client, items, start, group):
+                    return False
+                start, group = start + len(group), []
+        return await send(client, items, start, group) if group else True
+
+    async def send(client, items, start, group):
+        results = await normalize_rows_async(group, client, model=DEFAULT_MODEL, cache=response_cache)
+        if results is None:
+            return False
+        await store_group(client, items, [dict(result, **{SOURCE_ROW_KEY: idx})
+                                          for idx, result in enumerate(results, start)])
+        return True
+
+    async def run(rows, items, found):
+        client = open_pool()
+        try:
+            if found is not None:
+                return await map_locally(client, rows, items, found)
+            return await send_groups(client, rows, items)
+        finally:
+            if client is not None:
+                await client.close()
+
+    rows = TableReader(os.path.join(job_dir, ROWS_TABLE))
+    try:
+        head = head_rows(rows)
+        found = find_local_mapping(head, header_cache)
+        if found is None:
+            if not configured_providers():
+                print("❌ DASHSCOPE_API_KEY (or ARK_API_KEY) environment variable not set")
+                return None
+            try:
+                print("🤖 Asking Qwen for the column mapping...")
+                answer = request_header_mapping(mapping_columns(head), model=DEFAULT_MODEL)
+                if map_rows_with_answer(head, header_cache, answer) is not None:
+                    found = find_local_mapping(head, header_cache)
+                else:
+                    print("⚠️  No usable column mapping, sending all rows")
+            except Exception as e:
+                print(f"⚠️  Column mapping request failed ({e}), sending all rows")
+
+        items = TableWriter(os.path.join(job_dir, ITEMS_TABLE))
+        try:
+            ok = asyncio.run(run(rows, items, found))
+        except BaseException:
+            items.abort()
+            raise
+    finally:
+        rows.close()
+    if value_stats["unresolved"] and configured_providers():
+        print(f"✅ {value_stats['resolved']} of {value_stats['unresolved']} unrecognised values normalized with Qwen")
+    elif value_stats["unresolved"]:
+        print(f"⚠️  {value_stats['unresolved']} values not recognised, kept as they are")
+    if not ok or not len(items):
+        items.abort()
+        if os.path.exists(items.path):
+            os.remove(items.path)  # From an earlier input, must not count as this one's output
+        return None if not ok else 0
+    items.close(meta={"mapping": "local" if found is not None else "llm"})
+    return items.rows
+
+
+def generate_from_job(job_dir, output_filename, thumbnails=None, pricing=None):
+    """Stage 3: stream items.table into the quote, images straight from the blob store
+
+    Prices come from the pricing columns alone, read without decoding
+    the rest of the table. Returns the quote path, or None if there are no
+    items to quote.
+    """
+    from pricing import PRICE_FIELDS, PricingEngine
+    from quote_writer import write_quote_excel
+
+    items = TableReader(os.path.join(job_dir, ITEMS_TABLE))
+    blobs = BlobReader(job_dir)
+    try:
+        if not items.rows:
+            print("❌ No items to quote")
+            return None
+        if pricing is None:
+            pricing = PricingEngine()
+        prices = pricing.price_columns(*(items.column(field) for field in PRICE_FIELDS))
+        return write_quote_excel(items.iter_rows(), output_filename, images=blobs, thumbnails=thumbnails,
+                                 images_dir=job_dir, prices=prices)
+    finally:
+        blobs.close()
+        items.close()
+
+
+def run_job(input_file, job_dir, output_filename, start=None, merge_similar=False):
+    """Run the stages that are not done yet (or all from `start` on), returns the quote path or None"""
+    from images import ThumbnailCache
+    from llm_cache import ResponseCache
+
+    rerun = False
+    for stage in STAGES:
+        rerun = rerun or stage == start or not stage_done(job_dir, stage, input_file, merge_similar)
+        if not rerun:
+            print(f"⏭️  {stage}: reusing {job_dir}")
+            continue
+
+        print(f"\n=== {stage.upper()} ===")
+        if stage == "extract":
+            count = extract_to_job(input_file, job_dir, merge_similar=merge_similar)
+            if not count:
+                print("❌ No data extracted from Excel file")
+                return None
+        elif stage == "normalize":
+            response_cache = ResponseCache()
+            try:
+                count = normalize_job(job_dir, response_cache=response_cache)
+            finally:
+                response_cache.close()
+            if not count:
+                print("❌ Failed to process data with Qwen API")
+                return None
+            print(f"✅ {count} items normalized ({response_cache.summary()})")
+        else:
+            return generate_from_job(job_dir, output_filename, thumbnails=ThumbnailCache())
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    options = {}
+    for arg in sys.argv[1:]:
+        if arg.startswith("--"):
+            key, _, value = arg[2:].partition("=")
+            options[key] = value
+    if not args or options.get("from", STAGES[0]) not in STAGES:
+        print("Usage: python artifact.py <input_excel_file> [output.xlsx] [--job=DIR] [--from=extract|normalize|generate]"
+              " [--merge-similar-images]")
+        print("  Keeps rows, images and normalized items in DIR (default <input>.job/); a rerun")
+        print("  repeats only the stages whose output is missing, or everything from --from on;")
+        print("  --merge-similar-images stores near-duplicate pictures (resized, re-exported) once")
+        sys.exit(1)
+
+    input_file = args[0]
+    output_filename = args[1] if len(args) > 1 else "手板报价单.xlsx"
+    if not os.path.exists(input_file):
+        print(f"❌ Input file not found: {input_file}")
+        sys.exit(1)
+    job_dir = options.get("job") or f"{os.path.splitext(input_file)[0]}.job"
+
+    quote_file = run_job(input_file, job_dir, output_filename, start=options.get("from"),
+                         merge_similar="merge-similar-images" in options)
+    if quote_file is None:
+        sys.exit(1)
+    print(f"\n🎉 SUCCESS! 📝 Quote generated: {quote_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Image-to-row assignment
+Scores only the rows near each image anchor and picks the best overall matching
+"""
+
+import heapq
+from bisect import bisect_left
+
+# Rows further than this from an image span always score 0
+PROXIMITY_ROWS = 2
+
+
+def calculate_image_row_score(img_from_row, img_to_row, data_row):
+    """Calculate how well an image matches a data row"""
+
+    # Ensure img_to_row is at least img_from_row
+    img_to_row = max(img_to_row, img_from_row)
+
+    # Calculate overlap between image span and data row
+    overlap_start = max(img_from_row, data_row)
+    overlap_end = min(img_to_row, data_row + 1)
+    overlap = max(0, overlap_end - overlap_start)
+
+    if overlap <= 0:
+        # No overlap, but calculate proximity penalty
+        if data_row < img_from_row:
+            distance = img_from_row - data_row
+        else:
+            distance = data_row - img_to_row
+
+        # Proximity score (decreases with distance)
+        if distance <= 2:
+            return max(0, 2 - distance)  # Score 2 for adjacent, 1 for 1 row away
+        else:
+            return 0
+
+    # Base score from overlap amount
+    overlap_score = overlap * 10
+
+    # Bonus for perfect alignment (image starts exactly at data row)
+    alignment_bonus = 3 if img_from_row == data_row else 0
+
+    # Bonus for image center being close to row center
+    img_center = (img_from_row + img_to_row) / 2
+    row_center = data_row + 0.5
+    center_distance = abs(img_center - row_center)
+    center_bonus = max(0, 2 - center_distance)  # Up to 2 points for perfect centering
+
+    # Penalty for very large images (they might span multiple rows incorrectly)
+    img_height = img_to_row - img_from_row
+    size_penalty = min(2, max(0, img_height - 3))  # Penalty for images > 3 rows tall
+
+    total_score = overlap_score + alignment_bonus + center_bonus - size_penalty
+
+    return max(0, total_score)
+
+
+def candidate_rows(from_row, to_row, max_data_row):
+    """Data rows inside the proximity window of an image span"""
+    first = max(2, from_row - PROXIMITY_ROWS)
+    last = min(max_data_row, max(from_row, to_row) + PROXIMITY_ROWS)
+    return range(first, last + 1)
+
+
+class FreeRows:
+    """Sorted set of unassigned rows with nearest-row lookup"""
+
+    def __init__(self, rows):
+        self.rows = sorted(rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def take_closest(self, row):
+        """Remove and return the free row closest to row (lower row wins ties)"""
+        pos = bisect_left(self.rows, row)
+        if pos == len(self.rows) or (pos > 0 and row - self.rows[pos - 1] <= self.rows[pos] - row):
+            pos -= 1
+        return self.rows.pop(pos)
+
+
+def match_images(image_candidates):
+    """Maximum-score matching of images to rows
+
+    image_candidates[i] is a list of (row, score) pairs. Every image may also
+    stay unmatched at score 0. Images are added one at a time and each one
+    runs a Dijkstra search for the cheapest augmenting path (Hungarian method
+    with potentials on the sparse candidate graph). The search stops at the
+    first free row, so on real sheets it only touches a few nearby rows.
+
+    Returns {row: image_index} for the matched images.
+    """
+    top = max((score for candidates in image_candidates for _, score in candidates), default=0)
+
+    # Costs are top - score so they stay non-negative; row -(i+1) is image i's
+    # private "unmatched" slot at cost top (score 0)
+    edges = [
+        [(row, top - score) for row, score in candidates] + [(-(i + 1), top)]
+        for i, candidates in enumerate(image_candidates)
+    ]
+    img_potential = [0] * len(edges)
+    row_potential = {}
+    row_owner = {}
+    img_row = {}
+
+    for start in range(len(edges)):
+        dist = {}
+        reached_from = {}
+        done_rows = {}
+        done_imgs = {start: 0}
+        heap = []
+
+        def relax(img, img_dist):
+            for row, cost in edges[img]:
+                new_dist = img_dist + cost - img_potential[img] - row_potential.get(row, 0)
+                if new_dist < dist.get(row, float("inf")):
+                    dist[row] = new_dist
+                    reached_from[row] = img
+                    heapq.heappush(heap, (new_dist, row))
+
+        relax(start, 0)
+        while True:
+            row_dist, row = heapq.heappop(heap)
+            if row in done_rows or row_dist > dist[row]:
+                continue
+            done_rows[row] = row_dist
+            owner = row_owner.get(row)
+            if owner is None:
+                break
+            # The matched edge has zero reduced cost
+            done_imgs[owner] = row_dist
+            relax(owner, row_dist)
+
+        # Keep reduced costs non-negative for the next search
+        for img, img_dist in done_imgs.items():
+            img_potential[img] += row_dist - img_dist
+        for done_row, done_dist in done_rows.items():
+            row_potential[done_row] = row_potential.get(done_row, 0) - (row_dist - done_dist)
+
+        # Flip the augmenting path
+        while True:
+            img = reached_from[row]
+            previous_row = img_row.get(img)
+            img_row[img] = row
+            row_owner[row] = img
+            if img == start:
+                break
+            row = previous_row
+
+    return {row: img for img, row in img_row.items() if row > 0}
+
+
+def assign_images_to_rows(image_spans, max_data_row):
+    """Assign images to data rows, returns {row: image_index}
+
+    image_spans is a list of 1-based (from_row, to_row) anchor spans.
+    """
+    # First pass: score each image against the rows in its proximity window
+    image_candidates = []
+    for from_row, to_row in image_spans:
+        candidates = []
+        for data_row in candidate_rows(from_row, to_row, max_data_row):
+            score = calculate_image_row_score(from_row, to_row, data_row)
+            if score > 0:  # Only consider positive scores
+                candidates.append((data_row, score))
+        image_candidates.append(candidates)
+
+    # Second pass: best overall matching instead of first-come-first-served
+    images_by_row = match_images(image_candidates)
+    for row, img_idx in sorted(images_by_row.items()):
+        score = next(s for r, s in image_candidates[img_idx] if r == row)
+        print(f"Assigned image {img_idx} to row {row} (score: {score:.1f})")
+
+    # Third pass: handle any remaining unassigned images
+    assigned_images = set(images_by_row.values())
+    unassigned_images = [i for i in range(len(image_spans)) if i not in assigned_images]
+    free_rows = FreeRows(row for row in range(2, max_data_row + 1) if row not in images_by_row)
+
+    if unassigned_images and free_rows:
+        print(f"Assigning remaining {len(unassigned_images)} images to {len(free_rows)} rows")
+
+        # Simple proximity-based assignment for remainders
+        for img_idx in unassigned_images:
+            if not free_rows:
+                break
+            images_by_row[free_rows.take_closest(image_spans[img_idx][0])] = img_idx
+
+    return images_by_row
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Batch quote generation
+Runs a whole directory (or glob) of customer workbooks through the pipeline
+"""
+
+import asyncio
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from header_map import HeaderMappingCache, map_rows_locally
+from images import ThumbnailCache
+from llm import DEFAULT_CONCURRENCY, DEFAULT_MODEL, DEFAULT_REQUESTS_PER_SECOND, RateLimiter
+from llm_cache import ResponseCache
+from pricing import PricingEngine
+from providers import open_pool
+from unified import extract_customer_excel, generate_quote_excel, process_with_client
+from values import normalize_values, resolve_values_async
+
+DEFAULT_OUTPUT_DIR = "batch_output"
+QUOTE_FILENAME = "手板报价单.xlsx"
+REPORT_FILENAME = "batch_report.json"
+SHARED_IMAGES_DIR = "shared_images"  # Under the output directory, one copy of each distinct picture for all jobs
+
+
+def collect_inputs(patterns):
+    """Workbook paths for directories and glob patterns, in a stable order
+
+    Excel lock files (~$name.xlsx) are skipped.
+    """
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = glob.glob(os.path.join(pattern, "*.xlsx"))
+        else:
+            matches = glob.glob(pattern)
+        for path in sorted(matches):
+            if os.path.basename(path).startswith("~$") or not os.path.isfile(path):
+                continue
+            if path not in files:
+                files.append(path)
+    return files
+
+
+def job_dirs(files, output_dir):
+    """One output directory per input file, named after it and never shared"""
+    dirs = {}
+    used = set()
+    for path in files:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        name, n = stem, 2
+        while name in used:
+            name = f"{stem}_{n}"
+            n += 1
+        used.add(name)
+        dirs[path] = os.path.join(output_dir, name)
+    return dirs
+
+
+def extract_job(input_file, job_dir, streaming=False, merge_similar=False, shared_images=None):
+    """Pool worker: extract one workbook into job_dir/extracted_images
+
+    Pictures already stored in shared_images by another job are hard-linked
+    instead of written again.
+    """
+    return extract_customer_excel(input_file, os.path.join(job_dir, "extracted_images"), streaming=streaming,
+                                  merge_similar=merge_similar, shared_images=shared_images)
+
+
+def generate_job(processed_data, job_dir, prices=None):
+    """Pool worker: write job_dir's quote, returns (path, thumbnail hits, misses)"""
+    thumbnails = ThumbnailCache()
+    quote_file = generate_quote_excel(
+        processed_data,
+        os.path.join(job_dir, QUOTE_FILENAME),
+        thumbnails=thumbnails,
+        write_only=True,
+        images_dir=os.path.join(job_dir, "extracted_images"),
+        prices=prices,
+    )
+    return quote_file, thumbnails.hits, thumbnails.misses
+
+
+async def run_batch_async(files, output_dir=DEFAULT_OUTPUT_DIR, workers=None, streaming=False,
+                          concurrency=DEFAULT_CONCURRENCY, requests_per_second=DEFAULT_REQUESTS_PER_SECOND,
+                          merge_similar=False):
+    """Process files concurrently, returns one status dict per file
+
+    Extraction and quote generation run in a process pool; normalization
+    runs here, with every file's LLM calls going through one ProviderPool
+    and sharing one concurrency limit and rate limit. The header
+    mapping and response caches are shared too, so a layout learned from
+    one file helps the rest. Items are priced here from one PricingEngine.
+    Each distinct picture is stored once in output_dir/shared_images and
+    hard-linked into the jobs showing it.
+    """
+    loop = asyncio.get_running_loop()
+    dirs = job_dirs(files, output_dir)
+    header_cache = HeaderMappingCache()
+    response_cache = ResponseCache()
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = RateLimiter(requests_per_second)
+    pricing = PricingEngine()
+
+    client = open_pool()
+
+    async def job(pool, input_file):
+        status = {"input": input_file, "output_dir": dirs[input_file], "status": "failed",
+                  "stage": "extract", "rows": 0, "items": 0}
+        started = time.perf_counter()
+        try:
+            os.makedirs(dirs[input_file], exist_ok=True)
+            extracted_data = await loop.run_in_executor(
+                pool, partial(extract_job, input_file, dirs[input_file], streaming, merge_similar,
+                              os.path.join(output_dir, SHARED_IMAGES_DIR))
+            )
+            if not extracted_data:
+                status["error"] = "No data extracted"
+                return status
+            status["rows"] = len(extracted_data)
+
+            status["stage"] = "normalize"
+            processed_data = map_rows_locally(extracted_data, header_cache)
+            if processed_data is None:
+                if client is None:
+                    status["error"] = "DASHSCOPE_API_KEY (or ARK_API_KEY) environment variable not set"
+                    return status
+                processed_data = await process_with_client(
+                    extracted_data, client, header_cache, response_cache=response_cache,
+                    semaphore=semaphore, limiter=limiter,
+                )
+            if not processed_data:
+                status["error"] = "LLM normalization failed"
+                return status
+            status["items"] = len(processed_data)
+            unresolved = normalize_values(processed_data)
+            if unresolved and client is not None:
+                try:
+                    async with semaphore:
+                        await limiter.wait()
+                        await resolve_values_async(processed_data, unresolved, client, DEFAULT_MODEL, response_cache)
+                except Exception as e:
+                    print(f"⚠️  {input_file}: value normalization request failed ({e}), values kept as they are")
+
+            status["stage"] = "generate"
+            prices = pricing.price_items(processed_data)
+            status["priced"] = sum(price is not None for price in prices)
+            quote_file, thumb_hits, thumb_misses = await loop.run_in_executor(
+                pool, generate_job, processed_data, dirs[input_file], prices
+            )
+            status.update(status="ok", stage="done", quote=quote_file,
+                          thumbnail_hits=thumb_hits, thumbnail_misses=thumb_misses)
+        except Exception as e:
+            status["error"] = f"{type(e).__name__}: {e}"
+        finally:
+            status["seconds"] = round(time.perf_counter() - started, 2)
+            print(f"{'✅' if status['status'] == 'ok' else '❌'} {input_file} ({status['seconds']}s)")
+        return status
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return await asyncio.gather(*(job(pool, input_file) for input_file in files))
+    finally:
+        response_cache.close()
+        if client is not None:
+            await client.close()
+
+
+def write_report(results, output_dir=DEFAULT_OUTPUT_DIR):
+    """Save the per-file statuses as JSON and print a summary table"""
+    report_path = os.path.join(output_dir, REPORT_FILENAME)
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+    print("\n=== BATCH REPORT ===")
+    for result in results:
+        if result["status"] == "ok":
+            detail = f"{result['items']} items -> {result['quote']}"
+        else:
+            detail = f"failed at {result['stage']}: {result.get('error', 'unknown error')}"
+        print(f"{'✅' if result['status'] == 'ok' else '❌'} {os.path.basename(result['input'])}: "
+              f"{detail} ({result['seconds']}s)")
+    ok = sum(result["status"] == "ok" for result in results)
+    print(f"📊 {ok}/{len(results)} quotes generated, report: {report_path}")
+    return report_path
+
+
+def main():
+    """Batch entry point: python batch.py <dir or glob>... [--out DIR] [--workers N] [--stream] [--merge-similar-images]"""
+    args = sys.argv[1:]
+    output_dir = DEFAULT_OUTPUT_DIR
+    workers = None
+    streaming = False
+    merge_similar = False
+    patterns = []
+    i = 0
+    while i < len(args):
+        if args[i] == "--out" and i + 1 < len(args):
+            output_dir = args[i + 1]
+            i += 2
+        elif args[i] == "--workers" and i + 1 < len(args):
+            workers = int(args[i + 1])
+            i += 2
+        elif args[i] == "--stream":
+            streaming = True
+            i += 1
+        elif args[i] == "--merge-similar-images":
+            merge_similar = True
+            i += 1
+        else:
+            patterns.append(args[i])
+            i += 1
+
+    if not patterns:
+        print("Usage: python batch.py <directory or glob>... [--out DIR] [--workers N] [--stream] "
+              "[--merge-similar-images]")
+        print("Example: python batch.py data/ --out quotes")
+        sys.exit(1)
+
+    files = collect_inputs(patterns)
+    if not files:
+        print(f"❌ No .xlsx files found in: {' '.join(patterns)}")
+        sys.exit(1)
+
+    print(f"🚀 Batch run: {len(files)} workbooks -> {output_dir}/")
+    os.makedirs(output_dir, exist_ok=True)
+    results = asyncio.run(run_batch_async(files, output_dir, workers=workers, streaming=streaming,
+                                          merge_similar=merge_similar))
+    write_report(results, output_dir)
+    if not all(result["status"] == "ok" for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1004 @@
+#!/usr/bin/env python3
+"""
+Benchmark harness
+Times the pipeline stages on synthetic customer workbooks and compares against stored baselines
+"""
+
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BENCH_DIR, "bench_data")
+SAMPLES_DIR = os.path.join(BENCH_DIR, "data")  # Real customer workbooks
+BASELINE_FILE = os.path.join(BENCH_DIR, "bench_baseline.json")
+OUTPUT_FILE = os.path.join(BENCH_DIR, "bench_output.txt")
+
+DEFAULT_SCALES = [100, 1000, 10000]
+STAGES = ["extract", "extract_stream", "assign", "generate", "main"]
+
+KNOWN_HEADERS = ["序号", "零件名称", "数量", "材质", "表面处理", "备注"]
+UNKNOWN_HEADERS = ["Ref", "Descr", "Pcs", "Stock", "Treatment", "Memo"]  # Not in the alias table, needs the LLM
+MATERIALS = ["铝合金6061", "不锈钢304", "ABS", "POM", "树脂", "PC"]
+FINISHES = ["喷砂", "阳极氧化", "无", "喷漆+丝印", "120#打磨"]
+
+ROW_HEIGHT_EMU = 190500  # Default 15pt row
+
+# --providers: stub endpoints for the primary provider (slow tail, some errors) and a steady alternate
+PRIMARY_FAULTS = {"delay": 0.1, "slow_rate": 0.1, "slow_delay": 2.0, "error_rate": 0.05}
+ALTERNATE_FAULTS = {"delay": 0.2}
+DOWN_FAULTS = {"error_rate": 1.0}
+PROVIDER_ROWS = 400
+PROVIDER_CHUNK_TOKENS = 120  # Small chunks, so a run makes enough calls for the p95 to settle
+
+# --requote: parts of a quoted sheet (the two 垫片 rows are identical) with the unit prices entered by hand,
+# and the part inserted in the middle of its revision
+REQUOTE_PARTS = [
+    ("支架", 2, "铝合金6061", "阳极氧化", ""),
+    ("外壳", 1, "ABS", "喷砂", "注意公差"),
+    ("垫片", 10, "POM", "无", ""),
+    ("垫片", 10, "POM", "无", ""),
+    ("盖板", 5, "不锈钢304", "喷砂", ""),
+]
+REQUOTE_PRICES = [120.5, 80.0, 3.2, 3.6, 45.0]
+REQUOTE_INSERTED = (2, ("新零件", 3, "PC", "喷漆+丝印", ""))
+REQUOTE_IMAGES = (0, 4)  # Parts with a picture
+
+# --dedup: pictures of REQUOTE_PARTS, by part: a render, the same render resized, another render, the first again
+DEDUP_SIZES = {0: 200, 1: 150, 2: 200, 3: 200}
+DEDUP_SOURCES = {0: 0, 1: 0, 2: 2, 3: 0}  # Part whose render each picture is
+DEDUP_JOBS = 2  # Copies of the workbook quoted by one batch run
+
+# --values: a sheet whose material, finish and quantity cells the vocabularies can't read, quoted next to
+# data/*.xlsx by the pipelined, sequential and artifact runs against a stub that marks the values it normalized
+VALUES_SPELLINGS = [(2, "航空铝ZX-9", "镜面抛光加xx"), ("两件", "客供料", "按图纸"), (1, "ABS", "喷砂"),
+                    ("一打", "航空铝ZX-9", "按图纸")]
+VALUES_ROWS = 40
+STUB_VALUE_MARK = "(stub)"
+QUOTE_FILE = "手板报价单.xlsx"
+
+# --assign: random small layouts compared against the old greedy passes and a brute-force optimum,
+# then assignment time per image at growing sizes (near-linear: the largest may cost at most
+# ASSIGN_SCALING_LIMIT times the smallest per image)
+ASSIGN_LAYOUTS = 3000
+ASSIGN_SCALES = [1000, 4000, 16000, 32000]
+ASSIGN_SCALING_LIMIT = 2.0
+
+# Usage-only invocations (no work done) -> budget in ms on top of a bare interpreter start
+STARTUP_BUDGETS_MS = {
+    "cli.py --help": 50,
+    "cli.py extract": 50,
+    "unified.py": 200,
+    "reader.py": 150,
+    "batch.py": 250,
+}
+
+
+def workbook_path(rows, images, image_size, jitter, anchors, merged_header, headers, seed):
+    name = f"bench_{rows}r_{images}i_{image_size}px_j{jitter}_{anchors}_{'m' if merged_header else 'f'}_{headers}_{seed}.xlsx"
+    return os.path.join(DATA_DIR, name)
+
+
+def make_image(idx, size, rng):
+    """Distinct PNG per part: a colored tile with an off-center block"""
+    from PIL import Image as PILImage, ImageDraw
+
+    img = PILImage.new("RGB", (size, size), (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    draw = ImageDraw.Draw(img)
+    x, y = rng.randrange(size // 2), rng.randrange(size // 2)
+    draw.rectangle([x, y, x + size // 3, y + size // 3], fill=(idx % 256, (idx // 256) % 256, 128))
+    fp = BytesIO()
+    img.save(fp, format="png")
+    return fp.getvalue()
+
+
+def make_workbook(rows=100, images=None, image_size=200, jitter=0.3, anchors="mixed", merged_header=True,
+                  headers="known", seed=0):
+    """Generate (or reuse) a synthetic customer sheet, returns its path
+
+    images defaults to one per row, spread over the rows. jitter moves each
+    anchor by up to that many rows; anchors is "one", "two" or "mixed"
+    (oneCellAnchor / twoCellAnchor). merged_header puts a merged title row
+    above the column titles like most real RFQ sheets.
+    """
+    from openpyxl import Workbook
+    from openpyxl.drawing.image import Image as XLImage
+    from openpyxl.drawing.spreadsheet_drawing import AnchorMarker, OneCellAnchor, TwoCellAnchor
+    from openpyxl.drawing.xdr import XDRPositiveSize2D
+    from openpyxl.utils.units import pixels_to_EMU
+
+    images = rows if images is None else images
+    path = workbook_path(rows, images, image_size, jitter, anchors, merged_header, headers, seed)
+    if os.path.exists(path):
+        return path
+    os.makedirs(DATA_DIR, exist_ok=True)
+    rng = random.Random(seed)
+
+    wb = Workbook()
+    ws = wb.active
+    titles = KNOWN_HEADERS if headers == "known" else UNKNOWN_HEADERS
+    if merged_header:
+        ws.append(["XX项目 手板加工清单"])
+        ws.merge_cells(start_row=1, start_column=1, end_row=1, end_column=len(titles))
+    ws.append(titles)
+    first_data_row = ws.max_row + 1
+    for idx in range(rows):
+        ws.append([
+            idx + 1,
+            f"零件-{idx + 1:05d}",
+            rng.choice([1, 1, 2, 5, 10]),
+            rng.choice(MATERIALS),
+            rng.choice(FINISHES),
+            "" if rng.random() < 0.7 else "注意公差",
+        ])
+
+    display_px = min(image_size, 60)
+    span_rows = max(1, display_px // 20)
+    for idx, data_idx in enumerate(sorted(rng.sample(range(rows), min(images, rows)))):
+        img = XLImage(BytesIO(make_image(idx, image_size, rng)))
+        img.width = img.height = display_px
+        offset = rng.uniform(-jitter, jitter)
+        row0 = max(0, first_data_row - 1 + data_idx + int(offset // 1))  # 0-based marker row
+        row_off = int((offset % 1) * ROW_HEIGHT_EMU)
+        marker = AnchorMarker(col=6, colOff=0, row=row0, rowOff=row_off)
+        kind = anchors if anchors != "mixed" else rng.choice(["one", "two"])
+        if kind == "one":
+            size = XDRPositiveSize2D(pixels_to_EMU(display_px), pixels_to_EMU(display_px))
+            img.anchor = OneCellAnchor(_from=marker, ext=size)
+        else:
+            img.anchor = TwoCellAnchor(
+                _from=marker, to=AnchorMarker(col=7, colOff=0, row=row0 + span_rows, rowOff=row_off)
+            )
+        ws.add_image(img)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    wb.save(tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Deterministic OpenAI-compatible chat endpoint
+
+    Header mapping requests get a positional mapping, row requests are
+    echoed back cell by cell in the wire format; responses stream in a few
+    pieces when asked. Subclasses made by start_stub() add latency (a base
+    delay plus a slow tail) and 500 errors.
+    """
+
+    delay = 0.0
+    slow_rate = 0.0
+    slow_delay = 0.0
+    error_rate = 0.0
+    rng = random.Random(0)
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        try:
+            self.answer()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The client gave up on this call (deadline or a hedge won)
+
+    def answer(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        prompt = body["messages"][-1]["content"]
+        if self.rng.random() < self.error_rate:
+            payload = b'{"error": {"message": "injected failure"}}'
+            self.send_response(500)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+        time.sleep(self.delay + (self.slow_delay if self.rng.random() < self.slow_rate else 0.0))
+        if "Columns:" in prompt:
+            columns = json.loads(prompt.split("Columns:", 1)[1])
+            fields = ["Serial_Number", "Part_Name", "Quantity", "Material", "Surface_Finish", "Notes"]
+            header_row = -1 if set(columns) & set(UNKNOWN_HEADERS) else 0  # Titles in the keys or the first row
+            content = json.dumps({"header_row": header_row, "mapping": dict(zip(columns, fields))})
+        elif "Values:" in prompt:
+            values = json.loads(prompt.split("Values:", 1)[1])
+            content = json.dumps({field: {str(value): len(str(value)) if field == "Quantity" else f"{value}{STUB_VALUE_MARK}"
+                                          for value in field_values}
+                                  for field, field_values in values.items()}, ensure_ascii=False)
+        else:
+            rows = json.loads(prompt.split("Input rows:", 1)[1])
+            results = []
+            for row_id, *cells in rows:
+                values = cells + [None] * 6
+                results.append([row_id, values[0], values[1], values[2], values[3], None, values[4], values[5]])
+            content = json.dumps(results, ensure_ascii=False)
+
+        usage = {"prompt_tokens": len(prompt) // 3, "completion_tokens": len(content) // 3,
+                 "total_tokens": (len(prompt) + len(content)) // 3}
+        base = {"id": "bench", "created": 0, "model": body.get("model", "stub")}
+        if body.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            step = max(1, len(content) // 4)
+            for start in range(0, len(content), step):
+                event = dict(base, object="chat.completion.chunk", choices=[
+                    {"index": 0, "delta": {"content": content[start:start + step]}, "finish_reason": None}
+                ])
+                self.wfile.write(f"data: {json.dumps(event)}\n\n".encode())
+            event = dict(base, object="chat.completion.chunk", choices=[], usage=usage)
+            self.wfile.write(f"data: {json.dumps(event)}\n\ndata: [DONE]\n\n".encode())
+            return
+
+        payload = json.dumps(dict(base, object="chat.completion", usage=usage, choices=[
+            {"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+        ])).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def start_stub(seed=0, **faults):
+    """Serve StubHandler on a free local port, returns the base URL
+
+    faults sets delay, slow_rate, slow_delay and error_rate (see StubHandler).
+    """
+    handler = type("FaultyStubHandler", (StubHandler,), dict(faults, rng=random.Random(seed))) if faults else StubHandler
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def peak_rss_mb():
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def run_stage(stage, workbook, workdir):
+    """Run one stage in this process (a fresh child per measurement), returns its metrics"""
+    sys.path.insert(0, BENCH_DIR)
+    os.chdir(workdir)
+    from assign import assign_images_to_rows
+    from header_map import HeaderMappingCache, map_rows_locally
+    from images import ThumbnailCache
+    from unified import extract_customer_excel, generate_quote_excel
+    from xlsx_stream import iter_image_anchors, sheet_parts
+    import unified
+    import zipfile
+
+    metrics = {}
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        if stage == "assign":
+            import openpyxl
+
+            wb = openpyxl.load_workbook(workbook, read_only=True)
+            max_row = wb.active.max_row
+            title = wb.active.title
+            wb.close()
+            with zipfile.ZipFile(workbook) as zf:
+                spans = [(a.from_row, a.to_row) for a in iter_image_anchors(zf, dict(sheet_parts(zf))[title])]
+            work = lambda: metrics.update(images=len(spans), assigned=len(assign_images_to_rows(spans, max_row)))
+        elif stage in ("extract", "extract_stream"):
+            def work():
+                rows = extract_customer_excel(workbook, "extracted_images", streaming=stage == "extract_stream")
+                metrics.update(rows=len(rows))
+        elif stage == "generate":
+            images = {}
+            rows = extract_customer_excel(workbook, "extracted_images", streaming=True, images=images)
+            processed = map_rows_locally(rows, HeaderMappingCache())
+            if processed is None:
+                raise SystemExit("generate needs workbooks with known headers")
+            images.clear()  # Read back from disk like a normal run
+            def work():
+                generate_quote_excel(processed, "quote.xlsx", thumbnails=ThumbnailCache(), write_only=True)
+                metrics.update(items=len(processed))
+        elif stage == "main":
+            os.environ["DASHSCOPE_API_KEY"] = "bench"
+            os.environ["DASHSCOPE_BASE_URL"] = start_stub()
+            def work():
+                sys.argv = ["unified.py", workbook]
+                try:
+                    unified.main()
+                except SystemExit as e:
+                    if e.code:
+                        raise RuntimeError(f"main() exited with {e.code}")
+        else:
+            raise ValueError(f"Unknown stage: {stage}")
+
+        rss_before = peak_rss_mb()
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        work()
+        metrics.update(
+            wall_s=round(time.perf_counter() - start, 4),
+            cpu_s=round(time.process_time() - cpu_start, 4),
+            peak_rss_mb=round(peak_rss_mb(), 1),
+            rss_growth_mb=round(peak_rss_mb() - rss_before, 1),
+        )
+    return metrics
+
+
+def measure(stage, workbook, repeat=1):
+    """Best of repeat runs of a stage, each in a fresh process and scratch directory"""
+    best = None
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory(prefix="bench_") as workdir:
+            result = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--stage", stage, os.path.abspath(workbook), workdir],
+                capture_output=True, text=True,
+            )
+        if result.returncode != 0:
+            return {"error": (result.stderr.strip().splitlines() or ["failed"])[-1]}
+        metrics = json.loads(result.stdout.strip().splitlines()[-1])
+        if best is None or metrics["wall_s"] < best["wall_s"]:
+            best = metrics
+    return best
+
+
+def measure_startup(repeat=7):
+    """Median startup overhead of each STARTUP_BUDGETS_MS command, in ms
+
+    Each command runs in a fresh interpreter and exits after printing its
+    usage, so the time is almost all imports; a bare `python -c pass` is
+    subtracted.
+    """
+    def median_ms(argv):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, *argv], cwd=BENCH_DIR, capture_output=True)
+            times.append(time.perf_counter() - start)
+        return sorted(times)[len(times) // 2] * 1000
+
+    bare = median_ms(["-c", "pass"])
+    return {command: round(median_ms(command.split()) - bare, 1) for command in STARTUP_BUDGETS_MS}
+
+
+def startup_lines(startup):
+    lines = []
+    for command, overhead in startup.items():
+        budget = STARTUP_BUDGETS_MS[command]
+        status = "ok" if overhead <= budget else "OVER BUDGET"
+        lines.append(f"startup  {command:<16} {overhead:>7.1f} ms  (budget {budget} ms)  {status}")
+    return lines
+
+
+def token_counts(path):
+    """Estimated tokens a workbook's rows cost as the JSON objects sent before and in the wire format
+
+    Input is every extracted row; output is the answer for each item of a
+    local mapping (None if the layout isn't known locally). Answers are
+    counted with JSON's default separators, since the model picks its own.
+    """
+    from header_map import HeaderMappingCache, map_rows_locally
+    from llm import ROW_KEY, WIRE_FIELDS, dumps_wire, estimate_tokens, wire_columns, wire_row
+    from unified import extract_customer_excel
+
+    with tempfile.TemporaryDirectory() as workdir, redirect_stdout(open(os.devnull, "w")):
+        rows = extract_customer_excel(path, workdir)
+        items = map_rows_locally(rows, HeaderMappingCache(os.path.join(workdir, "header_mappings.json")))
+    keyed = [dict(row, **{ROW_KEY: idx}) for idx, row in enumerate(rows)]
+    columns = wire_columns(keyed)
+    counts = {
+        "rows": len(rows),
+        "json_in": estimate_tokens(json.dumps(keyed, ensure_ascii=False, default=str)),
+        "wire_in": estimate_tokens(dumps_wire(columns) + "\n" + ",\n".join(dumps_wire(wire_row(row, columns))
+                                                                       for row in keyed)),
+        "json_out": None,
+        "wire_out": None,
+    }
+    if items is not None:
+        counts["json_out"] = estimate_tokens(json.dumps([dict(item, **{ROW_KEY: idx}) for idx, item in enumerate(items)],
+                                                        ensure_ascii=False, default=str))
+        counts["wire_out"] = estimate_tokens(json.dumps([[idx, *(item.get(field) for field in WIRE_FIELDS)]
+                                                         for idx, item in enumerate(items)],
+                                                        ensure_ascii=False, default=str))
+    return counts
+
+
+def token_lines(paths):
+    def saved(before, after):
+        return f"{before:>6} -> {after:>6} ({1 - after / before:6.1%} fewer)" if before else f"{'—':>32}"
+
+    lines = []
+    totals = {"json_in": 0, "wire_in": 0, "json_out": 0, "wire_out": 0}
+    for path in paths:
+        counts = token_counts(path)
+        for key in totals:
+            totals[key] += counts[key] or 0
+        lines.append(f"tokens  {os.path.basename(path)[:28]:<28} {counts['rows']:>5} rows  "
+                     f"in {saved(counts['json_in'], counts['wire_in'])}  "
+                     f"out {saved(counts['json_out'] or 0, counts['wire_out'] or 0)}")
+    lines.append(f"tokens  {'total':<28} {'':>10}  in {saved(totals['json_in'], totals['wire_in'])}  "
+                 f"out {saved(totals['json_out'], totals['wire_out'])}")
+    return lines
+
+
+def assign_legacy(image_spans, max_data_row):
+    """The greedy passes assign_images_to_rows replaced (every row scored, 20% rule for conflicts)"""
+    from assign import calculate_image_row_score
+
+    image_candidates = {}
+    for idx, (from_row, to_row) in enumerate(image_spans):
+        candidates = [(row, calculate_image_row_score(from_row, to_row, row)) for row in range(2, max_data_row + 1)]
+        image_candidates[idx] = sorted([(row, score) for row, score in candidates if score > 0],
+                                       key=lambda candidate: candidate[1], reverse=True)
+
+    images_by_row = {}
+    assigned_images = set()
+    order = sorted(image_candidates, key=lambda idx: len([c for c in image_candidates[idx] if c[1] > 5]))
+    for img_idx in order:
+        candidates = image_candidates[img_idx]
+        for row, score in candidates:
+            if row not in images_by_row:
+                images_by_row[row] = img_idx
+                assigned_images.add(img_idx)
+                break
+        else:
+            if candidates:
+                best_row, best_score = candidates[0]
+                current_img_idx = images_by_row[best_row]
+                current_candidates = image_candidates[current_img_idx]
+                current_score = next((s for r, s in current_candidates if r == best_row), 0)
+                if best_score > current_score * 1.2:
+                    relocated = False
+                    for alt_row, alt_score in current_candidates:
+                        if alt_row not in images_by_row and alt_score > current_score * 0.7:
+                            images_by_row[alt_row] = images_by_row[best_row]
+                            relocated = True
+                            break
+                    if relocated or len(current_candidates) <= 1:
+                        images_by_row[best_row] = img_idx
+                        assigned_images.add(img_idx)
+
+    unassigned_rows = set(range(2, max_data_row + 1)) - set(images_by_row)
+    for img_idx in set(range(len(image_spans))) - assigned_images:
+        if not unassigned_rows:
+            break
+        closest_row = min(unassigned_rows, key=lambda row: abs(row - image_spans[img_idx][0]))
+        images_by_row[closest_row] = img_idx
+        unassigned_rows.remove(closest_row)
+    return images_by_row
+
+
+def assignment_score(image_spans, images_by_row):
+    from assign import calculate_image_row_score
+
+    return sum(calculate_image_row_score(*image_spans[img], row) for row, img in images_by_row.items())
+
+
+def best_matching_score(image_candidates, img=0, used=frozenset()):
+    """Brute-force maximum matching score over every choice of row (or none) per image"""
+    if img == len(image_candidates):
+        return 0
+    best = best_matching_score(image_candidates, img + 1, used)
+    for row, score in image_candidates[img]:
+        if row not in used:
+            best = max(best, score + best_matching_score(image_candidates, img + 1, used | {row}))
+    return best
+
+
+def random_layout(rng, rows, images):
+    """(image spans, max data row): images anchored near their rows, some stacked, some tall"""
+    spans = []
+    for _ in range(images):
+        from_row = rng.randrange(2, rows + 2) + rng.choice([-1, 0, 0, 0, 1])
+        spans.append((max(1, from_row), max(1, from_row) + rng.choice([0, 0, 0, 1, 2, 4])))
+    return spans, rows + 1
+
+
+def assign_lines(layouts=ASSIGN_LAYOUTS):
+    """Compare assignments on random small layouts, then time growing ones; returns (ok, lines)"""
+    sys.path.insert(0, BENCH_DIR)
+    from assign import assign_images_to_rows, calculate_image_row_score, candidate_rows, match_images
+
+    rng = random.Random(0)
+    worse = better = not_optimal = 0
+    with redirect_stdout(open(os.devnull, "w")):
+        for _ in range(layouts):
+            rows = rng.randrange(2, 12)
+            spans, max_row = random_layout(rng, rows, rng.randrange(1, min(rows, 7) + 1))
+            new = assignment_score(spans, assign_images_to_rows(spans, max_row))
+            old = assignment_score(spans, assign_legacy(spans, max_row))
+            worse += new < old
+            better += new > old
+            candidates = [[(row, score) for row in candidate_rows(from_row, to_row, max_row)
+                           if (score := calculate_image_row_score(from_row, to_row, row)) > 0]
+                          for from_row, to_row in spans]
+            matched = match_images(candidates)
+            matched_score = sum(dict(candidates[img])[row] for row, img in matched.items())
+            not_optimal += abs(matched_score - best_matching_score(candidates)) > 1e-9
+    lines = [f"assign  {layouts} random layouts  {worse} scored lower than the old passes, {better} higher, "
+             f"{not_optimal} below the brute-force optimum  {'ok' if not worse and not not_optimal else 'WORSE'}"]
+
+    per_image = {}
+    for images in ASSIGN_SCALES:
+        spans, max_row = random_layout(random.Random(images), images, images)
+        best = None
+        with redirect_stdout(open(os.devnull, "w")):
+            for _ in range(3):
+                start = time.perf_counter()
+                assign_images_to_rows(spans, max_row)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+        per_image[images] = best / images
+        lines.append(f"assign  {images:>6} images  {best:8.3f}s  {best / images * 1e6:6.1f} µs/image")
+    growth = per_image[ASSIGN_SCALES[-1]] / per_image[ASSIGN_SCALES[0]]
+    scaling_ok = growth <= ASSIGN_SCALING_LIMIT
+    lines.append(f"assign  per-image time x{growth:.2f} from {ASSIGN_SCALES[0]} to {ASSIGN_SCALES[-1]} images "
+                 f"(limit x{ASSIGN_SCALING_LIMIT:g})  {'ok' if scaling_ok else 'NOT LINEAR'}")
+    return not worse and not not_optimal and scaling_ok, lines
+
+
+def requote_workbook(path, parts, images):
+    """Customer sheet with KNOWN_HEADERS and a serial number per part, images {part index: png} on their rows"""
+    from openpyxl import Workbook
+    from openpyxl.drawing.image import Image as XLImage
+
+    wb = Workbook()
+    ws = wb.active
+    ws.append(KNOWN_HEADERS)
+    for idx, part in enumerate(parts):
+        ws.append([idx + 1, *part])
+    for idx, png in images.items():
+        img = XLImage(BytesIO(png))
+        img.width = img.height = 40
+        ws.add_image(img, f"G{idx + 2}")
+    wb.save(path)
+
+
+def requote_lines():
+    """Re-quote a priced sheet after a row is inserted in the middle, every entered price must stay with its part
+
+    The insertion renumbers the serial numbers below it; the identical
+    rows must keep their own prices, in order.
+    """
+    sys.path.insert(0, BENCH_DIR)
+    import openpyxl
+
+    from quote_writer import DATA_START_ROW
+    from requote import read_quote_prices, requote
+
+    rng = random.Random(0)
+    pictures = {idx: make_image(idx, 80, rng) for idx in REQUOTE_IMAGES}
+    at, inserted = REQUOTE_INSERTED
+    revised = REQUOTE_PARTS[:at] + [inserted] + REQUOTE_PARTS[at:]
+    expected = REQUOTE_PRICES[:at] + [None] + REQUOTE_PRICES[at:]
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="bench_") as workdir:
+        os.chdir(workdir)  # Caches, images and rates stay in the scratch directory
+        try:
+            requote_workbook("v1.xlsx", REQUOTE_PARTS, pictures)
+            requote_workbook("v2.xlsx", revised, {idx + (idx >= at): png for idx, png in pictures.items()})
+            with redirect_stdout(open(os.devnull, "w")):
+                requote("v1.xlsx", "quote.xlsx")
+                wb = openpyxl.load_workbook("quote.xlsx")
+                for offset, price in enumerate(REQUOTE_PRICES):
+                    wb.worksheets[0].cell(DATA_START_ROW + offset, 7).value = price
+                wb.save("quote.xlsx")
+                requote("v2.xlsx", "quote.xlsx")
+            prices = read_quote_prices("quote.xlsx", len(revised))
+        finally:
+            os.chdir(cwd)
+    kept = sum(price == want for price, want in zip(prices, expected) if want is not None)
+    ok = prices == expected
+    return ok, [f"requote  row inserted at {at + 1}  kept {kept} of {len(REQUOTE_PRICES)} entered prices  "
+                f"{'ok' if ok else f'MISMATCH {prices} != {expected}'}"]
+
+
+def image_files(images_dir):
+    return sorted(name for name in os.listdir(images_dir) if not name.endswith(".tmp"))
+
+
+def dedup_lines():
+    """Extract a sheet with a resized copy of one picture, with and without --merge-similar-images, then batch it
+
+    Without merging each distinct file is written once (3 files); with it
+    the resized copy shares its original's file (2). A batch over copies
+    of the workbook must store each picture once for all jobs.
+    """
+    sys.path.insert(0, BENCH_DIR)
+    import asyncio
+
+    from PIL import Image
+
+    from batch import SHARED_IMAGES_DIR, run_batch_async
+    from unified import extract_customer_excel
+
+    rng = random.Random(0)
+    renders = {idx: make_image(idx, DEDUP_SIZES[idx], rng) for idx in set(DEDUP_SOURCES.values())}
+    pictures = {}
+    for idx, source in DEDUP_SOURCES.items():
+        pictures[idx] = renders[source]
+        if DEDUP_SIZES[idx] != DEDUP_SIZES[source]:
+            with Image.open(BytesIO(renders[source])) as img:
+                fp = BytesIO()
+                img.resize((DEDUP_SIZES[idx], DEDUP_SIZES[idx]), Image.LANCZOS).save(fp, format="png")
+                pictures[idx] = fp.getvalue()
+    expected = {False: len(set(pictures.values())), True: len(renders)}
+    ok, lines = True, []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="bench_") as workdir:
+        os.chdir(workdir)
+        try:
+            requote_workbook("parts.xlsx", REQUOTE_PARTS, pictures)
+            for merge_similar in (False, True):
+                for streaming in (False, True):
+                    images_dir = f"images_{merge_similar}_{streaming}"
+                    with redirect_stdout(open(os.devnull, "w")):
+                        rows = extract_customer_excel("parts.xlsx", images_dir, streaming=streaming,
+                                                      merge_similar=merge_similar)
+                    files = image_files(images_dir)
+                    shared = rows[1]["image_file"] == rows[0]["image_file"]
+                    passed = len(files) == expected[merge_similar] and shared == merge_similar
+                    ok = ok and passed
+                    lines.append(f"dedup  merge_similar={merge_similar!s:<5}  streaming={streaming!s:<5}  "
+                                 f"{len(files)} image files (want {expected[merge_similar]})  resized copy "
+                                 f"{'shares' if shared else 'has its own'} file  {'ok' if passed else 'MISMATCH'}")
+
+            inputs = []
+            for job in range(DEDUP_JOBS):
+                inputs.append(f"parts_{job}.xlsx")
+                shutil.copy("parts.xlsx", inputs[-1])
+            with redirect_stdout(open(os.devnull, "w")):
+                results = asyncio.run(run_batch_async(inputs, "batch", workers=1))
+            job_files = [os.path.join(result["output_dir"], "extracted_images", name) for result in results
+                         for name in image_files(os.path.join(result["output_dir"], "extracted_images"))]
+            stored = len({os.stat(path).st_ino for path in job_files})
+            shared_files = image_files(os.path.join("batch", SHARED_IMAGES_DIR))
+            passed = (all(result["status"] == "ok" for result in results) and stored == expected[False]
+                      and len(shared_files) == expected[False])
+            ok = ok and passed
+            lines.append(f"dedup  batch of {DEDUP_JOBS} jobs  {len(job_files)} job image files, {stored} stored "
+                         f"(want {expected[False]})  {'ok' if passed else 'MISMATCH'}")
+        finally:
+            os.chdir(cwd)
+    return ok, lines
+
+
+def quote_cells(quote_file):
+    """Every cell value of a quote's first sheet, row by row"""
+    import openpyxl
+
+    wb = openpyxl.load_workbook(quote_file, read_only=True)
+    try:
+        return [list(row) for row in wb.worksheets[0].iter_rows(values_only=True)]
+    finally:
+        wb.close()
+
+
+def values_lines():
+    """Quote data/*.xlsx and a sheet of unreadable values pipelined, sequentially and through a job artifact
+
+    All three runs go through a local stub provider, each in its own
+    scratch directory (no shared caches); their quotes must match cell for
+    cell, and the values only the model could normalize must show up in
+    every one of them.
+    """
+    import glob
+
+    runs = {  # mode -> script, arguments after the input file
+        "pipelined": ("unified.py",),
+        "sequential": ("unified.py", "--sequential"),
+        "artifact": ("artifact.py", QUOTE_FILE, "--job=job"),
+    }
+    env = dict(os.environ, DASHSCOPE_API_KEY="bench", DASHSCOPE_BASE_URL=start_stub())
+    env.pop("ARK_API_KEY", None)
+    ok, lines = True, []
+    with tempfile.TemporaryDirectory(prefix="bench_") as workdir:
+        parts = [(f"零件{idx}", *VALUES_SPELLINGS[idx % len(VALUES_SPELLINGS)], "") for idx in range(VALUES_ROWS)]
+        spellings = os.path.join(workdir, "spellings.xlsx")
+        requote_workbook(spellings, parts, {})
+        for path in [*sorted(glob.glob(os.path.join(SAMPLES_DIR, "*.xlsx"))), spellings]:
+            quotes = {}
+            for mode, (script, *args) in runs.items():
+                rundir = os.path.join(workdir, f"{len(lines)}_{mode}")
+                os.makedirs(rundir)
+                result = subprocess.run([sys.executable, os.path.join(BENCH_DIR, script), os.path.abspath(path), *args],
+                                        cwd=rundir, env=env, capture_output=True, text=True)
+                quotes[mode] = quote_cells(os.path.join(rundir, QUOTE_FILE)) if result.returncode == 0 else None
+            marked = {mode: sum(str(value).endswith(STUB_VALUE_MARK) for row in cells for value in row)
+                      if cells is not None else None for mode, cells in quotes.items()}
+            same = quotes["pipelined"] is not None and all(cells == quotes["pipelined"] for cells in quotes.values())
+            # The spellings sheet has unreadable values on every row but the 1-in-4 readable ones
+            resolved = path != spellings or marked["pipelined"] > 0
+            ok = ok and same and resolved
+            lines.append(f"values  {os.path.basename(path)[:28]:<28} {len(quotes['pipelined'] or ()):>4} quote rows  "
+                         f"model-normalized cells {'/'.join(str(marked[mode]) for mode in runs)} "
+                         f"({'/'.join(runs)})  {'ok' if same and resolved else 'MISMATCH'}")
+    return ok, lines
+
+
+def pricing_lines():
+    """Quote data/*.xlsx pipelined and sequentially with the example rates as pricing_rates.json
+
+    The customer sheets give no part volumes, so items are priced from
+    the per-piece rates; every sheet must get prices, the same count from
+    both runs.
+    """
+    sys.path.insert(0, BENCH_DIR)
+    import glob
+    import re
+
+    from pricing import DEFAULT_RATES_FILE, EXAMPLE_RATES_FILE
+
+    env = {key: value for key, value in os.environ.items() if key not in ("DASHSCOPE_API_KEY", "ARK_API_KEY")}
+    ok, lines = True, []
+    with tempfile.TemporaryDirectory(prefix="bench_") as workdir:
+        for path in sorted(glob.glob(os.path.join(SAMPLES_DIR, "*.xlsx"))):
+            counts = {}
+            for mode in ("pipelined", "sequential"):
+                rundir = os.path.join(workdir, f"{len(lines)}_{mode}")
+                os.makedirs(rundir)
+                shutil.copy(os.path.join(BENCH_DIR, EXAMPLE_RATES_FILE), os.path.join(rundir, DEFAULT_RATES_FILE))
+                result = subprocess.run([sys.executable, os.path.join(BENCH_DIR, "unified.py"), os.path.abspath(path),
+                                         *(["--sequential"] if mode == "sequential" else [])],
+                                        cwd=rundir, env=env, capture_output=True, text=True)
+                priced = re.search(r"Priced (\d+) of (\d+) items", result.stdout)
+                counts[mode] = tuple(map(int, priced.groups())) if priced and result.returncode == 0 else None
+            passed = counts["pipelined"] is not None and counts["pipelined"][0] > 0 and len(set(counts.values())) == 1
+            ok = ok and passed
+            shown = "/".join(f"{count[0]} of {count[1]}" if count else "failed" for count in counts.values())
+            lines.append(f"pricing  {os.path.basename(path)[:28]:<28} priced {shown} (pipelined/sequential)  "
+                         f"{'ok' if passed else 'MISMATCH'}")
+    return ok, lines
+
+
+def provider_run(faults, rows, deadline=5.0, hedge_after=0.5):
+    """Normalize rows through a ProviderPool over one stub per entry of faults, returns its metrics"""
+    import asyncio
+
+    from openai import AsyncOpenAI
+
+    from llm import normalize_rows_async
+    from providers import Provider, ProviderPool
+
+    durations = []
+
+    class TimedPool(ProviderPool):
+        async def run(self, request, kind="default", retries=None):
+            started = time.perf_counter()
+            try:
+                return await super().run(request, kind, retries)
+            finally:
+                durations.append(time.perf_counter() - started)
+
+    async def run():
+        pool = TimedPool([
+            Provider(name, AsyncOpenAI(api_key="bench", base_url=start_stub(seed, **fault), max_retries=0), "stub",
+                     deadline=deadline, hedge_after=hedge_after)
+            for seed, (name, fault) in enumerate(faults)
+        ])
+        async with pool:
+            started = time.perf_counter()
+            results = await normalize_rows_async(rows, pool, chunk_tokens=PROVIDER_CHUNK_TOKENS, requests_per_second=0)
+            return pool, time.perf_counter() - started, results
+
+    with redirect_stdout(open(os.devnull, "w")):
+        pool, wall, results = asyncio.run(run())
+    ordered = sorted(durations)
+
+    def quantile(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+    return {"wall_s": round(wall, 3), "complete": results is not None and len(results) == len(rows),
+            "calls": len(ordered), "p50_s": round(quantile(0.5), 3), "p95_s": round(quantile(0.95), 3),
+            "max_s": round(ordered[-1] if ordered else 0.0, 3), "pool": pool.summary()}
+
+
+def provider_lines(rows=PROVIDER_ROWS):
+    """Chunk latency with one faulty provider, hedged on a steady one, and with the primary down"""
+    data = [{"Ref": idx + 1, "Descr": f"part {idx}", "Pcs": idx % 9 + 1, "Stock": MATERIALS[idx % len(MATERIALS)],
+             "Treatment": FINISHES[idx % len(FINISHES)]} for idx in range(rows)]
+    scenarios = {
+        "single": [("primary", PRIMARY_FAULTS)],
+        "hedged": [("primary", PRIMARY_FAULTS), ("alternate", ALTERNATE_FAULTS)],
+        "primary_down": [("primary", DOWN_FAULTS), ("alternate", ALTERNATE_FAULTS)],
+    }
+    lines = []
+    for name, faults in scenarios.items():
+        metrics = provider_run(faults, data)
+        lines.append(f"providers  {name:<13} {metrics['wall_s']:>7.3f}s  {metrics['calls']:>4} calls  "
+                     f"p50 {metrics['p50_s']:.3f}s  p95 {metrics['p95_s']:.3f}s  max {metrics['max_s']:.3f}s  "
+                     f"{'ok' if metrics['complete'] else 'INCOMPLETE'}  [{metrics['pool']}]")
+    return lines
+
+
+def compare(results, baseline):
+    """Lines comparing results with the baseline's throughput and peak memory"""
+    lines = []
+    for scale, stages in results.items():
+        for stage, metrics in stages.items():
+            base = baseline.get(scale, {}).get(stage)
+            line = f"{scale:>6} rows  {stage:<15}"
+            if "error" in metrics:
+                lines.append(f"{line} ERROR {metrics['error']}")
+                continue
+            line += f" {metrics['wall_s']:>8.3f}s  {metrics['peak_rss_mb']:>7.1f} MB"
+            if base and "error" not in base:
+                speedup = base["wall_s"] / metrics["wall_s"] if metrics["wall_s"] else float("inf")
+                line += f"   {speedup:5.2f}x vs baseline ({base['wall_s']:.3f}s, {base['peak_rss_mb']:.1f} MB)"
+            lines.append(line)
+    return lines
+
+
+def main():
+    args = sys.argv[1:]
+    if args[:1] == ["--stage"]:
+        print(json.dumps(run_stage(args[1], args[2], args[3])))
+        return
+
+    options = {"rows": DEFAULT_SCALES, "stages": STAGES, "repeat": 1, "save": False, "image_size": 200,
+               "jitter": 0.3, "anchors": "mixed", "merged_header": True, "headers": "known", "startup": False,
+               "tokens": False, "files": None, "providers": False, "requote": False, "assign": False,
+               "dedup": False, "values": False, "pricing": False}
+    for arg in args:
+        key, _, value = arg.lstrip("-").partition("=")
+        if key == "rows":
+            options["rows"] = [int(n) for n in value.split(",")]
+        elif key == "stages":
+            options["stages"] = value.split(",")
+        elif key in ("repeat", "image_size"):
+            options[key] = int(value)
+        elif key == "jitter":
+            options["jitter"] = float(value)
+        elif key in ("anchors", "headers"):
+            options[key] = value
+        elif key == "flat_header":
+            options["merged_header"] = False
+        elif key in ("save", "startup", "tokens", "providers", "requote", "assign", "dedup", "values",
+                     "pricing"):
+            options[key] = True
+        elif key == "files":
+            options["files"] = value.split(",")
+        else:
+            print("Usage: python bench.py [--rows=100,1000,10000] [--stages=extract,...] [--repeat=N]")
+            print("       [--image_size=PX] [--jitter=ROWS] [--anchors=one|two|mixed] [--flat_header]")
+            print("       [--headers=known|unknown] [--save]")
+            print("       python bench.py --startup [--repeat=N]")
+            print("       python bench.py --tokens [--files=a.xlsx,b.xlsx]")
+            print("       python bench.py --providers")
+            print("       python bench.py --requote")
+            print("       python bench.py --assign")
+            print("       python bench.py --dedup")
+            print("       python bench.py --values")
+            print("       python bench.py --pricing")
+            print(f"  stages: {', '.join(STAGES)}; --save stores the results as the new baseline")
+            print("  --startup checks CLI start-up time against STARTUP_BUDGETS_MS (exit code 1 if over)")
+            print("  --tokens compares LLM row payload sizes, JSON objects vs the wire format (default: data/*.xlsx)")
+            print("  --providers times LLM calls against local stubs injecting latency and errors, with and")
+            print("              without a hedged alternate provider")
+            print("  --requote checks that entered prices survive a re-quote after a row is inserted (exit code 1")
+            print("            if not)")
+            print("  --assign compares image-to-row assignments with the old passes and a brute-force optimum on")
+            print("           random layouts and checks near-linear scaling (exit code 1 if either fails)")
+            print("  --dedup checks that exact and (with --merge-similar-images) resized copies of a picture are")
+            print("          stored once, also across the jobs of a batch (exit code 1 if not)")
+            print("  --values checks that pipelined, sequential and artifact runs quote data/*.xlsx and a sheet of")
+            print("           unreadable values identically, with the model's normalized values (exit code 1 if not)")
+            print("  --pricing checks that data/*.xlsx get unit prices from the example rates, pipelined and")
+            print("            sequentially (exit code 1 if not)")
+            sys.exit(1)
+
+    if options["assign"]:
+        ok, lines = assign_lines()
+        print("\n".join(lines))
+        with open(OUTPUT_FILE, "a", encoding="utf-8") as f:
+            f.write(f"# {time.strftime('%Y-%m-%d %H:%M:%S')} Image-to-row assignment\n" + "\n".join(lines) + "\n\n")
+        if not ok:
+            sys.exit(1)
+        return
+
+    if options["pricing"]:
+        ok, lines = pricing_lines()
+        print("\n".join(lines))
+        with open(OUTPUT_FILE, "a", encoding="utf-8") as f:
+            f.write(f"# {time.strftime('%Y-%m-%d %H:%M:%S')} Pricing from the example rates\n" + "\n".join(lines) + "\n\n")
+        if not ok:
+            sys.exit(1)
+        return
+
+    if options["values"]:
+        ok, lines = values_lines()
+        print("\n".join(lines))
+        with open(OUTPUT_FILE, "a", encoding="utf-8") as f:
+            f.write(f"# {time.strftime('%Y-%m-%d %H:%M:%S')} Value normalization across run modes\n"
+                    + "\n".join(lines) + "\n\n")
+        if not ok:
+            sys.exit(1)
+        return
+
+    if options["dedup"]:
+        ok, lines = dedup_lines()
+        print("\n".join(lines))
+        with open(OUTPUT_FILE, "a", encoding="utf-8") as f:
+            f.write(f"# {time.strftime('%Y-%m-%d %H:%M:%S')} Duplicate images\n" + "\n".join(lines) + "\n\n")
+        if not ok:
+            sys.exit(1)
+        return
+
+    if options["requote"]:
+        ok, lines = requote_lines()
+        print("\n".join(lines))
+        with open(OUTPUT_FILE, "a", encoding="utf-8") as f:
+            f.write(f"# {time.strftime('%Y-%m-%d %H:%M:%S')} Re-quote after an inserted row\n" + "\n".join(lines) + "\n\n")
+        if not ok:
+            sys.exit(1)
+        return
+
+    if options["providers"]:
+        lines = provider_lines()
+        print("\n".join(lines))
+        with open(OUTPUT_FILE, "a", encoding="utf-8") as f:
+            f.write(f"# {time.strftime('%Y-%m-%d %H:%M:%S')} LLM provider pool against fault-injecting stubs\n"
+                    + "\n".join(lines) + "\n\n")
+        return
+
+    if options["tokens"]:
+        import glob
+
+        lines = token_lines(options["files"] or sorted(glob.glob(os.path.join(SAMPLES_DIR, "*.xlsx"))))
+        print("\n".join(lines))
+        with open(OUTPUT_FILE, "a", encoding="utf-8") as f:
+            f.write(f"# {time.strftime('%Y-%m-%d %H:%M:%S')} LLM payload tokens (estimate_tokens)\n"
+                    + "\n".join(lines) + "\n\n")
+        return
+
+    if options["startup"]:
+        startup = measure_startup(max(options["repeat"], 7))
+        lines = startup_lines(startup)
+        print("\n".join(lines))
+        with open(OUTPUT_FILE, "a", encoding="utf-8") as f:
+            f.write(f"# {time.strftime('%Y-%m-%d %H:%M:%S')} {platform.platform()} Python "
+                    f"{platform.python_version()}\n" + "\n".join(lines) + "\n\n")
+        if any(overhead > STARTUP_BUDGETS_MS[command] for command, overhead in startup.items()):
+            sys.exit(1)
+        return
+
+    baseline = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE, encoding="utf-8") as f:
+            baseline = json.load(f).get("results", {})
+
+    results = {}
+    for rows in options["rows"]:
+        print(f"📦 Workbook with {rows} rows...")
+        workbook = make_workbook(rows, image_size=options["image_size"], jitter=options["jitter"],
+                                 anchors=options["anchors"], merged_header=options["merged_header"],
+                                 headers=options["headers"])
+        results[str(rows)] = {}
+        for stage in options["stages"]:
+            results[str(rows)][stage] = measure(stage, workbook, options["repeat"])
+            print("   " + compare({str(rows): {stage: results[str(rows)][stage]}}, baseline)[0].strip())
+
+    report = [f"# {time.strftime('%Y-%m-%d %H:%M:%S')} {platform.platform()} Python {platform.python_version()}"]
+    report += compare(results, baseline)
+    with open(OUTPUT_FILE, "a", encoding="utf-8") as f:
+        f.write("\n".join(report) + "\n\n")
+    print(f"📝 Results appended to {OUTPUT_FILE}")
+
+    if options["save"]:
+        merged = dict(baseline)
+        for scale, stages in results.items():
+            merged.setdefault(scale, {}).update(stages)
+        with open(BASELINE_FILE, "w", encoding="utf-8") as f:
+            json.dump({"machine": platform.platform(), "python": platform.python_version(),
+                       "options": {key: value for key, value in options.items() if key not in ("rows", "stages", "save")},
+                       "results": merged}, f, ensure_ascii=False, indent=2)
+        print(f"💾 Baseline saved to {BASELINE_FILE}")
+
+
+if __name__ == "__main__":
+    main()
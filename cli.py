@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Quote tools command line
+One entry point for every stage; each command imports only what it needs
+"""
+
+import json
+import os
+import sys
+
+QUOTE_FILENAME = "手板报价单.xlsx"
+
+USAGE = """Usage: python cli.py <command> [args...]
+
+Commands:
+  quote <input.xlsx> [--sequential] [--stream] [--sheets[=A,B]] [--merge-similar-images] [--profile] [--trace]
+                     extract, normalize and generate in one run (same as unified.py)
+  extract <input.xlsx> [--out rows.json] [--images DIR] [--stream] [--sheets all|A,B] [--workers N]
+          [--merge-similar-images]
+                     rows and images of a customer workbook (active sheet unless --sheets); with
+                     --merge-similar-images rows with resized or re-exported copies of one picture share a file
+  normalize <rows.json> [--out items.json]
+                     map extracted rows onto the quote fields (locally or with Qwen)
+  generate <items.json> [--out quote.xlsx] [--images DIR] [--rates pricing_rates.json]
+                     write the quote workbook, unit prices from the rate tables by Volume_cm3 or
+                     per piece (none without a rates file, see pricing_rates.example.json)
+  job <input.xlsx> [output.xlsx] [--job=DIR] [--from=extract|normalize|generate]
+                     resumable run through an on-disk job artifact (same as artifact.py)
+  price <items.json> [rates.json]
+                     unit price of every item from the rate tables (same as pricing.py)
+  convert-slides <deck.pptx>... [options]
+                     slide images via LibreOffice (same as reader.py)
+  batch <dir or glob>... [options]
+                     quote many workbooks at once (same as batch.py)
+"""
+
+
+def split_options(args, flags=(), options=()):
+    """(input path, {option: value}) for one input plus --flag and --option VALUE arguments"""
+    positional, values = [], {}
+    i = 0
+    while i < len(args):
+        if args[i] in flags:
+            values[args[i]] = True
+            i += 1
+        elif args[i] in options and i + 1 < len(args):
+            values[args[i]] = args[i + 1]
+            i += 2
+        elif args[i].startswith("--"):
+            raise SystemExit(f"❌ Unknown option: {args[i]}\n\n{USAGE}")
+        else:
+            positional.append(args[i])
+            i += 1
+    if len(positional) != 1:
+        raise SystemExit(USAGE)
+    return positional[0], values
+
+
+def stem_path(path, suffix):
+    """input.xlsx -> input.<suffix>, input.rows.json -> input.<suffix>"""
+    stem = os.path.splitext(path)[0]
+    if stem.endswith((".rows", ".items")):
+        stem = os.path.splitext(stem)[0]
+    return f"{stem}.{suffix}"
+
+
+def read_json(path):
+    if not os.path.exists(path):
+        raise SystemExit(f"❌ Input file not found: {path}")
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_json(path, payload):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2, default=str)
+
+
+def cmd_extract(args):
+    input_file, options = split_options(args, flags=("--stream", "--merge-similar-images"),
+                                        options=("--out", "--images", "--sheets", "--workers"))
+    if not os.path.exists(input_file):
+        raise SystemExit(f"❌ Input file not found: {input_file}")
+    from unified import extract_customer_excel
+
+    images_dir = options.get("--images", "extracted_images")
+    sheets = options.get("--sheets")
+    if sheets not in (None, "all"):
+        sheets = [name.strip() for name in sheets.split(",") if name.strip()]
+    try:
+        rows = extract_customer_excel(input_file, images_dir, streaming=options.get("--stream", False),
+                                      sheets=sheets, workers=int(options.get("--workers", 0)) or None,
+                                      merge_similar=options.get("--merge-similar-images", False))
+    except (KeyError, ValueError) as e:
+        raise SystemExit(f"❌ {e}")
+    if not rows:
+        raise SystemExit("❌ No data extracted from Excel file")
+    out = options.get("--out", stem_path(input_file, "rows.json"))
+    write_json(out, {"input": input_file, "images_dir": images_dir, "rows": rows})
+    print(f"📝 {len(rows)} rows written to {out}")
+
+
+def cmd_normalize(args):
+    rows_file, options = split_options(args, options=("--out",))
+    extracted = read_json(rows_file)
+    from llm_cache import ResponseCache
+    from unified import process_with_qwen
+
+    response_cache = ResponseCache()
+    try:
+        items = process_with_qwen(extracted["rows"], response_cache=response_cache)
+    finally:
+        response_cache.close()
+    if not items:
+        raise SystemExit("❌ Failed to process data with Qwen API")
+    out = options.get("--out", stem_path(rows_file, "items.json"))
+    write_json(out, {"input": extracted.get("input"), "images_dir": extracted.get("images_dir"), "items": items})
+    print(f"📝 {len(items)} items written to {out} (LLM response cache: {response_cache.summary()})")
+
+
+def cmd_generate(args):
+    items_file, options = split_options(args, options=("--out", "--images", "--rates"))
+    normalized = read_json(items_file)
+    from images import ThumbnailCache
+    from pricing import DEFAULT_RATES_FILE, PricingEngine
+    from unified import generate_quote_excel
+
+    images_dir = options.get("--images") or normalized.get("images_dir") or "extracted_images"
+    prices = PricingEngine(options.get("--rates", DEFAULT_RATES_FILE)).price_items(normalized["items"])
+    quote_file = generate_quote_excel(normalized["items"], options.get("--out", QUOTE_FILENAME),
+                                      thumbnails=ThumbnailCache(), write_only=True, images_dir=images_dir,
+                                      prices=prices)
+    print(f"📝 Quote generated: {quote_file} ({sum(price is not None for price in prices)} of {len(prices)} "
+          f"items priced)")
+
+
+def delegate(module_name, prog, args):
+    """Hand the arguments to an existing script's main()"""
+    import importlib
+
+    sys.argv = [prog, *args]
+    importlib.import_module(module_name).main()
+
+
+COMMANDS = {
+    "quote": lambda args: delegate("unified", "cli.py quote", args),
+    "extract": cmd_extract,
+    "normalize": cmd_normalize,
+    "generate": cmd_generate,
+    "job": lambda args: delegate("artifact", "cli.py job", args),
+    "price": lambda args: delegate("pricing", "cli.py price", args),
+    "convert-slides": lambda args: delegate("reader", "cli.py convert-slides", args),
+    "batch": lambda args: delegate("batch", "cli.py batch", args),
+}
+
+
+def main():
+    args = sys.argv[1:]
+    if not args or args[0] in ("-h", "--help", "help"):
+        print(USAGE)
+        sys.exit(0 if args else 1)
+    command, rest = args[0], args[1:]
+    if command not in COMMANDS:
+        print(f"❌ Unknown command: {command}\n")
+        print(USAGE)
+        sys.exit(1)
+    COMMANDS[command](rest)
+
+
+if __name__ == "__main__":
+    main()
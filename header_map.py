@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Header mapping layer
+Maps customer column headers onto our internal fields once per header layout
+"""
+
+import hashlib
+import json
+import os
+import re
+
+INTERNAL_FIELDS = [
+    "Serial_Number", "Part_Name", "Quantity", "Material",
+    "Machining_Process", "Surface_Finish", "Notes",
+]
+
+# Known header spellings (normalized with normalize_header) -> internal field
+HEADER_ALIASES = {
+    "Serial_Number": ["序号", "编号", "项次", "no", "item", "itemno"],
+    "Part_Name": ["零件名称", "名称", "品名", "零件名", "产品名称", "物料名称", "partname", "name"],
+    "Quantity": ["数量", "件数", "套数", "qty", "quantity"],
+    "Material": ["材质", "材料", "material"],
+    "Machining_Process": ["工艺", "加工工艺", "加工方式", "process"],
+    "Surface_Finish": ["表面处理", "外观处理", "表面", "后处理", "finish", "surfacefinish"],
+    "Notes": ["备注", "备注要求", "说明", "要求", "notes", "remark", "remarks"],
+}
+
+# Rows below row 1 that are checked for the real header line (title rows above it)
+HEADER_SEARCH_ROWS = 5
+
+_STRIP_CHARS = re.compile(r"[\s　:：()（）\[\]【】._\-/#*]+")
+
+
+def normalize_header(value):
+    """Canonical form of a header cell for matching and cache keys"""
+    if value in (None, "null"):
+        return ""
+    return _STRIP_CHARS.sub("", str(value)).lower()
+
+
+ALIAS_TO_FIELD = {
+    normalize_header(alias): field
+    for field, aliases in HEADER_ALIASES.items()
+    for alias in aliases
+}
+
+
+def header_signature(header_texts):
+    """Cache key for a header layout: hash of the normalized, non-empty header set"""
+    names = sorted({normalize_header(text) for text in header_texts} - {""})
+    return hashlib.sha256(json.dumps(names, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+
+def candidate_header_rows(rows):
+    """(header_row, {column key: header text}) for row 1 and the first data rows
+
+    header_row is -1 when the extracted keys themselves are the headers,
+    otherwise the index of the data row holding the column titles.
+    """
+    keys = [key for key in rows[0] if key != "image_file"] if rows else []
+    yield -1, {key: key for key in keys}
+    for idx, row in enumerate(rows[:HEADER_SEARCH_ROWS]):
+        yield idx, {key: row.get(key) for key in keys}
+
+
+def rule_mapping(header_texts):
+    """Map header texts with the alias table, {normalized header: field}"""
+    mapping = {}
+    used = set()
+    for text in header_texts.values():
+        field = ALIAS_TO_FIELD.get(normalize_header(text))
+        if field and field not in used:
+            mapping[normalize_header(text)] = field
+            used.add(field)
+    return mapping
+
+
+def is_usable_mapping(mapping):
+    """A layout is only transformed locally if name and quantity are both found"""
+    fields = set(mapping.values())
+    return "Part_Name" in fields and "Quantity" in fields
+
+
+def mapped_columns(header_texts, mapping):
+    """{internal field: extracted column key}, first column wins when two map to one field"""
+    columns = {}
+    for key, text in header_texts.items():
+        field = mapping.get(normalize_header(text))
+        if field and field not in columns:
+            columns[field] = key
+    return columns
+
+
+def apply_mapping(rows, header_row, header_texts, mapping):
+    """Deterministically turn extracted rows into internal-format rows"""
+    columns = mapped_columns(header_texts, mapping)
+
+    processed = []
+    for row in rows[header_row + 1:]:
+        item = {}
+        for field in INTERNAL_FIELDS:
+            value = row.get(columns[field], "null") if field in columns else "null"
+            item[field] = None if value == "null" else value
+        if all(value in (None, "") for value in item.values()):
+            continue  # Don't output empty rows
+        if item["Notes"] in (None, ""):
+            item["Notes"] = "N/A"
+        item["image_file"] = row.get("image_file", "null")
+        processed.append(item)
+    return processed
+
+
+class HeaderMappingCache:
+    """Header layouts seen before, persisted as JSON keyed by header_signature"""
+
+    def __init__(self, path="header_mappings.json"):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def get(self, header_texts):
+        entry = self.entries.get(header_signature(header_texts.values()))
+        return entry["mapping"] if entry else None
+
+    def put(self, header_texts, mapping, source):
+        self.entries[header_signature(header_texts.values())] = {
+            "headers": [str(text) for text in header_texts.values() if normalize_header(text)],
+            "mapping": mapping,
+            "source": source,
+        }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def find_local_mapping(rows, cache):
+    """(header_row, header_texts, mapping) from the cache or rule table, None if the layout is unknown"""
+    candidates = list(candidate_header_rows(rows))
+
+    for header_row, header_texts in candidates:
+        mapping = cache.get(header_texts)
+        if mapping:
+            print(f"⚡ Known header layout ({header_signature(header_texts.values())}), mapping locally")
+            return header_row, header_texts, mapping
+
+    # Pick the candidate row that matches the most known header spellings
+    header_row, header_texts = max(candidates, key=lambda candidate: len(rule_mapping(candidate[1])))
+    mapping = rule_mapping(header_texts)
+    if is_usable_mapping(mapping):
+        cache.put(header_texts, mapping, source="rules")
+        print("⚡ Header layout matched by rule table, mapping locally")
+        return header_row, header_texts, mapping
+
+    return None
+
+
+def map_rows_locally(rows, cache):
+    """Transform rows with a cached or rule-table mapping, None if the layout is unknown"""
+    found = find_local_mapping(rows, cache)
+    if found is None:
+        return None
+    header_row, header_texts, mapping = found
+    return apply_mapping(rows, header_row, header_texts, mapping)
+
+
+def mapping_columns(rows):
+    """{column key: [first values]} sent to the LLM to ask for the mapping"""
+    return {
+        key: [row.get(key) for row in rows[:HEADER_SEARCH_ROWS + 1]]
+        for key in rows[0] if key != "image_file"
+    }
+
+
+def map_rows_with_answer(rows, cache, answer):
+    """Cache the LLM's column mapping and transform locally, None if it is unusable
+
+    answer is {"header_row": int, "mapping": {column key: field or null}}
+    as returned for mapping_columns(rows).
+    """
+    header_row = int(answer.get("header_row", -1))
+    if not -1 <= header_row < min(len(rows), HEADER_SEARCH_ROWS):
+        return None
+
+    header_texts = dict(candidate_header_rows(rows))[header_row]
+    mapping = {
+        normalize_header(header_texts[key]): field
+        for key, field in answer.get("mapping", {}).items()
+        if key in header_texts and field in INTERNAL_FIELDS and normalize_header(header_texts[key])
+    }
+    if not is_usable_mapping(mapping):
+        return None
+
+    cache.put(header_texts, mapping, source="llm")
+    return apply_mapping(rows, header_row, header_texts, mapping)
+
+
+def map_rows_with_llm_mapping(rows, cache, request_mapping):
+    """Ask the LLM for the column mapping once, cache it and transform locally
+
+    request_mapping(columns) gets mapping_columns(rows) and returns the answer.
+    """
+    return map_rows_with_answer(rows, cache, request_mapping(mapping_columns(rows)))
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""
+Part image handling
+Keeps the original media bytes and reads sizes from the file header
+(no openpyxl here, the workbook side lives in quote_writer)
+"""
+
+import hashlib
+import os
+import struct
+import threading
+from io import BytesIO
+
+# Formats Excel embeds as-is -> file extension used in extracted_images/
+PASSTHROUGH_FORMATS = {"png": "png", "jpeg": "jpg", "gif": "gif"}
+
+# Thumbnails are stored at this multiple of the displayed size (sharper on HiDPI/print)
+DEFAULT_DPI_SCALE = 2
+
+# Perceptual hashes this many bits apart (of 64) count as the same picture, for ImageStores that
+# merge near-duplicates (merge_similar, off by default: distinct parts with similar renders would share a picture)
+PHASH_MAX_DISTANCE = 3
+PHASH_BANDS = 4  # Bands of 16 bits; within PHASH_MAX_DISTANCE at least one band matches exactly
+# ... and their 4x4 color grids may differ by at most this much per channel on average (0-255)
+PHASH_MAX_COLOR_DIFF = 3
+
+# JPEG start-of-frame markers (C4, C8 and CC are not frames)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def image_info(data):
+    """(format, width, height) read from the header, or None if unsupported"""
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and data[12:16] == b"IHDR":
+        width, height = struct.unpack(">II", data[16:24])
+        return "png", width, height
+
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        width, height = struct.unpack("<HH", data[6:10])
+        return "gif", width, height
+
+    if data[:2] == b"\xff\xd8":
+        pos = 2
+        while pos + 4 <= len(data):
+            if data[pos] != 0xFF:
+                return None
+            marker = data[pos + 1]
+            if marker == 0xFF:  # Fill byte
+                pos += 1
+                continue
+            if marker == 0xD8 or 0xD0 <= marker <= 0xD7:  # No length field
+                pos += 2
+                continue
+            (length,) = struct.unpack(">H", data[pos + 2:pos + 4])
+            if marker in JPEG_SOF_MARKERS:
+                height, width = struct.unpack(">HH", data[pos + 5:pos + 9])
+                return "jpeg", width, height
+            pos += 2 + length
+
+    return None
+
+
+def to_embeddable(data):
+    """Original bytes if Excel can embed them as-is, otherwise a PNG re-encode
+
+    Returns (bytes, (format, width, height)). Only the fallback decodes the image.
+    """
+    info = image_info(data)
+    if info is not None:
+        return data, info
+
+    from PIL import Image as PILImage
+
+    fp = BytesIO()
+    with PILImage.open(BytesIO(data)) as img:
+        img.save(fp, format="png")
+    png_bytes = fp.getvalue()
+    return png_bytes, image_info(png_bytes)
+
+
+def load_row_image(image_file, images=None, images_dir="extracted_images"):
+    """Bytes of an extracted row image, from memory if available"""
+    if images is not None and image_file in images:
+        return images[image_file]
+    image_path = os.path.join(images_dir, image_file)
+    if not os.path.exists(image_path):
+        return None
+    with open(image_path, "rb") as f:
+        return f.read()
+
+
+def file_has_contents(path, data):
+    """True if path already holds exactly these bytes"""
+    try:
+        if os.path.getsize(path) != len(data):
+            return False
+        with open(path, "rb") as f:
+            return f.read() == data
+    except OSError:
+        return False
+
+
+def perceptual_hash(data, size=8):
+    """64-bit difference hash: brightness gradients of a tiny grayscale copy
+
+    Re-encodes, resizes and small edits of the same picture land within a
+    few bits of each other. None if the image can't be decoded.
+    """
+    fingerprint = image_fingerprint(data, size)
+    return fingerprint[0] if fingerprint is not None else None
+
+
+def image_fingerprint(data, size=8):
+    """(perceptual_hash, 4x4 RGB color grid) from one decode, None if the image can't be decoded
+
+    The hash only sees brightness gradients, so flat renders that differ
+    mostly in color (or a small feature) can hash alike; the coarse color
+    grid tells those apart.
+    """
+    from PIL import Image as PILImage
+
+    try:
+        with PILImage.open(BytesIO(data)) as img:
+            img.draft("RGB", (size * 4, size * 4))  # JPEGs decode at a fraction of their size
+            rgb = img.convert("RGB")
+            pixels = list(rgb.convert("L").resize((size + 1, size), PILImage.BILINEAR).getdata())
+            colors = tuple(channel for pixel in rgb.resize((4, 4), PILImage.BOX).getdata() for channel in pixel)
+    except Exception:
+        return None
+    return difference_hash(pixels, size), colors
+
+
+def difference_hash(pixels, size):
+    value = 0
+    for y in range(size):
+        row = pixels[y * (size + 1):(y + 1) * (size + 1)]
+        for x in range(size):
+            value = (value << 1) | (row[x] > row[x + 1])
+    return value
+
+
+def color_distance(colors, other):
+    """Mean absolute difference of two color grids, per channel"""
+    return sum(abs(a - b) for a, b in zip(colors, other)) / len(colors)
+
+
+def phash_bands(phash):
+    """(band index, bits) keys of a 64-bit hash, for finding close hashes without comparing all pairs"""
+    width = 64 // PHASH_BANDS
+    return [(band, (phash >> (band * width)) & ((1 << width) - 1)) for band in range(PHASH_BANDS)]
+
+
+class ImageStore:
+    """Writes each distinct row image to images_dir once
+
+    Exact copies are found by sha256 of the bytes and reuse the file of
+    the first one seen, so every row still shows its own picture. With
+    merge_similar near-duplicates are merged too: a perceptual hash within
+    PHASH_MAX_DISTANCE bits, the same aspect ratio and nearly the same
+    coarse colors. That also catches the same render re-exported or
+    resized, but can give a part the picture of a similar one, so it is
+    opt-in.
+
+    With shared_dir (a directory shared by many jobs) each distinct image
+    is kept there once under its sha256, and images_dir gets a hard link
+    to it, so a picture every job of a batch repeats is stored only once.
+    """
+
+    def __init__(self, images_dir, merge_similar=False, shared_dir=None):
+        self.images_dir = images_dir
+        self.max_distance = PHASH_MAX_DISTANCE if merge_similar else None
+        self.shared_dir = shared_dir
+        self.by_digest = {}  # sha256 -> file name
+        self.bands = {}      # (band index, band bits) -> [(phash, colors, aspect, file name)]
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.shared_hits = 0  # Distinct images an earlier job had already stored in shared_dir
+        os.makedirs(images_dir, exist_ok=True)
+        if shared_dir is not None:
+            os.makedirs(shared_dir, exist_ok=True)
+
+    def find_similar(self, phash, colors, aspect):
+        for key in phash_bands(phash):
+            for other, other_colors, other_aspect, image_filename in self.bands.get(key, ()):
+                if (bin(phash ^ other).count("1") <= self.max_distance and abs(aspect - other_aspect) <= 0.02 * aspect
+                        and color_distance(colors, other_colors) <= PHASH_MAX_COLOR_DIFF):
+                    return image_filename
+        return None
+
+    def add(self, data, name):
+        """Store embeddable image bytes under name (without extension)
+
+        Returns (file name, bytes); the bytes are None when an earlier
+        identical or near-identical image is reused instead.
+        """
+        data, (img_format, width, height) = to_embeddable(data)
+        digest = hashlib.sha256(data).digest()
+        if digest in self.by_digest:
+            self.exact_hits += 1
+            return self.by_digest[digest], None
+
+        fingerprint = image_fingerprint(data) if self.max_distance is not None else None
+        aspect = width / height if height else 0
+        if fingerprint is not None:
+            image_filename = self.find_similar(*fingerprint, aspect)
+            if image_filename is not None:
+                self.by_digest[digest] = image_filename
+                self.near_hits += 1
+                return image_filename, None
+
+        image_filename = f"{name}.{PASSTHROUGH_FORMATS[img_format]}"
+        self.write(image_filename, data)
+        self.by_digest[digest] = image_filename
+        if fingerprint is not None:
+            phash, colors = fingerprint
+            for key in phash_bands(phash):
+                self.bands.setdefault(key, []).append((phash, colors, aspect, image_filename))
+        return image_filename, data
+
+    def write(self, image_filename, data):
+        """Persist one distinct image (subclasses store it elsewhere)"""
+        image_path = os.path.join(self.images_dir, image_filename)
+        if file_has_contents(image_path, data):  # Unchanged images from an earlier run stay as they are
+            return
+        if self.shared_dir is not None:
+            extension = os.path.splitext(image_filename)[1]
+            shared_path = os.path.join(self.shared_dir, f"{hashlib.sha256(data).hexdigest()}{extension}")
+            if file_has_contents(shared_path, data):
+                self.shared_hits += 1
+            else:
+                write_file(shared_path, data)
+            try:
+                link_file(shared_path, image_path)
+                return
+            except OSError:
+                pass  # Other file system or no hard links, keep a copy
+        write_file(image_path, data)
+
+    def summary(self):
+        unique = len(set(self.by_digest.values()))
+        summary = f"{unique} unique, {self.exact_hits} exact and {self.near_hits} near duplicates"
+        if self.shared_dir is not None:
+            summary += f", {self.shared_hits} already stored by earlier jobs"
+        return summary
+
+
+def prune_shared_images(shared_dir):
+    """Delete images of a shared ImageStore directory that no job links to any more, returns how many"""
+    removed = 0
+    for entry in os.scandir(shared_dir):
+        try:
+            if entry.is_file() and entry.stat().st_nlink == 1:
+                os.remove(entry.path)
+                removed += 1
+        except FileNotFoundError:
+            continue
+    return removed
+
+
+def write_file(path, data):
+    """Replace path with data without truncating it in place (it may be a hard link into a shared store)"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def link_file(source, path):
+    """Make path a hard link to source, replacing whatever path was"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    os.link(source, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def make_thumbnail(data, box):
+    """Downscale image bytes to fit a box x box pixel square
+
+    Images that already fit are returned unchanged without decoding. JPEGs
+    stay JPEG, everything else becomes PNG so transparency survives.
+    """
+    data, (img_format, width, height) = to_embeddable(data)
+    if width <= box and height <= box:
+        return data
+
+    from PIL import Image as PILImage
+
+    fp = BytesIO()
+    with PILImage.open(BytesIO(data)) as img:
+        if img_format == "jpeg":
+            img.draft("RGB", (box, box))  # Let the decoder skip detail we throw away
+        img.thumbnail((box, box), PILImage.LANCZOS)
+        if img_format == "jpeg":
+            img.save(fp, format="jpeg", quality=85, optimize=True)
+        else:
+            img.save(fp, format="png", optimize=True)
+    return fp.getvalue()
+
+
+class ThumbnailCache:
+    """On-disk thumbnail cache keyed by the source bytes hash and target size
+
+    Entries are evicted least recently used first (by file mtime, which is
+    refreshed on every hit) once the cache grows past max_bytes. Safe to
+    share between threads.
+    """
+
+    def __init__(self, cache_dir="thumbnail_cache", max_bytes=256 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.total_bytes = sum(entry.stat().st_size for entry in os.scandir(cache_dir) if entry.is_file())
+
+    def key(self, data, box):
+        return f"{hashlib.sha256(data).hexdigest()}_{box}"
+
+    def thumbnail(self, data, box):
+        """Cached make_thumbnail()"""
+        info = image_info(data)
+        if info is not None and info[1] <= box and info[2] <= box:
+            return data  # Already small enough, nothing to cache
+
+        path = os.path.join(self.cache_dir, self.key(data, box))
+        try:
+            with open(path, "rb") as f:
+                thumb = f.read()
+            os.utime(path)
+            with self.lock:
+                self.hits += 1
+            return thumb
+        except FileNotFoundError:
+            pass
+
+        thumb = make_thumbnail(data, box)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(thumb)
+        os.replace(tmp_path, path)
+        with self.lock:
+            self.misses += 1
+            self.total_bytes += len(thumb)
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+        return thumb
+
+    def evict(self):
+        """Drop the least recently used entries until the cache fits max_bytes"""
+        entries = sorted(
+            (entry.stat().st_mtime, entry.stat().st_size, entry.path)
+            for entry in os.scandir(self.cache_dir)
+            if entry.is_file()
+        )
+        self.total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            self.total_bytes -= size
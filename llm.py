@@ -0,0 +1,609 @@
+#!/usr/bin/env python3
+"""
+LLM normalization engine
+Splits rows into token-budgeted chunks and sends them concurrently
+"""
+
+import asyncio
+import json
+import random
+import time
+
+import profiling
+from llm_cache import fingerprint
+from values import FINISH_ALIASES, MATERIAL_ALIASES, PROCESS_ALIASES
+
+DASHSCOPE_BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+DEFAULT_MODEL = "qwen-turbo"
+
+# Input tokens of row data per request, leaves room for the echoed output
+DEFAULT_CHUNK_TOKENS = 2000
+DEFAULT_CONCURRENCY = 4
+DEFAULT_REQUESTS_PER_SECOND = 5
+DEFAULT_RETRIES = 3
+
+ROW_KEY = "_row"
+MODEL_KEY = "_model"  # Model that produced an answer, a ProviderPool's winner may not be the one asked for
+
+# Internal fields in the order the model answers them, after the row id
+WIRE_FIELDS = ("Serial_Number", "Part_Name", "Quantity", "Material", "Machining_Process", "Surface_Finish", "Notes")
+WIRE_EMPTY = (None, "", "null")
+
+# Part of every cache fingerprint, bump whenever PROMPT_TEMPLATE changes meaning
+PROMPT_VERSION = 2
+# Same for VALUE_PROMPT_TEMPLATE and the vocabularies it lists
+VALUE_PROMPT_VERSION = 1
+
+PROMPT_TEMPLATE = """You must translate and restructure rows of a customer's part list into our internal CNC machining company Excel log format.
+
+    Each input row is a JSON array: its row id, then its cells in this column order (null for an empty cell, empty cells at the end left out):
+    Column keys: {columns_json}
+
+    For each input row output a JSON array: the same row id, then these internal fields in this order:
+    {fields}
+
+    Instructions to follow:
+    - Take each field from the cell of the matching column, null if the row has none.
+    - Keep original data values the same.
+    - DON'T modify the row ids.
+    - Output one JSON array with one array per input row.
+    - Output structured valid JSON ONLY. NO OTHER TEXT.
+
+    Input rows:
+
+    {rows_json}"""
+
+
+MAPPING_PROMPT_TEMPLATE = """Below are the columns of a customer's part list for our CNC machining company, each with its key and the first cell values.
+
+    Map each column key to one of our internal fields:
+    Serial_Number, Part_Name, Quantity, Material, Machining_Process, Surface_Finish, Notes
+    Use null for columns that match none of them. Use each field at most once.
+
+    The column titles may be in the keys themselves or in one of the first rows (title rows above them).
+    Set "header_row" to the 0-based position in the value lists of the row holding the column titles, or -1 if the keys are the titles.
+
+    Output valid JSON ONLY, NO OTHER TEXT, in this form:
+    {{"header_row": -1, "mapping": {{"<column key>": "<internal field or null>"}}}}
+
+    Columns:
+
+    {columns_json}"""
+
+
+VALUE_PROMPT_TEMPLATE = """Below are cell values from a customer's part list for our CNC machining company that our own tables could not read, grouped by field.
+
+    Give the normalized form of each value:
+    - Material: the material grade or name, spelled like one of these where it fits: {materials}
+    - Machining_Process: one or more of these joined with " + ", where they fit: {processes}
+    - Surface_Finish: one or more of these joined with " + ", a color in parentheses like 阳极氧化(黑色): {finishes}
+    - Quantity: the total number of pieces as a number, or null if it can't be told
+    Keep a value unchanged if none of the above fits.
+
+    Output valid JSON ONLY, NO OTHER TEXT, in this form:
+    {{"<field>": {{"<original value>": <normalized value>}}}}
+
+    Values:
+
+    {values_json}"""
+
+
+def row_fingerprint(model, row):
+    """Cache key for one row: model, prompt version and the row values
+
+    _row and image_file are left out so the same part still hits the cache
+    after rows were inserted above it.
+    """
+    payload = {key: value for key, value in row.items() if key not in (ROW_KEY, "image_file")}
+    return fingerprint(model, PROMPT_VERSION, payload)
+
+
+class ChunkError(Exception):
+    """A chunk came back unusable, rows_received holds whatever did arrive"""
+
+    def __init__(self, message, rows_received=()):
+        super().__init__(message)
+        self.rows_received = list(rows_received)
+
+
+class JsonArrayStreamParser:
+    """Incremental parser for a JSON array of objects (or arrays) that arrives in pieces
+
+    feed() returns every element completed by the new text. Anything before
+    the opening '[' (```json fences, prose) and after the closing ']' is
+    ignored; complete tells whether the closing ']' was seen.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.started = False
+        self.complete = False
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.element_start = None
+
+    def feed(self, text):
+        buf = self.buffer + text
+        i = self.pos
+        elements = []
+        while i < len(buf) and not self.complete:
+            ch = buf[i]
+            if not self.started:
+                self.started = ch == "["
+            elif self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch in "{[":
+                if self.depth == 0:
+                    self.element_start = i
+                self.depth += 1
+            elif ch in "}]":
+                if self.depth == 0:
+                    self.complete = ch == "]"
+                else:
+                    self.depth -= 1
+                    if self.depth == 0:
+                        try:
+                            elements.append(json.loads(buf[self.element_start:i + 1]))
+                        except json.JSONDecodeError:
+                            pass  # Drop a malformed element, its row gets re-requested
+                        self.element_start = None
+            i += 1
+
+        # Only keep the unfinished element around
+        if self.element_start is None:
+            self.buffer, self.pos = "", 0
+        else:
+            self.buffer, self.pos = buf[self.element_start:], i - self.element_start
+            self.element_start = 0
+        return elements
+
+
+def estimate_tokens(text):
+    """Rough token count: one per CJK character, one per 4 other characters"""
+    cjk = sum(1 for ch in text if ord(ch) > 0x2E7F)
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def dumps_wire(value):
+    """JSON without spaces, the separators alone would cost a token per cell"""
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def wire_columns(rows):
+    """Column keys of rows in first-seen order, without _row and image_file"""
+    columns = {}
+    for row in rows:
+        for key in row:
+            if key not in (ROW_KEY, "image_file"):
+                columns.setdefault(key, None)
+    return list(columns)
+
+
+def wire_row(row, columns):
+    """[row id, cell, ...] in column order: null for empty cells, trailing empty cells dropped
+
+    Keys are sent once per request (wire_columns) and the image file name
+    stays here, the model only ever sees the row id.
+    """
+    cells = [None if row.get(key) in WIRE_EMPTY else row[key] for key in columns]
+    while cells and cells[-1] is None:
+        cells.pop()
+    return [row.get(ROW_KEY), *cells]
+
+
+def row_tokens(row):
+    """Estimated tokens of one row in the wire format"""
+    return estimate_tokens(dumps_wire(wire_row(row, wire_columns([row]))))
+
+
+def build_prompt(rows):
+    columns = wire_columns(rows)
+    lines = ",\n".join(dumps_wire(wire_row(row, columns)) for row in rows)
+    return PROMPT_TEMPLATE.format(columns_json=dumps_wire(columns), fields=", ".join(WIRE_FIELDS),
+                                  rows_json=f"[\n{lines}\n]")
+
+
+def decode_result(result, rows_by_id):
+    """Rebuild the internal-format record of an answer [row id, field, ...], None if it names no sent row
+
+    The row's image_file and _row come from the row that was sent. An
+    object (a model answering in the long form) is passed on as it is.
+    """
+    if isinstance(result, dict):
+        return result
+    if not isinstance(result, list) or not result:
+        return None
+    row = rows_by_id.get(str(result[0]))
+    if row is None:
+        return None
+    values = result[1:1 + len(WIRE_FIELDS)]
+    values += [None] * (len(WIRE_FIELDS) - len(values))
+    record = {field: None if value in WIRE_EMPTY else value for field, value in zip(WIRE_FIELDS, values)}
+    if record["Notes"] is None:
+        record["Notes"] = "N/A"
+    record["image_file"] = row.get("image_file", "null")
+    record[ROW_KEY] = row[ROW_KEY]
+    return record
+
+
+def chunk_rows(rows, max_tokens=DEFAULT_CHUNK_TOKENS):
+    """Split rows into consecutive chunks of at most max_tokens of wire-format rows
+
+    A single row larger than the budget gets a chunk of its own.
+    """
+    chunks = []
+    current = []
+    current_tokens = 0
+    for row in rows:
+        tokens = row_tokens(row)
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(current)
+            current = []
+            current_tokens = 0
+        current.append(row)
+        current_tokens += tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def strip_code_fence(text):
+    """Remove a ```json ... ``` wrapper around a model response"""
+    text = text.strip()
+    if text.startswith('```json'):
+        text = text[7:-3]
+    elif text.startswith('```'):
+        text = text[3:-3]
+    return text
+
+
+def match_chunk_results(chunk, results, positional=True):
+    """Pair a chunk's rows with the results that came back for them
+
+    Results are matched by _row first, then by image_file, and finally (if
+    positional) by position for results that carry no _row. Returns (matched, missing):
+    matched maps _row -> result, missing lists the rows still unanswered.
+    """
+    by_row = {}
+    by_image = {}
+    results = [result for result in results if isinstance(result, dict)]
+    for result in results:
+        if ROW_KEY in result:
+            by_row.setdefault(str(result[ROW_KEY]), result)
+        image_file = result.get("image_file")
+        if image_file not in (None, "null"):
+            by_image.setdefault(image_file, result)
+
+    matched = {}
+    missing = []
+    for position, row in enumerate(chunk):
+        result = by_row.get(str(row[ROW_KEY]))
+        if result is None and row.get("image_file") not in (None, "null"):
+            result = by_image.get(row["image_file"])
+        if result is None and positional and position < len(results) and ROW_KEY not in results[position]:
+            result = results[position]
+        if result is None:
+            missing.append(row)
+            continue
+        result = dict(result)
+        result[ROW_KEY] = row[ROW_KEY]
+        matched[row[ROW_KEY]] = result
+    return matched, missing
+
+
+class RateLimiter:
+    """Spaces request starts out to at most `rate` per second"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_start = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            loop = asyncio.get_running_loop()
+            delay = self.next_start - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.next_start = max(loop.time(), self.next_start) + self.interval
+
+
+def record_llm_call(name, started, usage, **attrs):
+    """Report one API call's latency and token usage to the profiler"""
+    if not profiling.enabled():
+        return
+    tokens = {
+        "prompt_tokens": getattr(usage, "prompt_tokens", None),
+        "completion_tokens": getattr(usage, "completion_tokens", None),
+    }
+    profiling.event(name, started, time.perf_counter() - started, **tokens, **attrs)
+    profiling.add("llm", calls=1, errors=1 if "error" in attrs else 0, **tokens)
+
+
+def client_models(client, model):
+    """Models that may answer a call on client: every provider's for a ProviderPool, else model"""
+    providers = getattr(client, "providers", None)
+    return [provider.model for provider in providers] if providers else [model]
+
+
+async def run_request(client, model, request, kind, retries=None):
+    """request(client, model) on an AsyncOpenAI client
+
+    A ProviderPool (providers.py) in place of the client picks the client
+    and model itself, with deadlines, hedging and retries (its own number
+    unless retries is given).
+    """
+    if hasattr(client, "run"):
+        return await client.run(request, kind, retries)
+    return await request(client, model)
+
+
+async def complete_chunk(client, model, chunk, stream=True, on_result=None):
+    """Send one chunk and return the row objects the model produced
+
+    Rows go out in the wire format (build_prompt) and each answer is
+    decoded back into a record as soon as it is complete; with stream=True
+    it is handed to on_result(obj) right away. A truncated or broken
+    response raises ChunkError carrying the records that did arrive.
+
+    Through a ProviderPool the chunk may be answered by two providers at
+    once (hedged); records from either are passed on, each carrying the
+    model that produced it under MODEL_KEY. The pool doesn't retry,
+    normalize_rows_async re-sends only the rows still missing.
+    """
+    rows_by_id = {str(row[ROW_KEY]): row for row in chunk}
+    messages = [{"role": "user", "content": build_prompt(chunk)}]
+    arrived = []  # Records from every attempt, kept if they all fail
+
+    async def request(client, model):
+        parser = JsonArrayStreamParser()
+        received = []
+
+        def take(text):
+            for obj in parser.feed(text):
+                obj = decode_result(obj, rows_by_id)
+                if obj is None:
+                    continue
+                obj = dict(obj, **{MODEL_KEY: model})
+                received.append(obj)
+                arrived.append(obj)
+                if on_result is not None:
+                    on_result(obj)
+
+        started = time.perf_counter()
+        first_token = None
+        usage = None
+        try:
+            if stream:
+                # Token counts only come with streamed responses when asked for
+                extra = {"stream_options": {"include_usage": True}} if profiling.enabled() else {}
+                response = await client.chat.completions.create(model=model, messages=messages, stream=True,
+                                                                **extra)
+                async for event in response:
+                    if event.choices and event.choices[0].delta.content:
+                        if first_token is None:
+                            first_token = time.perf_counter() - started
+                        take(event.choices[0].delta.content)
+                    if getattr(event, "usage", None):
+                        usage = event.usage
+            else:
+                response = await client.chat.completions.create(model=model, messages=messages)
+                usage = response.usage
+                take(response.choices[0].message.content or "")
+        except Exception as e:
+            record_llm_call("llm.chunk", started, usage, rows=len(chunk), received=len(received), error=str(e),
+                            model=model)
+            raise ChunkError(f"{e} after {len(received)} rows", received) from e
+
+        record_llm_call("llm.chunk", started, usage, rows=len(chunk), received=len(received), model=model,
+                        first_token_ms=round(first_token * 1000, 3) if first_token is not None else None)
+
+        if not parser.complete:
+            raise ChunkError(f"response ended after {len(received)} rows", received)
+        return received
+
+    try:
+        return await run_request(client, model, request, "chunk", retries=0)
+    except ChunkError as e:
+        raise ChunkError(str(e), arrived) from e.__cause__
+    except Exception as e:
+        raise ChunkError(f"{e} after {len(arrived)} rows", arrived) from e
+
+
+async def normalize_rows_async(
+    rows,
+    client,
+    model=DEFAULT_MODEL,
+    chunk_tokens=DEFAULT_CHUNK_TOKENS,
+    concurrency=DEFAULT_CONCURRENCY,
+    requests_per_second=DEFAULT_REQUESTS_PER_SECOND,
+    retries=DEFAULT_RETRIES,
+    cache=None,
+    stream=True,
+    on_row=None,
+    semaphore=None,
+    limiter=None,
+):
+    """Normalize rows chunk by chunk, returns the results in row order or None
+
+    Rows that came back are kept even when a response fails or is cut off;
+    only the rows still missing are re-sent, with jittered exponential
+    backoff. on_row(index, result) is called for each row as soon as it is
+    available (cached rows first). With a ResponseCache, rows answered
+    before are taken from it and only the rest are sent; every returned row
+    is stored on its own, under the model that answered it (a
+    ProviderPool's providers may run different models; model only names
+    the one a plain client is asked). Pass a shared asyncio.Semaphore and
+    RateLimiter to keep several concurrent calls (e.g. a batch run) within
+    one budget.
+    """
+    keyed_rows = [dict(row, **{ROW_KEY: idx}) for idx, row in enumerate(rows)]
+    results_by_row = {}
+    models = client_models(client, model)
+    if cache is not None:
+        for row in keyed_rows:
+            cached = cache.get_any([row_fingerprint(candidate, row) for candidate in models])
+            if cached is not None:
+                results_by_row[row[ROW_KEY]] = dict(cached, image_file=row.get("image_file", "null"))
+        if results_by_row:
+            print(f"💾 {len(results_by_row)} of {len(rows)} rows answered from cache")
+    if on_row is not None:
+        for idx, result in sorted(results_by_row.items()):
+            on_row(idx, result)
+
+    pending = chunk_rows([row for row in keyed_rows if row[ROW_KEY] not in results_by_row], chunk_tokens)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(concurrency)
+    if limiter is None:
+        limiter = RateLimiter(requests_per_second)
+
+    def accept(chunk, results, positional=True):
+        """Keep the matched rows and return the ones still missing"""
+        matched, missing = match_chunk_results(chunk, results, positional)
+        new_rows = [row for row in chunk if row[ROW_KEY] in matched and row[ROW_KEY] not in results_by_row]
+        answered_by = {}
+        for row in new_rows:
+            answered_by[row[ROW_KEY]] = matched[row[ROW_KEY]].pop(MODEL_KEY, model)
+            results_by_row[row[ROW_KEY]] = matched[row[ROW_KEY]]
+            if on_row is not None:
+                on_row(row[ROW_KEY], matched[row[ROW_KEY]])
+        if cache is not None and new_rows:
+            cache.put_many(
+                (
+                    row_fingerprint(answered_by[row[ROW_KEY]], row),
+                    {key: value for key, value in matched[row[ROW_KEY]].items() if key not in (ROW_KEY, "image_file")},
+                )
+                for row in new_rows
+            )
+        return missing
+
+    async def run(chunk, attempt):
+        if attempt:
+            await asyncio.sleep(min(30, 2 ** (attempt - 1)) * (0.5 + random.random()))
+        async with semaphore:
+            await limiter.wait()
+            on_result = (lambda obj: accept(chunk, [obj], positional=False)) if on_row is not None else None
+            return await complete_chunk(client, model, chunk, stream=stream, on_result=on_result)
+
+    if pending:
+        print(f"🤖 Sending {sum(map(len, pending))} rows in {len(pending)} chunks (concurrency {concurrency})")
+    for attempt in range(retries + 1):
+        if not pending:
+            break
+        outcomes = await asyncio.gather(*(run(chunk, attempt) for chunk in pending), return_exceptions=True)
+        failed = []
+        for chunk, outcome in zip(pending, outcomes):
+            if isinstance(outcome, ChunkError):
+                missing = accept(chunk, outcome.rows_received)
+                print(f"⚠️  Chunk of {len(chunk)} rows failed (attempt {attempt + 1}): {outcome}")
+            elif isinstance(outcome, BaseException):
+                missing = chunk
+                print(f"⚠️  Chunk of {len(chunk)} rows failed (attempt {attempt + 1}): {outcome}")
+            else:
+                missing = accept(chunk, outcome)
+                if missing:
+                    print(f"⚠️  Model skipped {len(missing)} of {len(chunk)} rows (attempt {attempt + 1})")
+            if missing:
+                failed.append(missing)
+        pending = failed
+
+    if pending:
+        print(f"❌ {sum(map(len, pending))} rows still missing after {retries + 1} attempts")
+        return None
+
+    ordered = []
+    for idx in range(len(keyed_rows)):
+        result = results_by_row[idx]
+        result.pop(ROW_KEY, None)
+        ordered.append(result)
+    return ordered
+
+
+def open_client(api_key=None, base_url=DASHSCOPE_BASE_URL):
+    """AsyncOpenAI client for api_key, or without one the environment's ProviderPool (None if it has none)"""
+    if api_key is None:
+        from providers import open_pool
+
+        return open_pool()
+    from openai import AsyncOpenAI
+
+    return AsyncOpenAI(api_key=api_key, base_url=base_url)
+
+
+def normalize_rows(rows, api_key=None, base_url=DASHSCOPE_BASE_URL, **kwargs):
+    """Synchronous entry point, opens a client (see open_client) for the run"""
+
+    async def run():
+        async with open_client(api_key, base_url) as client:
+            return await normalize_rows_async(rows, client, **kwargs)
+
+    return asyncio.run(run())
+
+
+async def request_header_mapping_async(client, columns, model=DEFAULT_MODEL):
+    """Ask the model once how a header layout maps onto our fields"""
+    prompt = MAPPING_PROMPT_TEMPLATE.format(
+        columns_json=json.dumps(columns, ensure_ascii=False, default=str)
+    )
+
+    async def request(client, model):
+        started = time.perf_counter()
+        response = await client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+        )
+        record_llm_call("llm.header_mapping", started, response.usage, columns=len(columns), model=model)
+        return json.loads(strip_code_fence(response.choices[0].message.content or ""))
+
+    return await run_request(client, model, request, "header_mapping")
+
+
+def value_fingerprint(model, field, value):
+    """Cache key for the model's normalized form of one unrecognised value"""
+    return fingerprint(model, "value", VALUE_PROMPT_VERSION, field, value)
+
+
+async def request_value_normalization_async(client, values, model=DEFAULT_MODEL):
+    """Ask the model once for the normalized form of {field: [values]}, returns {field: {value: normalized}}
+
+    The answering model is added under MODEL_KEY.
+    """
+    prompt = VALUE_PROMPT_TEMPLATE.format(
+        materials=", ".join(MATERIAL_ALIASES),
+        processes=", ".join(PROCESS_ALIASES),
+        finishes=", ".join(FINISH_ALIASES),
+        values_json=json.dumps(values, ensure_ascii=False, default=str),
+    )
+
+    async def request(client, model):
+        started = time.perf_counter()
+        response = await client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+        )
+        record_llm_call("llm.values", started, response.usage, values=sum(map(len, values.values())), model=model)
+        answer = json.loads(strip_code_fence(response.choices[0].message.content or ""))
+        if not isinstance(answer, dict):
+            raise ValueError("value answer is not a JSON object")
+        return dict(answer, **{MODEL_KEY: model})
+
+    return await run_request(client, model, request, "values")
+
+
+def request_header_mapping(columns, api_key=None, base_url=DASHSCOPE_BASE_URL, model=DEFAULT_MODEL):
+    """Synchronous request_header_mapping_async() on a client (see open_client) opened for the call"""
+
+    async def run():
+        async with open_client(api_key, base_url) as client:
+            return await request_header_mapping_async(client, columns, model)
+
+    return asyncio.run(run())
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Persistent LLM response cache
+SQLite store of normalized rows keyed by a request fingerprint
+"""
+
+import hashlib
+import json
+import sqlite3
+import time
+
+DEFAULT_TTL_SECONDS = 30 * 24 * 3600
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def fingerprint(*parts):
+    """Stable hash of JSON-serializable request parts"""
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Key/value store for model outputs with TTL and size-based LRU eviction
+
+    hits and misses count lookups for the run summary.
+    """
+
+    def __init__(self, path="llm_cache.sqlite3", ttl_seconds=DEFAULT_TTL_SECONDS, max_bytes=DEFAULT_MAX_BYTES):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL, size INTEGER NOT NULL)"
+        )
+        self.db.commit()
+
+    def get(self, key):
+        """Cached value for key, or None if missing or expired"""
+        now = time.time()
+        row = self.db.execute(
+            "SELECT value FROM responses WHERE key = ? AND created >= ?",
+            (key, now - self.ttl_seconds),
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        self.hits += 1
+        return json.loads(row[0])
+
+    def get_any(self, keys):
+        """Cached value of the first of keys that has one, None if none do (counted as one lookup)"""
+        now = time.time()
+        found = dict(self.db.execute(
+            f"SELECT key, value FROM responses WHERE key IN ({', '.join('?' * len(keys))}) AND created >= ?",
+            (*keys, now - self.ttl_seconds),
+        ).fetchall())
+        key = next((key for key in keys if key in found), None)
+        if key is None:
+            self.misses += 1
+            return None
+        self.db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        self.hits += 1
+        return json.loads(found[key])
+
+    def put_many(self, items):
+        """Store (key, value) pairs in one transaction and evict if needed"""
+        now = time.time()
+        rows = []
+        for key, value in items:
+            value_json = json.dumps(value, ensure_ascii=False, default=str)
+            rows.append((key, value_json, now, now, len(value_json.encode("utf-8"))))
+        self.db.executemany("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)", rows)
+        self.evict()
+        self.db.commit()
+
+    def put(self, key, value):
+        self.put_many([(key, value)])
+
+    def evict(self):
+        """Drop expired entries, then least recently used ones above max_bytes"""
+        self.db.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl_seconds,))
+        (total,) = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if total <= self.max_bytes:
+            return
+
+        stale = []
+        for key, size in self.db.execute("SELECT key, size FROM responses ORDER BY accessed"):
+            if total <= self.max_bytes:
+                break
+            stale.append((key,))
+            total -= size
+        self.db.executemany("DELETE FROM responses WHERE key = ?", stale)
+
+    def summary(self):
+        return f"{self.hits} hits, {self.misses} misses"
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
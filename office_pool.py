@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Warm LibreOffice conversion pool
+Keeps headless soffice instances running and converts documents to PDF over UNO
+"""
+
+import os
+import queue
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+SOFFICE_CANDIDATES = ["soffice", "libreoffice"]
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_JOBS = 50           # Restart a worker after this many conversions
+DEFAULT_MAX_RSS_MB = 1024       # ...or once its soffice process grows past this
+STARTUP_TIMEOUT = 60
+
+# Export filter per source extension, anything else goes through the writer filter
+PDF_FILTERS = {
+    ".ppt": "impress_pdf_Export", ".pptx": "impress_pdf_Export", ".odp": "impress_pdf_Export",
+    ".xls": "calc_pdf_Export", ".xlsx": "calc_pdf_Export", ".ods": "calc_pdf_Export",
+}
+
+
+def find_soffice():
+    """Path of the LibreOffice binary, or None if it isn't installed"""
+    for name in SOFFICE_CANDIDATES:
+        path = shutil.which(name)
+        if path:
+            return path
+    return None
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def process_rss_mb(pid):
+    """Resident memory of a process in MB (Linux /proc), None where unavailable"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def convert_cold(src, out_dir, soffice=None):
+    """One-off `soffice --convert-to pdf` with a private profile, returns the PDF path
+
+    Used when the UNO bindings are missing. The profile and output live in
+    per-call directories so parallel runs never collide.
+    """
+    soffice = soffice or find_soffice()
+    if soffice is None:
+        raise FileNotFoundError("LibreOffice (soffice) not found")
+    with tempfile.TemporaryDirectory(prefix="soffice_profile_") as profile:
+        subprocess.run([
+            soffice, "--headless", "--norestore", f"-env:UserInstallation={Path(profile).as_uri()}",
+            "--convert-to", "pdf", "--outdir", out_dir, src,
+        ], check=True, stdout=subprocess.DEVNULL)
+    pdf_path = os.path.join(out_dir, f"{Path(src).stem}.pdf")
+    if not os.path.exists(pdf_path):
+        raise FileNotFoundError(f"PDF conversion failed - {pdf_path} not found")
+    return pdf_path
+
+
+class OfficeWorker:
+    """One headless soffice process with its own profile, driven over a UNO socket"""
+
+    def __init__(self, soffice, max_jobs=DEFAULT_MAX_JOBS, max_rss_mb=DEFAULT_MAX_RSS_MB):
+        self.soffice = soffice
+        self.max_jobs = max_jobs
+        self.max_rss_mb = max_rss_mb
+        self.process = None
+        self.desktop = None
+        self.profile_dir = None
+        self.jobs = 0
+
+    def start(self):
+        import uno
+
+        self.profile_dir = tempfile.mkdtemp(prefix="soffice_profile_")
+        port = free_port()
+        self.process = subprocess.Popen([
+            self.soffice, "--headless", "--invisible", "--nologo", "--norestore", "--nodefault",
+            f"-env:UserInstallation={Path(self.profile_dir).as_uri()}",
+            f"--accept=socket,host=127.0.0.1,port={port};urp;StarOffice.ComponentContext",
+        ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        local_context = uno.getComponentContext()
+        resolver = local_context.ServiceManager.createInstanceWithContext(
+            "com.sun.star.bridge.UnoUrlResolver", local_context
+        )
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while True:
+            try:
+                context = resolver.resolve(
+                    f"uno:socket,host=127.0.0.1,port={port};urp;StarOffice.ComponentContext"
+                )
+                break
+            except Exception:
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    self.stop()
+                    raise RuntimeError("soffice did not start")
+                time.sleep(0.25)
+        self.desktop = context.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", context)
+        self.jobs = 0
+
+    def stop(self):
+        if self.desktop is not None:
+            try:
+                self.desktop.terminate()
+            except Exception:
+                pass
+            self.desktop = None
+        if self.process is not None:
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+            self.process = None
+        if self.profile_dir is not None:
+            shutil.rmtree(self.profile_dir, ignore_errors=True)
+            self.profile_dir = None
+
+    def needs_recycle(self):
+        if self.process is None or self.process.poll() is not None:
+            return True
+        if self.jobs >= self.max_jobs:
+            return True
+        rss = process_rss_mb(self.process.pid)
+        return rss is not None and rss > self.max_rss_mb
+
+    def convert(self, src, out_dir):
+        """Convert src to PDF inside out_dir, returns the PDF path"""
+        import uno
+        from com.sun.star.beans import PropertyValue
+
+        def props(**values):
+            result = []
+            for name, value in values.items():
+                prop = PropertyValue()
+                prop.Name, prop.Value = name, value
+                result.append(prop)
+            return tuple(result)
+
+        if self.needs_recycle():
+            self.stop()
+            self.start()
+
+        pdf_path = os.path.join(out_dir, f"{Path(src).stem}.pdf")
+        filter_name = PDF_FILTERS.get(Path(src).suffix.lower(), "writer_pdf_Export")
+        doc = self.desktop.loadComponentFromURL(
+            uno.systemPathToFileUrl(os.path.abspath(src)), "_blank", 0, props(Hidden=True, ReadOnly=True)
+        )
+        if doc is None:
+            raise RuntimeError(f"LibreOffice could not open {src}")
+        try:
+            doc.storeToURL(uno.systemPathToFileUrl(os.path.abspath(pdf_path)), props(FilterName=filter_name))
+        finally:
+            doc.close(True)
+        self.jobs += 1
+        return pdf_path
+
+
+class ConversionService:
+    """Queue of document conversions served by a pool of warm soffice workers
+
+    Workers start lazily on their first job and are recycled after max_jobs
+    conversions or once soffice grows past max_rss_mb. Without the UNO
+    bindings (python3-uno) every job falls back to convert_cold(). Use as a
+    context manager, or call close() to shut the instances down.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, max_jobs=DEFAULT_MAX_JOBS, max_rss_mb=DEFAULT_MAX_RSS_MB,
+                 soffice=None):
+        self.soffice = soffice or find_soffice()
+        try:
+            import uno  # noqa: F401
+            self.warm = True
+        except ImportError:
+            self.warm = False
+            print("⚠️  python3-uno not available, converting with one soffice process per file")
+        self.idle = queue.Queue()
+        self.workers = [OfficeWorker(self.soffice, max_jobs, max_rss_mb) for _ in range(workers)]
+        for worker in self.workers:
+            self.idle.put(worker)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="soffice")
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def convert(self, src, out_dir):
+        """Convert src to a PDF in out_dir on the next free worker (blocking)"""
+        if self.soffice is None:
+            raise FileNotFoundError("LibreOffice (soffice) not found")
+        if not self.warm:
+            return convert_cold(src, out_dir, self.soffice)
+        worker = self.idle.get()
+        try:
+            return worker.convert(src, out_dir)
+        except Exception:
+            worker.stop()  # Start over with a fresh instance on the next job
+            raise
+        finally:
+            self.idle.put(worker)
+
+    def submit(self, src, out_dir):
+        """Queue a conversion, returns a Future with the PDF path"""
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("ConversionService is closed")
+            return self.executor.submit(self.convert, src, out_dir)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+        self.executor.shutdown(wait=True)
+        for worker in self.workers:
+            worker.stop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""
+Pipelined quote generation
+Extract, normalize and generate run concurrently, joined by bounded queues
+"""
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import profiling
+from header_map import (HEADER_SEARCH_ROWS, HeaderMappingCache, apply_mapping, find_local_mapping,
+                        mapping_columns, map_rows_with_answer)
+from images import DEFAULT_DPI_SCALE, load_row_image
+from llm import (DEFAULT_CHUNK_TOKENS, DEFAULT_CONCURRENCY, DEFAULT_MODEL,
+                 DEFAULT_REQUESTS_PER_SECOND, RateLimiter, normalize_rows_async, request_header_mapping_async,
+                 row_tokens)
+from quote_writer import IMAGE_MAX_SIZE, write_quote_excel
+from providers import open_pool
+from unified import iter_customer_rows
+from values import normalize_values, resolve_values_async, unresolved_count
+
+QUEUE_SIZE = 256         # Rows buffered between two stages
+WINDOW_ROWS = 4 * QUEUE_SIZE  # Rows normalization may run ahead of the writer
+IMAGE_WORKERS = 4
+VALUE_BATCH_SECONDS = 0.05  # Unrecognised values collected this long go to the model in one request
+
+_DONE = object()
+
+
+class PipelineError(Exception):
+    pass
+
+
+async def run_pipeline(input_file, output_filename, images_dir="extracted_images", header_cache=None,
+                       response_cache=None, thumbnails=None, dpi_scale=DEFAULT_DPI_SCALE,
+                       chunk_tokens=DEFAULT_CHUNK_TOKENS, concurrency=DEFAULT_CONCURRENCY,
+                       requests_per_second=DEFAULT_REQUESTS_PER_SECOND, image_workers=IMAGE_WORKERS,
+                       queue_size=QUEUE_SIZE, client=None, semaphore=None, limiter=None, pricing=None,
+                       merge_similar=False, shared_images=None):
+    """Extract → normalize → generate with all three stages running at once
+
+    - extraction runs in a thread and feeds rows into a bounded queue; each
+      row's image is handed to a thread pool for thumbnailing right away
+      (merge_similar and shared_images as for extract_customer_excel)
+    - normalization maps rows locally once the header layout is known from
+      the first rows (asking the LLM for the mapping if needed), otherwise
+      sends them in token-budgeted batches while extraction continues
+    - material, process, finish and quantity values are cleaned up with
+      the local vocabularies as each row comes out of normalization; rows
+      with values they don't know wait while those values, gathered from
+      all rows for VALUE_BATCH_SECONDS, are asked about in one request
+      (each distinct value once, answers kept in response_cache), so the
+      quote matches a sequential run
+    - the write_only quote writer runs in another thread and consumes the
+      normalized rows, in order, as soon as they are ready; with a
+      PricingEngine each row is priced from the rate tables on its way in;
+      a row's image is dropped from memory once the last row showing it
+      is written
+
+    A long-running caller can pass its own AsyncOpenAI client or
+    ProviderPool (left open) and the semaphore / limiter shared by all its
+    runs; otherwise a ProviderPool is opened for the run.
+
+    Returns the number of quoted items. Raises PipelineError if a stage fails.
+    """
+    loop = asyncio.get_running_loop()
+    if header_cache is None:
+        header_cache = HeaderMappingCache()
+    extracted = asyncio.Queue(maxsize=queue_size)
+    normalized = asyncio.Queue(maxsize=queue_size)
+    image_pool = ThreadPoolExecutor(max_workers=image_workers, thread_name_prefix="images")
+    image_jobs = {}     # image_file -> Future of the bytes to embed
+    ready_images = {}   # image_file -> bytes, filled just before the writer needs them
+    image_refs = {}     # image_file -> rows extracted but not written yet that show it
+    image_lock = threading.Lock()  # The extraction thread adds images, the writer thread drops them
+    box = int(IMAGE_MAX_SIZE * dpi_scale)
+    stop = threading.Event()  # Set when a later stage failed, extraction stops early
+
+    def prepare_image(data):
+        with profiling.accumulate("pipeline.image"):
+            return thumbnails.thumbnail(data, box) if thumbnails is not None else data
+
+    def prepare_image_file(image_file):
+        data = load_row_image(image_file, None, images_dir)
+        return prepare_image(data) if data is not None else None
+
+    def release_image(image_file):
+        """A row showing image_file was written, forget the image once no pending row needs it"""
+        with image_lock:
+            image_refs[image_file] -= 1
+            if not image_refs[image_file]:
+                del image_refs[image_file]
+                image_jobs.pop(image_file, None)
+                ready_images.pop(image_file, None)
+
+    def put_from_thread(queue, item):
+        asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+    # Stage 1: extraction thread
+    extract_state = {"finished": False}  # Set once normalization has taken the end marker (or error)
+
+    def extract():
+        try:
+            with profiling.span("pipeline.extract") as stats:
+                raw_images = {}
+                count = 0
+                for row in iter_customer_rows(input_file, images_dir, images=raw_images, merge_similar=merge_similar,
+                                              shared_images=shared_images):
+                    if stop.is_set():
+                        break
+                    image_file = row.get("image_file")
+                    if image_file not in (None, "null"):
+                        with image_lock:
+                            if image_file in raw_images:
+                                image_jobs[image_file] = image_pool.submit(prepare_image, raw_images.pop(image_file))
+                            elif image_file not in image_jobs:
+                                # Same bytes as an earlier image whose rows are all written: read it back
+                                image_jobs[image_file] = image_pool.submit(prepare_image_file, image_file)
+                            image_refs[image_file] = image_refs.get(image_file, 0) + 1
+                    put_from_thread(extracted, row)
+                    count += 1
+                stats.update(rows=count, images=len(image_jobs))
+            put_from_thread(extracted, _DONE)
+        except BaseException as e:
+            put_from_thread(extracted, e)
+            raise
+
+    async def next_row():
+        row = await extracted.get()
+        extract_state["finished"] = row is _DONE or isinstance(row, BaseException)
+        if isinstance(row, BaseException):
+            raise PipelineError(f"Extraction failed: {row}") from row
+        return row
+
+    # In-order hand-off from normalization (which may finish rows out of order) to the writer
+    ready = {}
+    changed = asyncio.Event()
+    room = asyncio.Event()
+    state = {"total": None, "error": None, "flushed": 0}
+
+    def emit(idx, item):
+        unresolved = normalize_values([item]) if item is not None else {}
+        if unresolved:
+            value_tasks.append(asyncio.create_task(resolve_item(idx, item, unresolved)))
+            return
+        ready[idx] = item
+        changed.set()
+
+    # Values the vocabularies don't know, asked about in batches shared by all rows
+    value_answers = {}  # (field, value) -> Future of the value to use
+    value_batch = {}    # field -> values not sent yet
+    value_tasks = []
+    value_stats = {"unresolved": 0, "resolved": 0, "sender": None}
+
+    async def resolve_item(idx, item, unresolved):
+        try:
+            for field, values in unresolved.items():
+                for value in values:
+                    if (field, value) not in value_answers:
+                        value_answers[(field, value)] = loop.create_future()
+                        value_batch.setdefault(field, []).append(value)
+                        if value_stats["sender"] is None:
+                            value_stats["sender"] = asyncio.create_task(send_values())
+                    item[field] = await value_answers[(field, value)]
+        finally:
+            ready[idx] = item
+            changed.set()
+
+    async def send_values():
+        await asyncio.sleep(VALUE_BATCH_SECONDS)
+        batch = dict(value_batch)
+        value_batch.clear()
+        value_stats["sender"] = None
+        # One stand-in item per distinct value, filled in by resolve_values_async
+        keys = [(field, value) for field, values in batch.items() for value in values]
+        items = [{field: value} for field, value in keys]
+        unresolved = {field: {} for field in batch}
+        for idx, (field, value) in enumerate(keys):
+            unresolved[field][value] = [idx]
+        value_stats["unresolved"] += len(keys)
+        if client is not None:
+            try:
+                with profiling.span("pipeline.values_llm", values=len(items)):
+                    async with semaphore:
+                        await limiter.wait()
+                        value_stats["resolved"] += await resolve_values_async(items, unresolved, client,
+                                                                              DEFAULT_MODEL, response_cache)
+            except Exception as e:
+                print(f"⚠️  Value normalization request failed ({e}), values kept as they are")
+        for (field, value), item in zip(keys, items):
+            value_answers[(field, value)].set_result(item[field])
+
+    async def flush():
+        next_idx = 0
+        while True:
+            while next_idx in ready:
+                item = ready.pop(next_idx)
+                next_idx += 1
+                if item is not None:
+                    await normalized.put(item)
+                state["flushed"] = next_idx
+                room.set()
+            if state["error"] is not None:
+                await normalized.put(state["error"])
+                return
+            if state["total"] is not None and next_idx >= state["total"]:
+                await normalized.put(_DONE)
+                return
+            changed.clear()
+            await changed.wait()
+
+    # Stage 2: normalization on the event loop
+    async def normalize(client):
+        head = []
+        row = await next_row()
+        while row is not _DONE and len(head) <= HEADER_SEARCH_ROWS:
+            head.append(row)
+            row = await next_row()
+        if not head:
+            raise PipelineError("No data extracted from Excel file")
+
+        found = find_local_mapping(head, header_cache)
+        if found is None and client is not None:
+            try:
+                print("🤖 Asking Qwen for the column mapping...")
+                answer = await request_header_mapping_async(client, mapping_columns(head), DEFAULT_MODEL)
+                if map_rows_with_answer(head, header_cache, answer) is not None:
+                    found = find_local_mapping(head, header_cache)
+                else:
+                    print("⚠️  No usable column mapping, sending all rows")
+            except Exception as e:
+                print(f"⚠️  Column mapping request failed ({e}), sending all rows")
+        if found is None and client is None:
+            raise PipelineError("DASHSCOPE_API_KEY (or ARK_API_KEY) environment variable not set")
+
+        async def wait_for_room(yielded):
+            while yielded - state["flushed"] >= WINDOW_ROWS:
+                room.clear()
+                await room.wait()
+
+        async def rows():
+            for yielded, head_row in enumerate(head):
+                await wait_for_room(yielded)
+                yield head_row
+            yielded, current = len(head), row
+            while current is not _DONE:
+                await wait_for_room(yielded)
+                yield current
+                yielded += 1
+                current = await next_row()
+
+        count = 0
+        with profiling.span("pipeline.normalize") as stats:
+            if found is not None:
+                header_row, header_texts, mapping = found
+                async for current in rows():
+                    mapped = apply_mapping([current], -1, header_texts, mapping) if count > header_row else []
+                    emit(count, mapped[0] if mapped else None)
+                    count += 1
+            else:
+                tasks = []
+
+                async def send(start, batch):
+                    results = await normalize_rows_async(
+                        batch, client, model=DEFAULT_MODEL, chunk_tokens=chunk_tokens, cache=response_cache,
+                        semaphore=semaphore, limiter=limiter, on_row=lambda idx, result: emit(start + idx, result),
+                    )
+                    if results is None:
+                        raise PipelineError("Failed to process data with Qwen API")
+
+                # Same budget as chunk_rows(), so each batch goes out as one request
+                batch, batch_tokens = [], 0
+                async for current in rows():
+                    tokens = row_tokens(current)
+                    if batch and (batch_tokens + tokens > chunk_tokens or len(batch) >= WINDOW_ROWS // 2):
+                        tasks.append(asyncio.create_task(send(count - len(batch), batch)))
+                        batch, batch_tokens = [], 0
+                    batch.append(current)
+                    batch_tokens += tokens
+                    count += 1
+                if batch:
+                    tasks.append(asyncio.create_task(send(count - len(batch), batch)))
+                try:
+                    await asyncio.gather(*tasks)
+                finally:
+                    for task in tasks:
+                        task.cancel()
+            stats.update(rows=count)
+        state["total"] = count
+
+    async def normalize_stage(client):
+        try:
+            await normalize(client)
+        except Exception as e:
+            state["error"] = e if isinstance(e, PipelineError) else PipelineError(f"Normalization failed: {e}")
+            # Unblock the extraction thread and let it finish
+            stop.set()
+            while not extract_state["finished"]:
+                item = await extracted.get()
+                extract_state["finished"] = item is _DONE or isinstance(item, BaseException)
+        finally:
+            changed.set()
+
+    # Stage 3: writer thread
+    writer_state = {"finished": False}
+    prices = []  # Unit price per written row, filled just before the writer needs it
+
+    def writer_rows():
+        while True:
+            item = asyncio.run_coroutine_threadsafe(normalized.get(), loop).result()
+            if item is _DONE or isinstance(item, BaseException):
+                writer_state["finished"] = True
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            image_file = item.get("image_file")
+            with image_lock:
+                job = image_jobs.get(image_file)
+            if job is not None:
+                data = job.result()
+                if data is not None:
+                    ready_images[image_file] = data
+            if pricing is not None:
+                prices.extend(pricing.price_items([item]))
+            yield item
+            # The writer asks for the next item only once this row is written
+            if job is not None:
+                release_image(image_file)
+
+    def write():
+        counted = []
+
+        def counting():
+            for item in writer_rows():
+                counted.append(None)
+                yield item
+
+        try:
+            with profiling.span("pipeline.generate") as stats:
+                write_quote_excel(counting(), output_filename, images=ready_images, dpi_scale=dpi_scale,
+                                  images_dir=images_dir, prices=prices if pricing is not None else None)
+                stats.update(items=len(counted), priced=sum(price is not None for price in prices))
+            if pricing is not None:
+                print(f"💰 Priced {sum(price is not None for price in prices)} of {len(prices)} items from the rate "
+                      f"tables")
+        except BaseException:
+            # Keep the earlier stages from blocking on a queue nobody reads
+            stop.set()
+            while not writer_state["finished"]:
+                item = asyncio.run_coroutine_threadsafe(normalized.get(), loop).result()
+                writer_state["finished"] = item is _DONE or isinstance(item, BaseException)
+            raise
+        return len(counted)
+
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(concurrency)
+    if limiter is None:
+        limiter = RateLimiter(requests_per_second)
+    own_client = client is None
+    if own_client:
+        client = open_pool()
+
+    try:
+        extract_future = loop.run_in_executor(None, extract)
+        write_future = loop.run_in_executor(None, write)
+        normalize_task = asyncio.create_task(normalize_stage(client))
+        flush_task = asyncio.create_task(flush())
+        results = await asyncio.gather(write_future, extract_future, normalize_task, flush_task,
+                                       return_exceptions=True)
+    finally:
+        image_pool.shutdown(wait=False, cancel_futures=True)
+        for task in [*value_tasks, value_stats["sender"]]:
+            if task is not None:
+                task.cancel()
+        if own_client and client is not None:
+            await client.close()
+
+    for result in results:
+        if isinstance(result, PipelineError):
+            raise result
+    for result in results:
+        if isinstance(result, BaseException):
+            raise PipelineError(f"Pipeline failed: {result}") from result
+    if value_stats["unresolved"] and client is not None:
+        print(f"✅ {value_stats['resolved']} of {value_stats['unresolved']} unrecognised values normalized with Qwen")
+    elif value_stats["unresolved"]:
+        print(f"⚠️  {value_stats['unresolved']} values not recognised, kept as they are")
+    return results[0]
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Unit pricing engine
+Prices normalized items in batch from local rate tables, reloaded when the file changes
+
+Nothing is priced unless a rates file exists (pricing_rates.example.json
+shows the format, its numbers are examples only). Items with a known part
+volume are priced by it, the others from the per-piece rates of their
+material and processes where the rates file has them.
+"""
+
+import json
+import math
+import os
+import sys
+import threading
+from bisect import bisect_right
+
+from values import EMPTY_VALUES, parse_quantity_value
+
+DEFAULT_RATES_FILE = "pricing_rates.json"
+EXAMPLE_RATES_FILE = "pricing_rates.example.json"  # Format reference, its numbers are not real rates
+
+# Batches smaller than this are priced in plain Python, NumPy's setup costs more than it saves
+NUMPY_MIN_ROWS = 256
+
+PRICE_FIELDS = ("Material", "Machining_Process", "Surface_Finish", "Quantity", "Volume_cm3")
+
+
+def split_color(value):
+    """("ABS", "黑色") for "ABS(黑色)", (value, None) without a color"""
+    text = str(value).strip()
+    if text.endswith(")") and "(" in text:
+        name, _, color = text[:-1].partition("(")
+        return name.strip(), color.strip()
+    return text, None
+
+
+def quantity_count(quantity):
+    """Pieces to price a line for, 1 when the quantity is missing or unreadable (as in the quote's column F)"""
+    if type(quantity) is int:
+        return quantity if quantity > 0 else 1
+    count = parse_quantity_value(quantity) if quantity not in EMPTY_VALUES else None
+    return count if count is not None and count > 0 else 1
+
+
+def part_volume(value):
+    """Part volume in cm³ from an item's Volume_cm3, NaN when missing or unreadable"""
+    if value in EMPTY_VALUES or isinstance(value, bool):
+        return math.nan
+    try:
+        volume = float(value)
+    except (TypeError, ValueError):
+        return math.nan
+    return volume if volume > 0 else math.nan
+
+
+class RateTable:
+    """One rates file compiled into index lookups
+
+    Every known material gets an integer code into lists of its stock cost
+    per cm³, stock cost per piece and default process. Process and finish
+    cells (which may list several, "喷砂 + 阳极氧化(黑色)") are parsed once per
+    distinct value; each distinct process combination gets a code into
+    lists of its fixed, per-cm³ and per-piece cost, setup fee and material
+    factor. Pricing then only gathers those lists by code and scales them
+    by each part's volume, or takes the per-piece costs without one.
+    """
+
+    def __init__(self, rates):
+        self.minimum = float(rates.get("minimum_unit_price", 0))
+        self.finishes = {name: float(cost) for name, cost in rates.get("finishes", {}).items()}
+        colors = rates.get("color_surcharges", {})
+        self.color_default = float(colors.get("default", 0))
+        self.colors = {name: float(cost) for name, cost in colors.items() if name != "default"}
+        breaks = sorted((float(quantity), float(factor)) for quantity, factor in rates.get("quantity_breaks", [[1, 1]]))
+        self.break_quantities = [quantity for quantity, _ in breaks]
+        self.break_factors = [factor for _, factor in breaks]
+
+        self.processes = rates.get("processes", {})
+        self.combo_codes = {}       # process cell -> combination code, -1 if unknown
+        self.combo_cost = []        # Per part: hourly_rate * hours
+        self.combo_per_cm3 = []     # Per part and cm³ of its volume
+        self.combo_per_piece = []   # Per part instead of per_cm3 when the volume is unknown, NaN if not given
+        self.combo_setup = []       # Once per line, spread over the quantity
+        self.combo_factor = []      # Stock bought per part volume
+
+        self.material_codes = {}
+        self.material_stock = []    # Cost of one cm³ of this material, before the process factor
+        self.material_piece = []    # Stock cost of one part of unknown volume, before the process factor (or NaN)
+        self.material_combo = []    # Combination code of the material's default process
+        for code, (name, material) in enumerate(rates.get("materials", {}).items()):
+            self.material_codes[name] = code
+            self.material_stock.append(float(material["density"]) / 1000 * float(material["price_per_kg"]))
+            self.material_piece.append(float(material.get("per_piece", math.nan)))
+            self.material_combo.append(self.process_code(material.get("process")))
+        self.finish_memo = {}
+
+    def process_code(self, process):
+        """Combination code for a process cell ("CNC", "CNC + 车削"), -1 if any part is unknown"""
+        if process in EMPTY_VALUES:
+            return -1
+        process = str(process)
+        code = self.combo_codes.get(process)
+        if code is not None:
+            return code
+        names = [name.strip() for name in process.split("+") if name.strip()]
+        if not names or any(name not in self.processes for name in names):
+            code = -1
+        else:
+            terms = [self.processes[name] for name in names]
+            code = len(self.combo_cost)
+            self.combo_cost.append(sum(float(term.get("hourly_rate", 0)) * float(term.get("hours", 0)) for term in terms))
+            self.combo_per_cm3.append(sum(float(term.get("per_cm3", 0)) for term in terms))
+            # A process charged by volume needs its own per-piece rate, the others cost nothing extra per piece
+            self.combo_per_piece.append(sum(float(term.get("per_piece", math.nan if float(term.get("per_cm3", 0)) else 0))
+                                            for term in terms))
+            self.combo_setup.append(sum(float(term.get("setup", 0)) for term in terms))
+            self.combo_factor.append(max(float(term.get("material_factor", 1)) for term in terms))
+        self.combo_codes[process] = code
+        return code
+
+    def finish_cost(self, finish):
+        """Surcharge for a finish cell, colors included; NaN if any finish is unknown"""
+        if finish in EMPTY_VALUES:
+            return 0.0
+        finish = str(finish)
+        cost = self.finish_memo.get(finish)
+        if cost is None:
+            cost = 0.0
+            for part in finish.split("+"):
+                name, color = split_color(part)
+                if not name:
+                    continue
+                if name not in self.finishes:
+                    cost = math.nan
+                    break
+                cost += self.finishes[name]
+                if color:
+                    cost += self.colors.get(color, self.color_default)
+            self.finish_memo[finish] = cost
+        return cost
+
+    def codes(self, materials, processes, finishes, quantities, volumes):
+        """Per-row (material code, process code, finish cost, quantity, volume) columns"""
+        material_codes = []
+        combo_codes = []
+        for material, process in zip(materials, processes):
+            code = -1 if material in EMPTY_VALUES else self.material_codes.get(split_color(material)[0], -1)
+            material_codes.append(code)
+            combo = self.process_code(process) if process not in EMPTY_VALUES else -1
+            if combo == -1 and process in EMPTY_VALUES and code >= 0:
+                combo = self.material_combo[code]
+            combo_codes.append(combo)
+        finish_costs = [self.finish_cost(finish) for finish in finishes]
+        counts = [quantity_count(quantity) for quantity in quantities]
+        return material_codes, combo_codes, finish_costs, counts, [part_volume(volume) for volume in volumes]
+
+    def price_python(self, material_codes, combo_codes, finish_costs, counts, volumes):
+        prices = []
+        for material, combo, finish, count, volume in zip(material_codes, combo_codes, finish_costs, counts, volumes):
+            if material < 0 or combo < 0 or math.isnan(finish):
+                prices.append(None)
+                continue
+            if math.isnan(volume):
+                stock = self.material_piece[material] * self.combo_factor[combo] + self.combo_per_piece[combo]
+            else:
+                stock = (self.material_stock[material] * self.combo_factor[combo] + self.combo_per_cm3[combo]) * volume
+            if math.isnan(stock):
+                prices.append(None)
+                continue
+            factor = self.break_factors[max(bisect_right(self.break_quantities, count) - 1, 0)]
+            unit = (stock + self.combo_cost[combo] + finish) * factor + self.combo_setup[combo] / count
+            prices.append(round(max(unit, self.minimum), 2))
+        return prices
+
+    def price_numpy(self, np, material_codes, combo_codes, finish_costs, counts, volumes):
+        material = np.asarray(material_codes, dtype=np.int64)
+        combo = np.asarray(combo_codes, dtype=np.int64)
+        finish = np.asarray(finish_costs, dtype=np.float64)
+        count = np.asarray(counts, dtype=np.float64)
+        volume = np.asarray(volumes, dtype=np.float64)
+        known = (material >= 0) & (combo >= 0) & ~np.isnan(finish)
+        # Unknown rows read the spare last slot of every array and are masked out afterwards
+        material_at = np.where(known, material, -1)
+        stock_per_cm3 = np.append(np.asarray(self.material_stock, dtype=np.float64), 0.0)[material_at]
+        stock_per_piece = np.append(np.asarray(self.material_piece, dtype=np.float64), 0.0)[material_at]
+        combo_at = np.where(known, combo, -1)
+        cost = np.append(np.asarray(self.combo_cost, dtype=np.float64), 0.0)[combo_at]
+        per_cm3 = np.append(np.asarray(self.combo_per_cm3, dtype=np.float64), 0.0)[combo_at]
+        per_piece = np.append(np.asarray(self.combo_per_piece, dtype=np.float64), 0.0)[combo_at]
+        setup = np.append(np.asarray(self.combo_setup, dtype=np.float64), 0.0)[combo_at]
+        process_factor = np.append(np.asarray(self.combo_factor, dtype=np.float64), 1.0)[combo_at]
+        stock = np.where(np.isnan(volume), stock_per_piece * process_factor + per_piece,
+                         (stock_per_cm3 * process_factor + per_cm3) * volume)
+        known &= ~np.isnan(stock)
+        breaks = np.searchsorted(np.asarray(self.break_quantities), count, side="right") - 1
+        factor = np.asarray(self.break_factors)[np.maximum(breaks, 0)]
+        unit = (np.nan_to_num(stock) + cost + np.nan_to_num(finish)) * factor + setup / count
+        unit = np.maximum(unit, self.minimum)
+        # Rounded by Python's round(), np.round's scaling disagrees with it on some half cents
+        return [round(price, 2) if ok else None for price, ok in zip(unit.tolist(), known.tolist())]
+
+    def price_columns(self, materials, processes, finishes, quantities, volumes):
+        """Unit price per row from the PRICE_FIELDS columns, None where it can't be priced
+
+        A row can't be priced if its material, process or finish is unknown,
+        or if its part volume is missing and there are no per-piece rates for
+        it.
+        unit = (stock + process cost + finish surcharges) * quantity break
+        factor + setup fees / quantity, at least minimum_unit_price, where
+        stock = (stock cost per cm³ * process material factor + process cost
+        per cm³) * volume, or without a volume = material per_piece * process
+        material factor + process per_piece (0 for processes not charged by
+        volume). Rows without a process use the material's default.
+        """
+        columns = self.codes(materials, processes, finishes, quantities, volumes)
+        if len(columns[0]) >= NUMPY_MIN_ROWS:
+            try:
+                import numpy as np
+            except ImportError:
+                np = None
+            if np is not None:
+                return self.price_numpy(np, *columns)
+        return self.price_python(*columns)
+
+
+class PricingEngine:
+    """RateTable from a JSON file, recompiled whenever the file changes on disk
+
+    The file is checked (one stat) on every call, so estimators can edit
+    the rates while a service keeps running. A file that fails to load
+    keeps the previous table in use. Safe to share between threads.
+    """
+
+    def __init__(self, path=DEFAULT_RATES_FILE):
+        self.path = path
+        self.table = None
+        self.stamp = None
+        self.reloads = 0
+        self.lock = threading.Lock()
+
+    def current(self):
+        """The RateTable for the file as it is now, None if there is no rates file"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return self.table
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            if stamp != self.stamp:
+                try:
+                    with open(self.path, encoding="utf-8") as f:
+                        self.table = RateTable(json.load(f))
+                    self.reloads += 1
+                except (OSError, ValueError, KeyError, TypeError) as e:
+                    print(f"⚠️  Could not load rates from {self.path} ({e}), keeping the previous rates")
+                self.stamp = stamp
+            return self.table
+
+    def price_columns(self, materials, processes, finishes, quantities, volumes):
+        table = self.current()
+        if table is None:
+            return [None] * len(materials)
+        with self.lock:  # The table's memos are filled while pricing
+            return table.price_columns(materials, processes, finishes, quantities, volumes)
+
+    def price_items(self, items):
+        """Unit price per normalized item (None where it can't be priced), for generate_quote_excel's prices"""
+        items = items if isinstance(items, list) else list(items)
+        return self.price_columns(*([item.get(field) for item in items] for field in PRICE_FIELDS))
+
+
+def main():
+    """Price an items JSON file (as written by cli.py normalize): python pricing.py <items.json> [rates.json]"""
+    args = sys.argv[1:]
+    if not args:
+        print("Usage: python pricing.py <items.json> [rates.json]")
+        sys.exit(1)
+    with open(args[0], encoding="utf-8") as f:
+        items = json.load(f)["items"]
+    engine = PricingEngine(args[1] if len(args) > 1 else DEFAULT_RATES_FILE)
+    if engine.current() is None:
+        print(f"⚠️  No rates file at {engine.path}, nothing is priced (see {EXAMPLE_RATES_FILE} for the format)")
+    prices = engine.price_items(items)
+    for item, price in zip(items, prices):
+        print(f"{item.get('Part_Name')}\t{item.get('Material')}\t{item.get('Quantity')}\t"
+              f"{item.get('Volume_cm3') or '—'}\t{price if price is not None else '—'}")
+    priced = sum(price is not None for price in prices)
+    print(f"💰 {priced} of {len(items)} items priced")
+
+
+if __name__ == "__main__":
+    main()
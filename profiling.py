@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Pipeline instrumentation
+Stage spans with wall/CPU time and memory, written as JSON lines and Chrome trace events
+"""
+
+import contextvars
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_profiler = None
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, None where unavailable"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if os.uname().sysname == "Darwin" else 1024), 1)
+
+
+class Profiler:
+    """Collects span records and writes them as they finish
+
+    Every record is one JSON line; with trace_path the same spans are also
+    saved as a Chrome trace (chrome://tracing, Perfetto) by finish().
+    Memory peaks come from tracemalloc (Python allocations) and the
+    process's max RSS. CPU time is process-wide, so spans that overlap
+    (concurrent LLM calls) share it.
+    """
+
+    def __init__(self, path, trace_path=None, trace_memory=True):
+        self.path = path
+        self.trace_path = trace_path
+        self.trace_memory = trace_memory
+        self.file = open(path, "w", encoding="utf-8")
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+        self.trace_events = []
+        self.totals = {}
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def write(self, record, trace=True):
+        with self.lock:
+            self.file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            if self.trace_path and trace:
+                self.trace_events.append({
+                    "name": record["name"],
+                    "ph": "X",
+                    "ts": round(record["start_ms"] * 1000),
+                    "dur": round(record["wall_ms"] * 1000),
+                    "pid": os.getpid(),
+                    "tid": record.get("tid", threading.get_ident()),
+                    "args": {key: value for key, value in record.items() if key not in ("name", "start_ms", "wall_ms")},
+                })
+
+    def finish(self):
+        for name, total in sorted(self.totals.items()):
+            self.write(dict(total, name=name, kind="total"), trace=False)
+        self.file.close()
+        if self.trace_path:
+            with open(self.trace_path, "w", encoding="utf-8") as f:
+                json.dump({"traceEvents": self.trace_events, "displayTimeUnit": "ms"}, f, default=str)
+
+
+def enable(path="profile.jsonl", trace_path=None, trace_memory=True):
+    """Start recording spans to path (JSON lines), optionally a Chrome trace too"""
+    global _profiler
+    _profiler = Profiler(path, trace_path, trace_memory)
+    return _profiler
+
+
+def enabled():
+    return _profiler is not None
+
+
+def finish():
+    """Flush totals and the trace file, then stop recording"""
+    global _profiler
+    if _profiler is not None:
+        _profiler.finish()
+        _profiler = None
+
+
+@contextmanager
+def span(name, **attrs):
+    """Time a stage; yields a dict for counts and other attributes to report
+
+    Spans nest (the parent is tracked per thread / asyncio task) and each
+    reports the tracemalloc peak reached while it was open.
+    """
+    profiler = _profiler
+    if profiler is None:
+        yield attrs
+        return
+
+    parent = _current_span.get()
+    state = {"name": name, "peak": 0}
+    token = _current_span.set(state)
+    if profiler.trace_memory:
+        _, parent_peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield attrs
+    finally:
+        wall = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+        _current_span.reset(token)
+        record = {
+            "name": name,
+            "parent": parent["name"] if parent else None,
+            "start_ms": round((start - profiler.origin) * 1000, 3),
+            "wall_ms": round(wall * 1000, 3),
+            "cpu_ms": round(cpu * 1000, 3),
+            "peak_rss_mb": peak_rss_mb(),
+            "tid": threading.get_ident(),
+        }
+        if profiler.trace_memory:
+            peak = max(tracemalloc.get_traced_memory()[1], state["peak"])
+            record["tracemalloc_peak_mb"] = round(peak / (1024 * 1024), 2)
+            # reset_peak() above hid the parent's earlier peak, hand it back
+            if parent is not None:
+                parent["peak"] = max(parent["peak"], peak, parent_peak)
+        record.update(attrs)
+        profiler.write(record)
+
+
+@contextmanager
+def accumulate(name):
+    """Add the wall/CPU time of many small calls (e.g. per-image encoding) to one total"""
+    profiler = _profiler
+    if profiler is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield
+    finally:
+        add(name, calls=1, wall_ms=(time.perf_counter() - start) * 1000, cpu_ms=(time.process_time() - cpu_start) * 1000)
+
+
+def add(name, **values):
+    """Sum counters (token counts, calls, ...) into a total reported by finish()"""
+    profiler = _profiler
+    if profiler is None:
+        return
+    with profiler.lock:
+        total = profiler.totals.setdefault(name, {})
+        for key, value in values.items():
+            total[key] = round(total.get(key, 0) + (value or 0), 3)
+
+
+def event(name, start, wall, **attrs):
+    """Record something timed elsewhere (start from time.perf_counter, wall in seconds)"""
+    profiler = _profiler
+    if profiler is None:
+        return
+    parent = _current_span.get()
+    profiler.write(dict({
+        "name": name,
+        "parent": parent["name"] if parent else None,
+        "start_ms": round((start - profiler.origin) * 1000, 3),
+        "wall_ms": round(wall * 1000, 3),
+        "tid": threading.get_ident(),
+    }, **attrs))
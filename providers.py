@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+LLM provider pool
+Per-call deadlines, jittered retries, hedging to an alternate provider and circuit breakers
+"""
+
+import asyncio
+import os
+import random
+import time
+from collections import deque
+
+import profiling
+from llm import DASHSCOPE_BASE_URL, DEFAULT_MODEL
+
+ARK_BASE_URL = "https://ark.cn-beijing.volces.com/api/v3"
+ARK_MODEL = "doubao-1.5-pro-32k-250115"
+
+DEFAULT_DEADLINE = 120.0      # Seconds one attempt may take, streaming included
+DEFAULT_POOL_RETRIES = 2
+HEDGE_QUANTILE = 0.95         # A call still running past this latency gets a duplicate on another provider
+HEDGE_MIN_SAMPLES = 20        # Latencies needed per kind of call before the quantile is trusted
+DEFAULT_HEDGE_DELAY = 20.0    # Hedge delay until then
+LATENCY_WINDOW = 200
+BREAKER_FAILURES = 5          # Consecutive failures that open a provider's circuit
+BREAKER_COOLDOWN = 30.0       # Seconds before an open circuit lets one probe call through
+
+
+class ProviderError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """Stops calls to a provider after repeated failures, probes it again after a cooldown
+
+    closed: calls go through. open: calls are refused until the cooldown
+    has passed, then one probe call is let through (half-open); its
+    success closes the circuit, its failure opens it again.
+    """
+
+    def __init__(self, failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN, clock=time.monotonic):
+        self.threshold = failures
+        self.cooldown = cooldown
+        self.clock = clock
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+
+    def allow(self):
+        """Whether a call may go out now; in half-open state this takes the single probe slot"""
+        if self.state == "open" and self.clock() - self.opened_at >= self.cooldown:
+            self.state = "half_open"
+        if self.state == "closed":
+            return True
+        if self.state == "half_open" and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def release(self):
+        """A call that was let through ended without an outcome (cancelled)"""
+        self.probing = False
+
+    def success(self):
+        self.state = "closed"
+        self.failures = 0
+        self.probing = False
+
+    def failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.state == "half_open" or self.failures >= self.threshold:
+            self.state = "open"
+            self.opened_at = self.clock()
+
+
+class Provider:
+    """One OpenAI-compatible endpoint: its client, model, deadline, breaker and recent latencies"""
+
+    def __init__(self, name, client, model, deadline=DEFAULT_DEADLINE, breaker=None, hedge_after=DEFAULT_HEDGE_DELAY):
+        self.name = name
+        self.client = client
+        self.model = model
+        self.deadline = deadline
+        self.hedge_after = hedge_after
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.latencies = {}  # kind of call -> recent successful latencies
+        self.calls = 0
+        self.failures = 0
+
+    def hedge_delay(self, kind):
+        """HEDGE_QUANTILE latency of this kind of call, hedge_after until there are enough samples"""
+        samples = self.latencies.get(kind, ())
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return min(self.hedge_after, self.deadline)
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(HEDGE_QUANTILE * len(ordered)))]
+
+    async def call(self, request, kind):
+        """request(client, model) under the deadline, outcome reported to the breaker"""
+        self.calls += 1
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(request(self.client, self.model), self.deadline)
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except asyncio.TimeoutError as e:
+            self.failures += 1
+            self.breaker.failure()
+            raise ProviderError(f"{self.name}: no answer within {self.deadline:g}s") from e
+        except Exception:
+            self.failures += 1
+            self.breaker.failure()
+            raise
+        self.breaker.success()
+        self.latencies.setdefault(kind, deque(maxlen=LATENCY_WINDOW)).append(time.perf_counter() - started)
+        return result
+
+
+class ProviderPool:
+    """Sends each call to the first provider whose circuit is closed, hedged on the others
+
+    run(request) awaits request(client, model) on a provider; anything it
+    raises (an API error, a response that doesn't parse) counts as a
+    failed attempt. A call still running past the provider's p95 latency
+    for its kind, or one that failed, gets a duplicate on the next
+    available provider; the first valid result wins and the other call is
+    cancelled. Failed calls are retried with jittered backoff.
+
+    Used in place of an AsyncOpenAI client by the llm.py functions, and
+    closed the same way (close() or async with).
+    """
+
+    def __init__(self, providers, retries=DEFAULT_POOL_RETRIES):
+        self.providers = list(providers)
+        self.retries = retries
+        self.hedges = 0
+        self.failovers = 0
+        self.rescued = 0  # Calls answered by a provider other than the first one tried
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        for provider in self.providers:
+            await provider.client.close()
+
+    def pick(self, exclude=()):
+        for provider in self.providers:
+            if provider not in exclude and provider.breaker.allow():
+                return provider
+        return None
+
+    async def race(self, request, kind):
+        """One attempt: the first provider, hedged or failed over to the others in turn"""
+        provider = self.pick()
+        if provider is None:
+            raise ProviderError("every provider's circuit is open")
+        started = time.perf_counter()
+        tried = [provider]
+        tasks = {asyncio.ensure_future(provider.call(request, kind)): provider}
+        hedge_at = provider.hedge_delay(kind)
+        errors = []
+        try:
+            while tasks:
+                timeout = None
+                if hedge_at is not None:
+                    timeout = max(0.0, hedge_at - (time.perf_counter() - started))
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    winner = tasks.pop(task)
+                    if task.exception() is None:
+                        if winner is not tried[0]:
+                            self.rescued += 1
+                        return task.result()
+                    errors.append(task.exception())
+                if done and tasks:
+                    continue  # The other call is still running
+                # Past the p95 (hedge) or failed (fail over): the next provider not tried yet
+                alternate = self.pick(exclude=tried)
+                if alternate is not None:
+                    if not done:
+                        self.hedges += 1
+                        profiling.add("llm.pool", hedges=1)
+                        print(f"⏱️  {tried[-1].name} slower than {hedge_at:.1f}s, hedging on {alternate.name}")
+                    else:
+                        self.failovers += 1
+                        profiling.add("llm.pool", failovers=1)
+                    tried.append(alternate)
+                    tasks[asyncio.ensure_future(alternate.call(request, kind))] = alternate
+                hedge_at = None  # At most one hedge per attempt
+            raise errors[-1]
+        finally:
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def run(self, request, kind="default", retries=None):
+        """Result of the first valid request(client, model), ProviderError or the last failure if none"""
+        retries = self.retries if retries is None else retries
+        for attempt in range(retries + 1):
+            if attempt:
+                await asyncio.sleep(min(10, 2 ** (attempt - 1)) * (0.5 + random.random()))
+            try:
+                return await self.race(request, kind)
+            except Exception as e:
+                if attempt == retries:
+                    raise
+                print(f"⚠️  LLM call failed (attempt {attempt + 1}): {e}")
+
+    def summary(self):
+        parts = [f"{provider.name} {provider.calls} calls, {provider.failures} failed, {provider.breaker.state}"
+                 for provider in self.providers]
+        return (f"{'; '.join(parts)}; {self.hedges} hedged, {self.failovers} failed over, "
+                f"{self.rescued} answered by another provider")
+
+
+def configured_providers():
+    """(name, api key, base url, model) of every provider with an API key in the environment, primary first
+
+    DASHSCOPE_API_KEY / DASHSCOPE_BASE_URL / DASHSCOPE_MODEL for Qwen,
+    ARK_API_KEY / ARK_BASE_URL / ARK_MODEL for Volcengine ark (doubao).
+    """
+    providers = []
+    if os.environ.get("DASHSCOPE_API_KEY"):
+        providers.append(("dashscope", os.environ["DASHSCOPE_API_KEY"],
+                          os.environ.get("DASHSCOPE_BASE_URL", DASHSCOPE_BASE_URL),
+                          os.environ.get("DASHSCOPE_MODEL", DEFAULT_MODEL)))
+    if os.environ.get("ARK_API_KEY"):
+        providers.append(("ark", os.environ["ARK_API_KEY"], os.environ.get("ARK_BASE_URL", ARK_BASE_URL),
+                          os.environ.get("ARK_MODEL", ARK_MODEL)))
+    return providers
+
+
+def open_pool(deadline=DEFAULT_DEADLINE, retries=DEFAULT_POOL_RETRIES):
+    """ProviderPool over configured_providers(), None if there are none
+
+    The clients don't retry on their own, the pool does.
+    """
+    configs = configured_providers()
+    if not configs:
+        return None
+    from openai import AsyncOpenAI
+
+    return ProviderPool([
+        Provider(name, AsyncOpenAI(api_key=api_key, base_url=base_url, timeout=deadline, max_retries=0), model,
+                 deadline=deadline)
+        for name, api_key, base_url, model in configs
+    ], retries=retries)
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+Write-optimized quote generator
+Streams the 手板报价单 layout row by row through a write_only worksheet
+"""
+
+import hashlib
+from copy import copy
+from zipfile import ZIP_DEFLATED, ZipFile
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.drawing.image import Image as XLImage
+from openpyxl.styles import Font, Alignment, PatternFill, NamedStyle
+from openpyxl.utils import get_column_letter
+from openpyxl.writer.excel import ExcelWriter
+
+import profiling
+from images import DEFAULT_DPI_SCALE, load_row_image, to_embeddable
+from values import EMPTY_VALUES, parse_quantity_value
+
+# Modern color palette
+BRAND_BLUE = "2E86AB"      # Professional blue
+ACCENT_BLUE = "A23B72"     # Accent color
+LIGHT_GRAY = "F8F9FA"      # Very light background
+MEDIUM_GRAY = "6C757D"     # Text gray
+DARK_GRAY = "343A40"       # Dark text
+SUCCESS_GREEN = "28A745"   # For totals
+
+FONT_NAME = 'Microsoft YaHei'
+MONEY_FORMAT = '"¥"#,##0.00'
+
+QUOTE_TITLE = "手板报价单"
+
+# Fillable customer fields (NO yellow)
+CUSTOMER_FIELDS = [
+    "甲方公司: ___________________________",
+    "联系人: ___________________________",
+    "电话: ___________________________",
+    "邮箱: ___________________________"
+]
+
+COMPANY_INFO = [
+    "乙方公司: 杭州越依模型科技有限公司",
+    "联系人: 傅士勤",
+    "电话: 137 7747 9066",
+    "地址: 杭州市富阳区东洲工业功能区1号路11号"
+]
+
+TABLE_HEADERS = ["序号", "零件图片", "零件名称", "表面处理", "材质", "数量", "单价(未税)", "总价(未税)"]
+HEADER_WIDTHS = [6, 12, 20, 12, 15, 8, 15, 15]
+
+# Clean terms list with fillable delivery time (NO yellow highlight)
+QUOTE_TERMS = [
+    "• 付款方式: 月结30天",
+    "• 交货期: 确认后 (     ) 个工作日内完成",  # Fillable, but NO highlight
+    "• 验收标准: 依据甲方2D、3D图纸及说明文档进行验收",
+    "• 本报价单适用于杭州海康威视科技有限公司及其子公司、关联公司",
+    "• 报价有效期: 30天",
+    "• 所有价格均为人民币不含税价格"
+]
+
+HEADER_ROW = 15
+DATA_START_ROW = 16
+DATA_ROW_HEIGHT = 65
+IMAGE_MAX_SIZE = 55  # Displayed image size in the picture column, px
+
+
+class PassthroughImage(XLImage):
+    """openpyxl image backed by raw bytes, written to the workbook unchanged
+
+    Images created with the same media dict share one media part: the
+    writer numbers every image, but only the first number sticks, so all
+    of them point at the same /xl/media file. Save with save_workbook()
+    so that file is written only once.
+    """
+
+    def __init__(self, data, info, media=None):
+        self.ref = None
+        self.raw = data
+        self.format, self.width, self.height = info
+        self.media = media if media is not None else {"id": None}
+
+    @property
+    def _id(self):
+        return self.media["id"]
+
+    @_id.setter
+    def _id(self, value):
+        if self.media["id"] is None:
+            self.media["id"] = value
+
+    def _data(self):
+        return self.raw
+
+
+def make_xl_image(data, media=None):
+    """openpyxl image for raw image bytes without decoding them
+
+    media is a dict kept for one workbook; identical bytes then share a
+    single media part in the saved file.
+    """
+    data, info = to_embeddable(data)
+    if media is None:
+        return PassthroughImage(data, info)
+    shared = media.setdefault(hashlib.sha256(data).digest(), {"id": None})
+    return PassthroughImage(data, info, shared)
+
+
+class SharedMediaWriter(ExcelWriter):
+    """ExcelWriter that stores a media part once however many images use it"""
+
+    def _write_images(self):
+        written = set()
+        for img in self._images:
+            if img.path not in written:
+                written.add(img.path)
+                self._archive.writestr(img.path[1:], img._data())
+
+
+def save_workbook(wb, filename):
+    """wb.save(filename) for workbooks whose images may share media parts"""
+    if wb.write_only and not wb.worksheets:
+        wb.create_sheet()
+    SharedMediaWriter(wb, ZipFile(filename, "w", ZIP_DEFLATED, allowZip64=True)).save()
+
+
+def format_surface_finish(surface_finish):
+    """Surface finish display, values are already cleaned up by values.normalize_values()"""
+    if surface_finish in EMPTY_VALUES:
+        return "—"
+    return str(surface_finish)
+
+
+def parse_quantity(quantity):
+    """Quantity as int/float, 0 when it can't be read"""
+    if isinstance(quantity, int) and not isinstance(quantity, bool):
+        return quantity
+    quantity = parse_quantity_value(quantity) if quantity not in EMPTY_VALUES else None
+    return quantity if quantity is not None else 0
+
+
+def unit_price(prices, idx):
+    """Unit price for data row idx, 0 (to be filled in) if none is known"""
+    if prices is None or idx >= len(prices) or prices[idx] is None:
+        return 0
+    return prices[idx]
+
+
+def quote_row_image(row_data, images=None, thumbnails=None, dpi_scale=DEFAULT_DPI_SCALE, images_dir="extracted_images",
+                    media=None):
+    """openpyxl image sized for the picture column, or None if the row has none
+
+    Pass the same media dict for every row of a workbook so that rows with
+    the same picture share one media part (see save_workbook).
+    """
+    if not row_data.get("image_file") or row_data["image_file"] == "null":
+        return None
+    img_bytes = load_row_image(row_data["image_file"], images, images_dir)
+    if img_bytes is None:
+        return None
+
+    # Resize image to fit nicely in cell
+    max_size = IMAGE_MAX_SIZE
+    if thumbnails is not None:
+        img_bytes = thumbnails.thumbnail(img_bytes, int(max_size * dpi_scale))
+    img = make_xl_image(img_bytes, media)
+    if img.width > max_size or img.height > max_size:
+        ratio = min(max_size/img.width, max_size/img.height)
+        img.width = int(img.width * ratio)
+        img.height = int(img.height * ratio)
+    return img
+
+
+def quote_styles():
+    """Named styles for every kind of cell in the quote, declared once per workbook"""
+    center = Alignment(horizontal='center', vertical='center')
+    left = Alignment(horizontal='left', vertical='center')
+    right = Alignment(horizontal='right', vertical='center')
+    center_wrap = Alignment(horizontal='center', vertical='center', wrap_text=True)
+    left_wrap = Alignment(horizontal='left', vertical='center', wrap_text=True)
+    body_font = Font(name=FONT_NAME, size=11, color=DARK_GRAY)
+    light_fill = PatternFill(start_color=LIGHT_GRAY, end_color=LIGHT_GRAY, fill_type="solid")
+
+    styles = [
+        NamedStyle("quote_title", font=Font(name=FONT_NAME, size=28, bold=True, color=DARK_GRAY), alignment=center),
+        NamedStyle("quote_section", font=Font(name=FONT_NAME, size=12, bold=True, color=DARK_GRAY), alignment=left),
+        NamedStyle("quote_field", font=body_font, alignment=left),
+        NamedStyle("quote_term", font=Font(name=FONT_NAME, size=10, color=MEDIUM_GRAY), alignment=left),
+        NamedStyle(
+            "quote_table_header",
+            font=Font(name=FONT_NAME, size=11, bold=True, color="FFFFFF"),
+            fill=PatternFill(start_color=BRAND_BLUE, end_color=BRAND_BLUE, fill_type="solid"),
+            alignment=center,
+        ),
+        NamedStyle("quote_subtotal_label", font=Font(name=FONT_NAME, size=12, bold=True, color=DARK_GRAY), alignment=right),
+        NamedStyle(
+            "quote_subtotal",
+            font=Font(name=FONT_NAME, size=12, bold=True, color=SUCCESS_GREEN),
+            fill=light_fill,
+            alignment=center,
+            number_format=MONEY_FORMAT,
+        ),
+        NamedStyle("quote_signature", font=Font(name=FONT_NAME, size=11, bold=True, color=DARK_GRAY), alignment=center),
+        NamedStyle("quote_signature_line", font=Font(name=FONT_NAME, size=10, color=MEDIUM_GRAY), alignment=center),
+    ]
+
+    # Data rows, plain and with the alternating background
+    for suffix, fill in (("", PatternFill()), ("_shaded", light_fill)):
+        styles += [
+            NamedStyle(f"quote_center{suffix}", font=body_font, fill=fill, alignment=center_wrap),
+            NamedStyle(f"quote_left{suffix}", font=body_font, fill=fill, alignment=left_wrap),
+            NamedStyle(f"quote_quantity{suffix}", font=body_font, fill=fill, alignment=center_wrap, number_format='#,##0'),
+            NamedStyle(f"quote_price{suffix}", font=body_font, fill=fill, alignment=center_wrap, number_format=MONEY_FORMAT),
+            NamedStyle(
+                f"quote_total{suffix}",
+                font=Font(name=FONT_NAME, size=11, bold=True, color=DARK_GRAY),
+                fill=fill,
+                alignment=center_wrap,
+                number_format=MONEY_FORMAT,
+            ),
+        ]
+    return styles
+
+
+# Named style per quote column (序号 ... 总价)
+DATA_COLUMN_STYLES = ["quote_center", "quote_center", "quote_left", "quote_left", "quote_left",
+                      "quote_quantity", "quote_price", "quote_total"]
+
+
+class QuoteSheetWriter:
+    """Appends rows to a write_only worksheet, filling the gaps between them"""
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.next_row = 1
+        self.style_arrays = {}
+
+    def cell(self, value, style):
+        cell = WriteOnlyCell(self.ws, value=value)
+        # Resolve each named style once, then reuse its style indices
+        style_array = self.style_arrays.get(style)
+        if style_array is None:
+            cell.style = style
+            self.style_arrays[style] = copy(cell._style)
+        else:
+            cell._style = copy(style_array)
+        return cell
+
+    def row(self, row_idx, cells=(), height=None, merge_to=None):
+        while self.next_row < row_idx:
+            self.ws.append([])
+            self.next_row += 1
+        if height is not None:
+            self.ws.row_dimensions[row_idx].height = height
+        if merge_to is not None:
+            self.ws.merged_cells.add(f"A{row_idx}:{merge_to}{row_idx}")
+        self.ws.append(cells)
+        self.ws.row_dimensions.pop(row_idx, None)  # Already written, keep memory flat
+        self.next_row = row_idx + 1
+
+
+def write_quote_excel(processed_data, output_filename, images=None, thumbnails=None, dpi_scale=DEFAULT_DPI_SCALE,
+                      images_dir="extracted_images", prices=None):
+    """Write the quote in one streaming pass, same layout as generate_quote_excel
+
+    Rows go straight to disk through a write_only worksheet and every cell
+    refers to a named style declared once, so memory stays flat with the
+    number of lines. Images are collected and written as one drawing part
+    when the workbook is saved. prices optionally holds a unit price per
+    item (None where unknown) for column G.
+    """
+    wb = Workbook(write_only=True)
+    for style in quote_styles():
+        wb.add_named_style(style)
+    ws = wb.create_sheet("Quote")
+
+    # Sheet-level settings must be in place before the first row is written
+    for col_num, width in enumerate(HEADER_WIDTHS, 1):
+        ws.column_dimensions[get_column_letter(col_num)].width = width
+    ws.sheet_view.showGridLines = False
+    ws.page_margins.left = 0.75
+    ws.page_margins.right = 0.75
+    ws.page_margins.top = 1.0
+    ws.page_margins.bottom = 1.0
+
+    out = QuoteSheetWriter(ws)
+
+    # Header blocks
+    out.row(1, [out.cell(QUOTE_TITLE, "quote_title")], height=45, merge_to="H")
+    out.row(3, [out.cell("甲方信息", "quote_section")], height=25, merge_to="H")
+    for i, field in enumerate(CUSTOMER_FIELDS, start=4):
+        out.row(i, [out.cell(field, "quote_field")], height=22, merge_to="H")
+    out.row(9, [out.cell("乙方信息", "quote_section")], height=25, merge_to="H")
+    for i, info in enumerate(COMPANY_INFO, start=10):
+        out.row(i, [out.cell(info, "quote_field")], height=20, merge_to="H")
+    out.row(14, height=25)
+    out.row(HEADER_ROW, [out.cell(header, "quote_table_header") for header in TABLE_HEADERS], height=35)
+
+    # Data rows (processed_data may be any iterable, e.g. rows still being normalized)
+    item_count = 0
+    media = {}
+    try:
+        for idx, row_data in enumerate(processed_data):
+            item_count = idx + 1
+            current_row = DATA_START_ROW + idx
+            suffix = "_shaded" if idx % 2 == 0 else ""
+            row_values = [
+                f"{idx + 1:02d}",  # Zero-padded serial number
+                "",  # Image placeholder
+                row_data.get("Part_Name", "—"),
+                format_surface_finish(row_data.get("Surface_Finish", "")),
+                row_data.get("Material", "—"),
+                parse_quantity(row_data.get("Quantity", 0)),
+                unit_price(prices, idx),  # Unit price, 0 is the placeholder
+                f"=F{current_row}*G{current_row}",
+            ]
+            out.row(
+                current_row,
+                [out.cell(value, style + suffix) for value, style in zip(row_values, DATA_COLUMN_STYLES)],
+                height=DATA_ROW_HEIGHT,
+            )
+
+            try:
+                with profiling.accumulate("generate.image"):
+                    img = quote_row_image(row_data, images, thumbnails, dpi_scale, images_dir, media)
+                if img is not None:
+                    img.anchor = f"B{current_row}"
+                    ws.add_image(img)
+            except Exception as e:
+                print(f"⚠️  Error adding image for row {current_row}: {e}")
+    except BaseException:
+        # The source failed mid-way: close the half-written sheet so its temp file is released cleanly
+        ws.close()
+        raise
+
+    # Totals section
+    total_row = item_count + DATA_START_ROW + 1
+    last_data_row = item_count + DATA_START_ROW - 1
+    out.row(
+        total_row,
+        [out.cell("小计", "quote_subtotal_label")] + [None] * 6
+        + [out.cell(f"=SUM(H{DATA_START_ROW}:H{last_data_row})", "quote_subtotal")],
+        height=35,
+        merge_to="G",
+    )
+
+    # Terms section
+    terms_start = total_row + 3
+    out.row(terms_start, [out.cell("条款说明", "quote_section")], height=25, merge_to="H")
+    for i, term in enumerate(QUOTE_TERMS, start=terms_start + 1):
+        out.row(i, [out.cell(term, "quote_term")], height=20, merge_to="H")
+
+    # Signature section
+    signature_row = terms_start + len(QUOTE_TERMS) + 3
+    out.row(signature_row, [None] * 5 + [out.cell("乙方签名确认", "quote_signature")], height=25)
+    ws.merged_cells.add(f"F{signature_row}:H{signature_row}")
+    out.row(signature_row + 2, [None] * 5 + [out.cell("________________________", "quote_signature_line")])
+    ws.merged_cells.add(f"F{signature_row + 2}:H{signature_row + 2}")
+
+    with profiling.span("generate.save", rows=item_count):
+        save_workbook(wb, output_filename)
+    print(f"✅ Modern quote Excel generated: {output_filename}")
+    return output_filename
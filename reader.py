@@ -2,46 +2,127 @@
 import subprocess
 import os
 import sys
-import glob
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from office_pool import ConversionService, convert_cold
 
-def convert_pptx_to_images(pptx_file, output_dir="./read"):
+DEFAULT_DPI = 96                # Plenty for reading slides on screen, far smaller than pdftoppm's 150
+THUMBNAIL_SIZE = 320            # Long side in px for thumbnail-only mode
+JPEG_QUALITY = 85
+IMAGE_FORMATS = {"png": "png", "jpeg": "jpg", "webp": "webp"}
+
+def pdf_page_count(pdf_file):
+    """Number of pages according to pdfinfo (ships with pdftoppm in poppler-utils)"""
+    result = subprocess.run(["pdfinfo", pdf_file], check=True, capture_output=True, text=True)
+    for line in result.stdout.splitlines():
+        if line.startswith("Pages:"):
+            return int(line.split()[1])
+    raise ValueError(f"pdfinfo reported no page count for {pdf_file}")
+
+def render_page(pdf_file, page, output_base, image_format="png", dpi=DEFAULT_DPI, size=None):
+    """Rasterize one page with pdftoppm -f/-l, returns the image path
+
+    size scales the long side to that many pixels and overrides dpi. WebP
+    isn't a pdftoppm output, those pages are rendered as PNG and re-encoded
+    with Pillow.
     """
-    Convert PPTX to individual slide images using LibreOffice + pdftoppm
+    cmd = ["pdftoppm", "-f", str(page), "-l", str(page), "-singlefile"]
+    if size:
+        cmd += ["-scale-to", str(size)]
+    else:
+        cmd += ["-r", str(dpi)]
+    if image_format == "jpeg":
+        cmd += ["-jpeg", "-jpegopt", f"quality={JPEG_QUALITY},optimize=y"]
+    else:
+        cmd += ["-png"]
+    subprocess.run(cmd + [pdf_file, output_base], check=True)
+
+    if image_format != "webp":
+        return f"{output_base}.{IMAGE_FORMATS[image_format]}"
+
+    from PIL import Image as PILImage
+
+    png_path = f"{output_base}.png"
+    webp_path = f"{output_base}.webp"
+    with PILImage.open(png_path) as img:
+        img.save(webp_path, format="webp", quality=JPEG_QUALITY, method=4)
+    os.remove(png_path)
+    return webp_path
+
+def rasterize_pdf(pdf_file, output_dir, base_name, image_format="png", dpi=DEFAULT_DPI, size=None,
+                  first_page=1, last_page=None, workers=None):
+    """Rasterize pages across a pool of pdftoppm processes, yields paths as pages finish
+
+    Pages are named {base_name}-NN like a single pdftoppm run would name
+    them, but come back in completion order.
+    """
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"Unsupported image format: {image_format}")
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    page_count = pdf_page_count(pdf_file)
+    last_page = min(last_page or page_count, page_count)
+    digits = len(str(page_count))
+    pages = range(max(first_page, 1), last_page + 1)
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = [
+            pool.submit(render_page, pdf_file, page,
+                        os.path.join(output_dir, f"{base_name}-{page:0{digits}d}"), image_format, dpi, size)
+            for page in pages
+        ]
+        try:
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+def iter_slide_images(pptx_file, output_dir="./read", service=None, image_format="png", dpi=DEFAULT_DPI,
+                      size=None, thumbnail=False, first_page=1, last_page=None, workers=None):
+    """
+    Convert PPTX to slide images, yielding each image path as soon as it is written
+
+    With a ConversionService the PDF is made by one of its warm soffice
+    instances, otherwise by a one-off soffice process. The intermediate PDF
+    lives in a per-job temp directory. thumbnail=True renders small JPEGs
+    (THUMBNAIL_SIZE on the long side) unless a format or size is given.
     """
     # Create output directory if it doesn't exist
     Path(output_dir).mkdir(parents=True, exist_ok=True)
     
     # Get the base filename without extension
     base_name = Path(pptx_file).stem
-    temp_pdf = f"{base_name}.pdf"
-    
-    try:
-        # Step 1: Convert PPTX to PDF using LibreOffice
+    if thumbnail:
+        size = size or THUMBNAIL_SIZE
+        image_format = "jpeg" if image_format == "png" else image_format
+
+    with tempfile.TemporaryDirectory(prefix="reader_") as job_dir:
+        # Step 1: Convert PPTX to PDF using LibreOffice (raises if no PDF was created)
         print(f"Converting {pptx_file} to PDF...")
-        subprocess.run([
-            "libreoffice", "--headless", "--convert-to", "pdf", pptx_file
-        ], check=True)
+        if service is not None:
+            temp_pdf = service.convert(pptx_file, job_dir)
+        else:
+            temp_pdf = convert_cold(pptx_file, job_dir)
         
-        # Step 2: Check if PDF was created
-        if not os.path.exists(temp_pdf):
-            raise FileNotFoundError(f"PDF conversion failed - {temp_pdf} not found")
-        
-        # Step 3: Convert PDF to PNG images using pdftoppm
+        # Step 2: Rasterize the pages in parallel with pdftoppm
         print(f"Converting PDF to images...")
-        output_prefix = os.path.join(output_dir, f"{base_name}")
-        subprocess.run([
-            "pdftoppm", "-png", temp_pdf, output_prefix
-        ], check=True)
-        
-        # Step 4: Clean up temp PDF
-        os.remove(temp_pdf)
-        
-        # Step 5: Count and report results
-        png_files = glob.glob(os.path.join(output_dir, f"{base_name}-*.png"))
-        print(f"✅ Successfully created {len(png_files)} slide images in {output_dir}")
-        
-        return png_files
+        yield from rasterize_pdf(temp_pdf, output_dir, base_name, image_format, dpi, size,
+                                 first_page, last_page, workers)
+        # Step 3: Clean up temp PDF (leaving the with block)
+
+def convert_pptx_to_images(pptx_file, output_dir="./read", service=None, **options):
+    """
+    Convert PPTX to individual slide images using LibreOffice + pdftoppm
+
+    options are passed on to iter_slide_images (image_format, dpi, size,
+    thumbnail, first_page, last_page, workers). Returns the image paths
+    in slide order.
+    """
+    try:
+        slide_files = sorted(iter_slide_images(pptx_file, output_dir, service, **options))
+        print(f"✅ Successfully created {len(slide_files)} slide images in {output_dir}")
+        return slide_files
         
     except subprocess.CalledProcessError as e:
         print(f"❌ Command failed: {e}")
@@ -54,21 +135,45 @@ def convert_pptx_to_images(pptx_file, output_dir="./read"):
         return None
 
 def main():
-    if len(sys.argv) != 2:
-        print("Usage: python convert_slides.py <pptx_file>")
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    options = {}
+    for arg in sys.argv[1:]:
+        if arg == "--thumbnail":
+            options["thumbnail"] = True
+        elif arg.startswith("--format="):
+            options["image_format"] = arg.split("=", 1)[1]
+        elif arg.startswith("--dpi="):
+            options["dpi"] = int(arg.split("=", 1)[1])
+        elif arg.startswith("--size="):
+            options["size"] = int(arg.split("=", 1)[1])
+        elif arg.startswith("--pages="):
+            first, _, last = arg.split("=", 1)[1].partition("-")
+            options["first_page"] = int(first)
+            options["last_page"] = int(last) if last else int(first)
+    if not args:
+        print("Usage: python convert_slides.py <pptx_file> [more.pptx ...] [options]")
+        print("  --format=png|jpeg|webp  --dpi=N  --size=PX  --pages=A-B  --thumbnail")
         sys.exit(1)
     
-    pptx_file = sys.argv[1]
+    pptx_files = args
     
-    if not os.path.exists(pptx_file):
-        print(f"❌ File not found: {pptx_file}")
-        sys.exit(1)
+    for pptx_file in pptx_files:
+        if not os.path.exists(pptx_file):
+            print(f"❌ File not found: {pptx_file}")
+            sys.exit(1)
+        
+        if not pptx_file.lower().endswith('.pptx'):
+            print("❌ File must be a .pptx file")
+            sys.exit(1)
     
-    if not pptx_file.lower().endswith('.pptx'):
-        print("❌ File must be a .pptx file")
-        sys.exit(1)
+    if len(pptx_files) == 1:
+        convert_pptx_to_images(pptx_files[0], **options)
+        return
     
-    convert_pptx_to_images(pptx_file)
+    # Several decks: keep soffice warm between them
+    with ConversionService() as service:
+        for pptx_file in pptx_files:
+            convert_pptx_to_images(pptx_file, service=service, **options)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Incremental re-quote
+Diffs a revised customer workbook against the manifest of the last run
+"""
+
+import hashlib
+import json
+import os
+import sys
+from collections import defaultdict
+
+from header_map import (HeaderMappingCache, apply_mapping, candidate_header_rows, find_local_mapping,
+                        mapped_columns, mapping_columns, map_rows_with_answer, rule_mapping)
+from images import ThumbnailCache
+from llm import DEFAULT_MODEL, normalize_rows, request_header_mapping
+from llm_cache import ResponseCache, fingerprint
+from pricing import PricingEngine
+from providers import configured_providers
+from quote_writer import DATA_START_ROW
+from unified import clean_values, extract_customer_excel, generate_quote_excel
+from values import EMPTY_VALUES
+
+MANIFEST_VERSION = 1
+
+
+def manifest_path(output_filename):
+    """The manifest lives next to the quote it describes"""
+    return f"{os.path.splitext(output_filename)[0]}.manifest.json"
+
+
+def load_manifest(path):
+    """Rows of the previous run, [] if there was none (or it is from another version)"""
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        return []
+    return manifest["rows"]
+
+
+def save_manifest(path, input_file, rows):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": MANIFEST_VERSION, "input": input_file, "rows": rows},
+                  f, ensure_ascii=False, indent=2, default=str)
+    os.replace(tmp_path, path)
+
+
+def image_hash(row, images):
+    """sha256 of the row's image bytes, None if it has no image"""
+    image_file = row.get("image_file")
+    if image_file in (None, "null") or image_file not in images:
+        return None
+    return hashlib.sha256(images[image_file]).hexdigest()
+
+
+def serial_columns(rows, found):
+    """Extracted column keys holding the customer's serial numbers, which shift whenever a row is inserted
+
+    found is find_local_mapping's answer; for a layout it doesn't know, the
+    alias table's best guess is used.
+    """
+    if found is not None:
+        _, header_texts, mapping = found
+    else:
+        _, header_texts = max(candidate_header_rows(rows), key=lambda candidate: len(rule_mapping(candidate[1])))
+        mapping = rule_mapping(header_texts)
+    key = mapped_columns(header_texts, mapping).get("Serial_Number")
+    return {key} if key is not None else set()
+
+
+def row_hash(row, img_hash, skip=()):
+    """Content hash of an extracted row: its non-empty cells outside skip, plus its image"""
+    return fingerprint({key: value for key, value in row.items()
+                        if key != "image_file" and key not in skip and value not in EMPTY_VALUES}, img_hash)
+
+
+def item_key(item, img_hash):
+    """Price key of a normalized item: its fields except the serial number, plus its image"""
+    return fingerprint({field: value for field, value in item.items()
+                        if field not in ("Serial_Number", "image_file") and value not in EMPTY_VALUES}, img_hash)
+
+
+def read_quote_prices(quote_file, count):
+    """Unit prices entered in column G of a generated quote, None where empty or not a number"""
+    if count == 0 or not os.path.exists(quote_file):
+        return [None] * count
+    import openpyxl
+
+    wb = openpyxl.load_workbook(quote_file, read_only=True)
+    try:
+        ws = wb.worksheets[0]
+        prices = [
+            value if isinstance(value, (int, float)) and value else None
+            for (value,) in ws.iter_rows(min_row=DATA_START_ROW, max_row=DATA_START_ROW + count - 1,
+                                         min_col=7, max_col=7, values_only=True)
+        ]
+    finally:
+        wb.close()
+    return prices + [None] * (count - len(prices))
+
+
+def items_per_row(rows, header_texts_mapping):
+    """Normalized item for each extracted row (None for header and empty rows)"""
+    header_row, header_texts, mapping = header_texts_mapping
+    items = []
+    for idx, row in enumerate(rows):
+        mapped = apply_mapping([row], -1, header_texts, mapping) if idx > header_row else []
+        items.append(mapped[0] if mapped else None)
+    return items
+
+
+def normalize_incremental(rows, hashes, previous, found, header_cache, response_cache=None):
+    """Normalized item per row, reusing the previous run's output for unchanged rows
+
+    Known header layouts (found, from find_local_mapping) are mapped locally
+    (instant, no reuse needed). For a new layout the model is asked once
+    for the column mapping; only if that fails are rows sent one by one,
+    and then only the changed ones. Returns None if normalization failed.
+    """
+    if found is not None:
+        return items_per_row(rows, found)
+
+    if not configured_providers():
+        print("❌ DASHSCOPE_API_KEY (or ARK_API_KEY) environment variable not set")
+        return None
+
+    try:
+        print("🤖 Asking Qwen for the column mapping...")
+        answer = request_header_mapping(mapping_columns(rows), model=DEFAULT_MODEL)
+        if map_rows_with_answer(rows, header_cache, answer) is not None:
+            return items_per_row(rows, find_local_mapping(rows, header_cache))
+        print("⚠️  No usable column mapping, sending changed rows")
+    except Exception as e:
+        print(f"⚠️  Column mapping request failed ({e}), sending changed rows")
+
+    previous_items = {entry["hash"]: entry["item"] for entry in previous}
+    changed = [idx for idx, row_key in enumerate(hashes) if row_key not in previous_items]
+    items = [previous_items.get(row_key) for row_key in hashes]
+    if changed:
+        print(f"🤖 Normalizing {len(changed)} changed rows with Qwen...")
+        results = normalize_rows([rows[idx] for idx in changed], model=DEFAULT_MODEL, cache=response_cache)
+        if results is None:
+            return None
+        for idx, result in zip(changed, results):
+            items[idx] = result
+
+    # Earlier items carry the earlier image names, point them at this run's files
+    for idx, item in enumerate(items):
+        if item is not None:
+            items[idx] = dict(item, image_file=rows[idx].get("image_file", "null"))
+    return items
+
+
+def requote(input_file, output_filename="手板报价单.xlsx", images_dir="extracted_images", streaming=False):
+    """Re-run the pipeline for a revised workbook, returns the quote file or None
+
+    Rows whose content and image are unchanged since the last run keep
+    their normalized output and the unit price entered in the previous
+    quote; unchanged images are not rewritten. Other rows are priced from
+    the rate tables. Rows are matched by content, not position or serial
+    number, so inserting or deleting rows doesn't lose prices; identical
+    rows take the previous prices of their twins in order.
+    """
+    path = manifest_path(output_filename)
+    previous = load_manifest(path)
+
+    # Pick up prices entered since the last run, in quote order (a rate-table price left as it was doesn't count)
+    quoted = [entry for entry in previous if entry["item"] is not None]
+    for entry, price in zip(quoted, read_quote_prices(output_filename, len(quoted))):
+        if price is not None and price != entry.get("rate_price"):
+            entry["price"] = price
+
+    print("\n=== STEP 1: EXTRACTING DATA ===")
+    images = {}
+    rows = extract_customer_excel(input_file, images_dir, streaming=streaming, images=images)
+    if not rows:
+        print("❌ No data extracted from Excel file")
+        return None
+
+    header_cache = HeaderMappingCache()
+    found = find_local_mapping(rows, header_cache)
+    serials = serial_columns(rows, found)
+    image_hashes = [image_hash(row, images) for row in rows]
+    hashes = [row_hash(row, img_hash, serials) for row, img_hash in zip(rows, image_hashes)]
+    previous_hashes = {entry["hash"] for entry in previous}
+    unchanged = sum(row_key in previous_hashes for row_key in hashes)
+    removed = len(previous_hashes - set(hashes))
+    print(f"🔍 {unchanged} rows unchanged, {len(rows) - unchanged} added or changed, {removed} removed")
+
+    print("\n=== STEP 2: NORMALIZING CHANGED ROWS ===")
+    response_cache = ResponseCache()
+    try:
+        items = normalize_incremental(rows, hashes, previous, found, header_cache, response_cache)
+        if items is not None:
+            clean_values([item for item in items if item is not None], response_cache)
+    finally:
+        response_cache.close()
+    if items is None:
+        print("❌ Failed to process data with Qwen API")
+        return None
+
+    # Previous prices per item key, in quote order, handed out in order to identical rows
+    previous_prices = defaultdict(list)
+    for entry in previous:
+        if entry["item"] is not None:
+            previous_prices[item_key(entry["item"], entry.get("image_hash"))].append(entry.get("price"))
+    quoted_rows = [(item, img_hash) for item, img_hash in zip(items, image_hashes) if item is not None]
+    processed_data = [item for item, _ in quoted_rows]
+    rate_prices = PricingEngine().price_items(processed_data)
+    kept_prices = []
+    for item, img_hash in quoted_rows:
+        twins = previous_prices[item_key(item, img_hash)]
+        kept_prices.append(twins.pop(0) if twins else None)
+    prices = [kept if kept is not None else rate for kept, rate in zip(kept_prices, rate_prices)]
+
+    print("\n=== STEP 3: GENERATING QUOTE ===")
+    thumbnails = ThumbnailCache()
+    quote_file = generate_quote_excel(processed_data, output_filename, images=images, thumbnails=thumbnails,
+                                      write_only=True, images_dir=images_dir, prices=prices)
+
+    kept_iter, rate_iter = iter(kept_prices), iter(rate_prices)
+    save_manifest(path, input_file, [
+        {"hash": row_key, "image_hash": img_hash, "item": item,
+         "price": next(kept_iter) if item is not None else None,
+         "rate_price": next(rate_iter) if item is not None else None}
+        for row_key, img_hash, item in zip(hashes, image_hashes, items)
+    ])
+    kept = sum(price is not None for price in kept_prices)
+    priced = sum(price is not None for price in prices) - kept
+    print(f"💰 Kept {kept} of {len(prices)} unit prices from the previous quote, {priced} priced from the rate tables")
+    return quote_file
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    streaming = "--stream" in sys.argv[1:]
+    if not args:
+        print("Usage: python requote.py <revised_excel_file> [output.xlsx] [--stream]")
+        print("Example: python requote.py input_v2.xlsx")
+        sys.exit(1)
+
+    input_file = args[0]
+    output_filename = args[1] if len(args) > 1 else "手板报价单.xlsx"
+    if not os.path.exists(input_file):
+        print(f"❌ Input file not found: {input_file}")
+        sys.exit(1)
+
+    print(f"🚀 Incremental re-quote: {input_file} -> {output_filename}")
+    quote_file = requote(input_file, output_filename, streaming=streaming)
+    if quote_file is None:
+        sys.exit(1)
+    print(f"\n🎉 SUCCESS! 📝 Quote updated: {quote_file}")
+
+
+if __name__ == "__main__":
+    main()
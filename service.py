@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Local quote service
+Long-running HTTP server that turns uploaded customer workbooks into quotes with warm state
+"""
+
+import asyncio
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlparse
+
+from header_map import HeaderMappingCache
+from images import ThumbnailCache, prune_shared_images
+from llm import DEFAULT_CONCURRENCY, DEFAULT_REQUESTS_PER_SECOND, RateLimiter
+from llm_cache import ResponseCache
+from pipeline import PipelineError, run_pipeline
+from pricing import PricingEngine
+from providers import open_pool
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8600
+DEFAULT_WORKERS = 2             # Quotes generated at the same time
+DEFAULT_MAX_QUEUE = 32          # Jobs waiting or running before new uploads are refused
+DEFAULT_JOBS_DIR = "service_jobs"
+SHARED_IMAGES_DIR = "shared_images"  # Under jobs_dir, one copy of each distinct picture for all jobs
+MAX_UPLOAD_BYTES = 100 * 1024 * 1024
+RESULT_TTL_SECONDS = 3600       # Finished jobs (and their files) are kept this long
+QUOTE_FILENAME = "手板报价单.xlsx"
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+class QuoteService:
+    """Job queue in front of run_pipeline(), with state kept warm between jobs
+
+    One event loop runs in a background thread and owns everything that is
+    expensive to set up: the LLM ProviderPool (keep-alive connections,
+    latency history and circuit breakers for every job), the LLM
+    concurrency and rate limits, the pricing engine, the header
+    mapping, response and thumbnail caches. At most `workers` jobs run at
+    once; up to `max_queue` may be waiting or running, further submissions
+    are refused. Each distinct picture is stored once in
+    jobs_dir/shared_images and hard-linked into the jobs showing it.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, max_queue=DEFAULT_MAX_QUEUE, jobs_dir=DEFAULT_JOBS_DIR,
+                 concurrency=DEFAULT_CONCURRENCY, requests_per_second=DEFAULT_REQUESTS_PER_SECOND,
+                 merge_similar=False):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.jobs_dir = jobs_dir
+        self.shared_images = os.path.join(jobs_dir, SHARED_IMAGES_DIR)
+        self.merge_similar = merge_similar
+        self.concurrency = concurrency
+        self.requests_per_second = requests_per_second
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.loop = None
+        self.thread = None
+        self.started = time.time()
+
+    def start(self):
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        self.loop = asyncio.new_event_loop()
+        # Every running job holds two threads (extraction and writer) for its whole duration
+        self.loop.set_default_executor(ThreadPoolExecutor(max_workers=2 * self.workers + 2,
+                                                          thread_name_prefix="quote_job"))
+        self.thread = threading.Thread(target=self.loop.run_forever, name="quote_service", daemon=True)
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self.setup(), self.loop).result()
+
+    async def setup(self):
+        """Created on the loop thread, which is the only one that uses them"""
+        self.job_slots = asyncio.Semaphore(self.workers)
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.limiter = RateLimiter(self.requests_per_second)
+        self.header_cache = HeaderMappingCache()
+        self.response_cache = ResponseCache()
+        self.thumbnails = ThumbnailCache()
+        # Rates are compiled once here and again only when pricing_rates.json changes
+        self.pricing = PricingEngine()
+        self.pricing.current()
+        # One pool for the service's lifetime, so its keep-alive connections, latency history and
+        # circuit breakers are shared by every job
+        self.client = open_pool()
+        if self.client is None:
+            print("⚠️  DASHSCOPE_API_KEY (or ARK_API_KEY) not set, only sheets with a known header layout can be quoted")
+
+    async def teardown(self):
+        if self.client is not None:
+            await self.client.close()
+        self.response_cache.close()
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self.teardown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def submit(self, data, filename="upload.xlsx"):
+        """Queue a workbook (bytes), returns the job dict or None if the queue is full"""
+        self.purge()
+        with self.lock:
+            active = sum(job["status"] in ("queued", "running") for job in self.jobs.values())
+            if active >= self.max_queue:
+                return None
+            job_id = uuid.uuid4().hex[:12]
+            job_dir = os.path.join(self.jobs_dir, job_id)
+            job = {
+                "id": job_id,
+                "status": "queued",
+                "filename": os.path.basename(filename) or "upload.xlsx",
+                "dir": job_dir,
+                "submitted": time.time(),
+                "done": threading.Event(),
+            }
+            self.jobs[job_id] = job
+
+        os.makedirs(job_dir, exist_ok=True)
+        with open(os.path.join(job_dir, "input.xlsx"), "wb") as f:
+            f.write(data)
+        asyncio.run_coroutine_threadsafe(self.run_job(job), self.loop)
+        return job
+
+    async def run_job(self, job):
+        try:
+            async with self.job_slots:
+                job.update(status="running", started=time.time())
+                item_count = await run_pipeline(
+                    os.path.join(job["dir"], "input.xlsx"),
+                    os.path.join(job["dir"], QUOTE_FILENAME),
+                    images_dir=os.path.join(job["dir"], "extracted_images"),
+                    header_cache=self.header_cache,
+                    response_cache=self.response_cache,
+                    thumbnails=self.thumbnails,
+                    client=self.client,
+                    semaphore=self.semaphore,
+                    limiter=self.limiter,
+                    pricing=self.pricing,
+                    merge_similar=self.merge_similar,
+                    shared_images=self.shared_images,
+                )
+            job.update(status="done", items=item_count, quote=os.path.join(job["dir"], QUOTE_FILENAME))
+        except PipelineError as e:
+            job.update(status="failed", error=str(e))
+        except Exception as e:
+            job.update(status="failed", error=f"{type(e).__name__}: {e}")
+        finally:
+            job["finished"] = time.time()
+            job["seconds"] = round(job["finished"] - job.get("started", job["submitted"]), 3)
+            print(f"{'✅' if job['status'] == 'done' else '❌'} Job {job['id']} {job['filename']} ({job['seconds']}s)")
+            job["done"].set()
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def purge(self):
+        """Forget finished jobs older than RESULT_TTL_SECONDS and delete their files (and pictures only they showed)"""
+        cutoff = time.time() - RESULT_TTL_SECONDS
+        with self.lock:
+            stale = [job for job in self.jobs.values() if job.get("finished", time.time()) < cutoff]
+            for job in stale:
+                del self.jobs[job["id"]]
+        for job in stale:
+            shutil.rmtree(job["dir"], ignore_errors=True)
+        if stale and os.path.isdir(self.shared_images):
+            prune_shared_images(self.shared_images)
+
+    def stats(self):
+        with self.lock:
+            statuses = [job["status"] for job in self.jobs.values()]
+        return {
+            "uptime_seconds": round(time.time() - self.started),
+            "workers": self.workers,
+            "queued": statuses.count("queued"),
+            "running": statuses.count("running"),
+            "done": statuses.count("done"),
+            "failed": statuses.count("failed"),
+            "llm": self.client is not None,
+            "llm_providers": self.client.summary() if self.client is not None else None,
+            "response_cache": {"hits": self.response_cache.hits, "misses": self.response_cache.misses},
+            "thumbnail_cache": {"hits": self.thumbnails.hits, "misses": self.thumbnails.misses},
+        }
+
+
+def job_summary(job):
+    return {key: value for key, value in job.items() if key not in ("dir", "done", "quote")}
+
+
+class QuoteHandler(BaseHTTPRequestHandler):
+    """HTTP front end, see main() for the routes"""
+
+    service = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_quote(self, job):
+        with open(job["quote"], "rb") as f:
+            body = f.read()
+        self.send_response(200)
+        self.send_header("Content-Type", XLSX_MIME)
+        self.send_header("Content-Disposition", f"attachment; filename*=UTF-8''{quote(QUOTE_FILENAME)}")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-Job-Id", job["id"])
+        self.send_header("X-Quote-Items", str(job["items"]))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_result(self, job):
+        if job["status"] == "done":
+            self.send_quote(job)
+        elif job["status"] == "failed":
+            self.send_json(422, job_summary(job))
+        else:
+            self.send_json(202, job_summary(job))
+
+    def do_GET(self):
+        parts = urlparse(self.path).path.strip("/").split("/")
+        if parts == ["health"]:
+            self.send_json(200, self.service.stats())
+        elif len(parts) in (2, 3) and parts[0] == "jobs":
+            job = self.service.get(parts[1])
+            if job is None:
+                self.send_json(404, {"error": "Unknown job"})
+            elif len(parts) == 3 and parts[2] == "quote":
+                self.send_result(job)
+            elif len(parts) == 2:
+                self.send_json(200, job_summary(job))
+            else:
+                self.send_json(404, {"error": "Not found"})
+        else:
+            self.send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path.rstrip("/") != "/quote":
+            self.send_json(404, {"error": "Not found"})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0 or length > MAX_UPLOAD_BYTES:
+            self.send_json(413 if length else 400, {"error": "Send the .xlsx file as the request body"})
+            return
+        data = self.rfile.read(length)
+        params = parse_qs(url.query)
+        job = self.service.submit(data, params.get("filename", ["upload.xlsx"])[0])
+        if job is None:
+            self.send_json(503, {"error": "Too many quotes in progress, try again shortly"})
+            return
+        if params.get("async", ["0"])[0] not in ("", "0", "false"):
+            self.send_json(202, job_summary(job))
+            return
+        job["done"].wait()
+        self.send_result(job)
+
+
+def main():
+    """Service entry point: python service.py [--host H] [--port N] [--workers N] [--max_queue N] [--merge-similar-images]"""
+    options = {"--host": DEFAULT_HOST, "--port": DEFAULT_PORT, "--workers": DEFAULT_WORKERS,
+               "--max_queue": DEFAULT_MAX_QUEUE}
+    merge_similar = False
+    args = sys.argv[1:]
+    i = 0
+    while i < len(args):
+        if args[i] == "--merge-similar-images":
+            merge_similar = True
+            i += 1
+        elif args[i] in options and i + 1 < len(args):
+            options[args[i]] = args[i + 1] if args[i] == "--host" else int(args[i + 1])
+            i += 2
+        else:
+            print("Usage: python service.py [--host H] [--port N] [--workers N] [--max_queue N] "
+                  "[--merge-similar-images]")
+            print("  POST /quote[?async=1&filename=name.xlsx]  body: the customer .xlsx, returns the quote")
+            print("  GET  /jobs/<id>, /jobs/<id>/quote          job status / finished quote")
+            print("  GET  /health                               queue and cache statistics")
+            sys.exit(1)
+
+    service = QuoteService(workers=options["--workers"], max_queue=options["--max_queue"],
+                           merge_similar=merge_similar)
+    service.start()
+    QuoteHandler.service = service
+    server = ThreadingHTTPServer((options["--host"], options["--port"]), QuoteHandler)
+    server.daemon_threads = True
+    print(f"🚀 Quote service listening on http://{options['--host']}:{options['--port']} "
+          f"({options['--workers']} workers)")
+    print(f"   curl --data-binary @input.xlsx -o {QUOTE_FILENAME} http://{options['--host']}:{options['--port']}/quote")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Shutting down")
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
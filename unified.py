@@ -4,43 +4,61 @@ Excel Quote Generator MVP
 Drop in Excel file → Get formatted quote Excel out
 """
 
-import openpyxl
-from openpyxl.drawing.image import Image as OpenpyxlImage
-from openpyxl import Workbook
-from openpyxl.drawing.image import Image as XLImage
-from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
-from openpyxl.utils import get_column_letter
-from PIL import Image as PILImage
+# openpyxl, PIL and the openai SDK are imported inside the stages that use
+# them, so usage errors and early exits don't pay for loading them
+import asyncio
 import os
-import json
 import sys
-from io import BytesIO
-from datetime import datetime
-from openai import OpenAI
+import zipfile
+import profiling
+from xlsx_stream import sheet_parts, iter_image_anchors, worksheet_names
+from assign import assign_images_to_rows
+from llm import (DEFAULT_MODEL, DEFAULT_CHUNK_TOKENS, DEFAULT_CONCURRENCY,
+                 DEFAULT_REQUESTS_PER_SECOND, RateLimiter, normalize_rows_async, request_header_mapping_async)
+from llm_cache import ResponseCache
+from header_map import HeaderMappingCache, map_rows_locally, mapping_columns, map_rows_with_answer
+from images import DEFAULT_DPI_SCALE, ImageStore, ThumbnailCache
+from pricing import PricingEngine
+from providers import configured_providers, open_pool
+from values import normalize_values, resolve_values_async, unresolved_count
 
-def extract_customer_excel(file_path, images_output_dir):
-    """Extract data and images from customer Excel file"""
-    wb = openpyxl.load_workbook(file_path)
+SHEET_KEY = "sheet"  # Sheet of origin on rows and items of a multi-sheet extraction
+
+def extract_customer_excel(file_path, images_output_dir, streaming=False, images=None, sheets=None, workers=None,
+                           merge_similar=False, shared_images=None):
+    """Extract data and images from customer Excel file
+
+    If images is a dict, the saved image bytes are also kept there by file
+    name so the quote writer can use them without reading the files back.
+    Only the active sheet is read unless sheets is given ("all" or a list
+    of sheet names), see extract_sheets(). merge_similar and shared_images
+    go to the ImageStore (merge near-duplicate pictures, keep each distinct
+    picture once in a directory shared across jobs).
+    """
+    if sheets is not None:
+        return extract_sheets(file_path, images_output_dir, sheets, workers=workers, images=images,
+                              merge_similar=merge_similar, shared_images=shared_images)
+    if streaming:
+        return extract_customer_excel_streaming(file_path, images_output_dir, images, merge_similar=merge_similar,
+                                                shared_images=shared_images)
+
+    import openpyxl
+
+    with profiling.span("extract.load_workbook"):
+        wb = openpyxl.load_workbook(file_path)
     ws = wb.active
 
     # Build headers
-    headers = []
-    for idx, cell in enumerate(ws[1]):
-        if cell.value is not None:
-            headers.append(cell.value)
-        else:
-            headers.append(f"Unnamed_Column_{idx+1}")
+    headers = build_headers(cell.value for cell in ws[1])
 
-    os.makedirs(images_output_dir, exist_ok=True)
+    store = ImageStore(images_output_dir, merge_similar=merge_similar, shared_dir=shared_images)
 
     # Get worksheet dimensions
     max_data_row = ws.max_row
     
     print("=== EXTRACTING IMAGES ===")
     
-    # First pass: calculate all image positions and scores for each row
-    image_candidates = {}  # {image_index: [(row, score), ...]}
-    
+    image_spans = []
     for i, img in enumerate(ws._images):
         anchor = img.anchor
         from_row = anchor._from.row + 1  # Convert to 1-based
@@ -56,242 +74,382 @@ def extract_customer_excel(file_path, images_output_dir):
             to_col = from_col + 1
         
         print(f"Image {i}: from=({from_row},{from_col}) to=({to_row},{to_col})")
-        
-        # Calculate scores for all possible data rows
-        candidates = []
-        for data_row in range(2, max_data_row + 1):
-            score = calculate_image_row_score(from_row, to_row, data_row)
-            if score > 0:  # Only consider positive scores
-                candidates.append((data_row, score))
-        
-        # Sort by score (highest first)
-        candidates.sort(key=lambda x: x[1], reverse=True)
-        image_candidates[i] = candidates
+        image_spans.append((from_row, to_row))
 
-    # Second pass: use Hungarian-like assignment to avoid conflicts
-    images_by_row = {}
-    assigned_images = set()
-    
-    # Start with images that have fewer good options (more constrained)
-    image_constraint_order = sorted(
-        image_candidates.keys(), 
-        key=lambda i: len([c for c in image_candidates[i] if c[1] > 5])
-    )
-    
-    for img_idx in image_constraint_order:
-        if img_idx in assigned_images:
-            continue
-            
-        candidates = image_candidates[img_idx]
-        
-        # Find best unassigned row
-        for row, score in candidates:
-            if row not in images_by_row:
-                images_by_row[row] = ws._images[img_idx]
-                assigned_images.add(img_idx)
-                print(f"Assigned image {img_idx} to row {row} (score: {score:.1f})")
-                break
-        else:
-            # No unassigned row found, handle conflict
-            if candidates:
-                best_row, best_score = candidates[0]
-                if best_row in images_by_row:
-                    # Check if we should replace the existing assignment
-                    current_img_idx = list(ws._images).index(images_by_row[best_row])
-                    current_candidates = image_candidates.get(current_img_idx, [])
-                    current_score = next((s for r, s in current_candidates if r == best_row), 0)
-                    
-                    if best_score > current_score * 1.2:  # 20% better to replace
-                        # Try to relocate the current image
-                        relocated = False
-                        for alt_row, alt_score in current_candidates:
-                            if alt_row not in images_by_row and alt_score > current_score * 0.7:  # Accept 30% score drop
-                                images_by_row[alt_row] = images_by_row[best_row]
-                                relocated = True
-                                break
-                        
-                        if relocated or len(current_candidates) <= 1:  # Replace if relocated or current has no alternatives
-                            images_by_row[best_row] = ws._images[img_idx]
-                            assigned_images.add(img_idx)
-
-    # Third pass: handle any remaining unassigned images
-    unassigned_images = set(range(len(ws._images))) - assigned_images
-    unassigned_rows = set(range(2, max_data_row + 1)) - set(images_by_row.keys())
-    
-    if unassigned_images and unassigned_rows:
-        print(f"Assigning remaining {len(unassigned_images)} images to {len(unassigned_rows)} rows")
-        
-        # Simple proximity-based assignment for remainders
-        for img_idx in unassigned_images:
-            if not unassigned_rows:
-                break
-                
-            img = ws._images[img_idx]
-            anchor = img.anchor
-            from_row = anchor._from.row + 1
-            
-            # Find closest unassigned row
-            closest_row = min(unassigned_rows, key=lambda r: abs(r - from_row))
-            images_by_row[closest_row] = img
-            unassigned_rows.remove(closest_row)
+    with profiling.span("extract.assign_images", images=len(image_spans), rows=max_data_row):
+        images_by_row = {
+            row: ws._images[img_idx]
+            for row, img_idx in assign_images_to_rows(image_spans, max_data_row).items()
+        }
 
     # Build the structured data
     structured_data = []
     for row_idx, row in enumerate(ws.iter_rows(min_row=2), start=2):
-        row_data = {}
-        for col_idx, cell in enumerate(row):
-            if col_idx < len(headers):
-                column_name = headers[col_idx]
-                row_data[column_name] = cell.value if cell.value is not None else "null"
+        row_data = build_row_data(headers, (cell.value for cell in row))
 
         image_filename = None
         if row_idx in images_by_row:
-            openpyxl_img: OpenpyxlImage = images_by_row[row_idx]
-            image_filename = f"image_row_{row_idx}.png"
-            image_path = os.path.join(images_output_dir, image_filename)
-            img_bytes = openpyxl_img._data()
-            img_pil = PILImage.open(BytesIO(img_bytes))
-            img_pil.save(image_path)
+            openpyxl_img = images_by_row[row_idx]
+            image_filename = save_row_image(openpyxl_img._data(), row_idx, store, images)
 
         row_data['image_file'] = image_filename if image_filename is not None else "null"
         structured_data.append(row_data)
 
-    print(f"✅ Extracted {len(structured_data)} rows with {len(images_by_row)} images")
+    print(f"✅ Extracted {len(structured_data)} rows with {len(images_by_row)} images ({store.summary()})")
     return structured_data
 
-def calculate_image_row_score(img_from_row, img_to_row, data_row):
-    """Calculate how well an image matches a data row"""
-    
-    # Ensure img_to_row is at least img_from_row
-    img_to_row = max(img_to_row, img_from_row)
-    
-    # Calculate overlap between image span and data row
-    overlap_start = max(img_from_row, data_row)
-    overlap_end = min(img_to_row, data_row + 1)
-    overlap = max(0, overlap_end - overlap_start)
-    
-    if overlap <= 0:
-        # No overlap, but calculate proximity penalty
-        if data_row < img_from_row:
-            distance = img_from_row - data_row
+def extract_customer_excel_streaming(file_path, images_output_dir, images=None, merge_similar=False,
+                                     shared_images=None):
+    """Extract data and images row by row without loading the whole workbook
+
+    Cell values come from a read-only workbook, image anchors and bytes are
+    read straight from the drawing and media parts of the xlsx zip, so only
+    one image is held in memory at a time.
+    """
+    return list(iter_customer_rows(file_path, images_output_dir, images, merge_similar=merge_similar,
+                                   shared_images=shared_images))
+
+def iter_customer_rows(file_path, images_output_dir, images=None, store=None, sheet=None, image_prefix="",
+                       merge_similar=False, shared_images=None):
+    """Generator behind extract_customer_excel_streaming, yields each row as soon as it is read
+
+    Image anchors are all read (and assigned to rows) before the first row
+    comes out; each row's image is saved before the row is yielded, through
+    store if given (an ImageStore) instead of files in images_output_dir
+    (with the merge_similar and shared_images options of
+    extract_customer_excel). sheet names the worksheet to read (default the active one), image file
+    names start with image_prefix.
+    """
+    import openpyxl
+
+    with profiling.span("extract.load_workbook", read_only=True):
+        wb = openpyxl.load_workbook(file_path, read_only=True)
+    try:
+        ws = wb[sheet] if sheet is not None else wb.active
+        if ws.max_row is None or ws.max_column is None:
+            ws.calculate_dimension(force=True)  # No <dimension> tag, scan once for the size
+        max_data_row = ws.max_row
+        max_column = ws.max_column
+
+        # Build headers
+        header_values = next(ws.iter_rows(min_row=1, max_row=1, max_col=max_column, values_only=True), ())
+        headers = build_headers(header_values)
+
+        if store is None:
+            store = ImageStore(images_output_dir, merge_similar=merge_similar, shared_dir=shared_images)
+
+        with zipfile.ZipFile(file_path) as zf:
+            sheet_path = dict(sheet_parts(zf))[ws.title]
+
+            print("=== EXTRACTING IMAGES ===")
+
+            anchors = list(iter_image_anchors(zf, sheet_path))
+            for i, anchor in enumerate(anchors):
+                print(f"Image {i}: from=({anchor.from_row},{anchor.from_col}) to=({anchor.to_row},{anchor.to_col})")
+
+            with profiling.span("extract.assign_images", images=len(anchors), rows=max_data_row):
+                image_by_row = assign_images_to_rows(
+                    [(anchor.from_row, anchor.to_row) for anchor in anchors], max_data_row
+                )
+
+            # Build the structured data
+            row_count = 0
+            rows = ws.iter_rows(min_row=2, max_row=max_data_row, max_col=max_column, values_only=True)
+            for row_idx in range(2, max_data_row + 1):
+                row_data = build_row_data(headers, next(rows, ()))
+
+                image_filename = None
+                if row_idx in image_by_row:
+                    img_bytes = zf.read(anchors[image_by_row[row_idx]].media_path)
+                    image_filename = save_row_image(img_bytes, row_idx, store, images, image_prefix)
+
+                row_data['image_file'] = image_filename if image_filename is not None else "null"
+                row_count += 1
+                yield row_data
+    finally:
+        wb.close()
+
+    print(f"✅ Extracted {row_count} rows with {len(image_by_row)} images ({store.summary()})")
+
+def build_headers(values):
+    """Column names from the first row, with placeholders for empty cells"""
+    headers = []
+    for idx, value in enumerate(values):
+        if value is not None:
+            headers.append(value)
         else:
-            distance = data_row - img_to_row
-        
-        # Proximity score (decreases with distance)
-        if distance <= 2:
-            return max(0, 2 - distance)  # Score 2 for adjacent, 1 for 1 row away
+            headers.append(f"Unnamed_Column_{idx+1}")
+    return headers
+
+def build_row_data(headers, values):
+    """Map one row of cell values onto the header names"""
+    row_data = {column_name: "null" for column_name in headers}
+    for col_idx, value in enumerate(values):
+        if col_idx < len(headers):
+            row_data[headers[col_idx]] = value if value is not None else "null"
+    return row_data
+
+def save_row_image(img_bytes, row_idx, store, images=None, prefix=""):
+    """Store the image assigned to a row and return its file name
+
+    PNG/JPEG/GIF bytes are written unchanged, only other formats get
+    decoded and converted to PNG. Rows whose image is the same as an
+    earlier row's share that row's file.
+    """
+    with profiling.accumulate("extract.save_image"):
+        image_filename, stored = store.add(img_bytes, f"{prefix}image_row_{row_idx}")
+    if images is not None and stored is not None:
+        images[image_filename] = stored
+    return image_filename
+
+def select_sheets(file_path, sheets="all"):
+    """Worksheet names to extract: every visible one for "all", else the given names in workbook order"""
+    with zipfile.ZipFile(file_path) as zf:
+        available = worksheet_names(zf)
+        all_names = [name for name, _ in sheet_parts(zf)]
+    if sheets == "all":
+        return available
+    unknown = [name for name in sheets if name not in all_names]
+    if unknown:
+        raise ValueError(f"Unknown sheet(s) {', '.join(unknown)}; workbook has: {', '.join(available)}")
+    return [name for name in all_names if name in sheets]
+
+def extract_sheet(file_path, images_output_dir, sheet, image_prefix, merge_similar=False, shared_images=None):
+    """Process pool worker: one sheet's rows (tagged with the sheet) and its image bytes"""
+    images = {}
+    rows = []
+    for row in iter_customer_rows(file_path, images_output_dir, images=images, sheet=sheet, image_prefix=image_prefix,
+                                  merge_similar=merge_similar, shared_images=shared_images):
+        row[SHEET_KEY] = sheet
+        rows.append(row)
+    return rows, images
+
+def extract_sheets(file_path, images_output_dir, sheets="all", workers=None, images=None, merge_similar=False,
+                   shared_images=None):
+    """Extract several worksheets at once, one worker process per sheet
+
+    Each sheet keeps its own header row and image-to-row assignment; its
+    image files are named sheet<n>_image_row_<row>.<ext> after the sheet's
+    position in the workbook. The rows come back in workbook order as one
+    list, each tagged with SHEET_KEY, ready for a single process_with_qwen()
+    and quote generation over the whole workbook.
+    """
+    names = select_sheets(file_path, sheets)
+    if not names:
+        print("❌ No worksheets to extract")
+        return []
+    with zipfile.ZipFile(file_path) as zf:
+        positions = {name: position for position, (name, _) in enumerate(sheet_parts(zf), start=1)}
+    os.makedirs(images_output_dir, exist_ok=True)
+    jobs = [(file_path, images_output_dir, name, f"sheet{positions[name]}_", merge_similar, shared_images)
+            for name in names]
+
+    print(f"=== EXTRACTING {len(names)} SHEETS: {', '.join(names)} ===")
+    workers = min(len(jobs), workers or os.cpu_count() or 1)
+    with profiling.span("extract.sheets", sheets=len(names), workers=workers) as stats:
+        if workers == 1:
+            results = [extract_sheet(*job) for job in jobs]
         else:
-            return 0
-    
-    # Base score from overlap amount
-    overlap_score = overlap * 10
-    
-    # Bonus for perfect alignment (image starts exactly at data row)
-    alignment_bonus = 3 if img_from_row == data_row else 0
-    
-    # Bonus for image center being close to row center
-    img_center = (img_from_row + img_to_row) / 2
-    row_center = data_row + 0.5
-    center_distance = abs(img_center - row_center)
-    center_bonus = max(0, 2 - center_distance)  # Up to 2 points for perfect centering
-    
-    # Penalty for very large images (they might span multiple rows incorrectly)
-    img_height = img_to_row - img_from_row
-    size_penalty = min(2, max(0, img_height - 3))  # Penalty for images > 3 rows tall
-    
-    total_score = overlap_score + alignment_bonus + center_bonus - size_penalty
-    
-    return max(0, total_score)
+            from concurrent.futures import ProcessPoolExecutor
+
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(extract_sheet, *zip(*jobs)))
+        structured_data = []
+        for name, (rows, sheet_images) in zip(names, results):
+            print(f"📄 {name}: {len(rows)} rows, {len(sheet_images)} images")
+            structured_data.extend(rows)
+            if images is not None:
+                images.update(sheet_images)
+        stats.update(rows=len(structured_data))
+
+    print(f"✅ Extracted {len(structured_data)} rows from {len(names)} sheets")
+    return structured_data
+
+def split_sheets(rows):
+    """[(sheet, rows without the sheet tag)] in order of first appearance, [(None, rows)] for untagged rows"""
+    groups = {}
+    for row in rows:
+        sheet = row.get(SHEET_KEY)
+        groups.setdefault(sheet, []).append({key: value for key, value in row.items() if key != SHEET_KEY}
+                                            if sheet is not None else row)
+    return list(groups.items()) or [(None, rows)]
+
+def process_with_qwen(extracted_data, chunk_tokens=DEFAULT_CHUNK_TOKENS, concurrency=DEFAULT_CONCURRENCY,
+                      requests_per_second=DEFAULT_REQUESTS_PER_SECOND, header_cache=None, response_cache=None):
+    """Process extracted data using Qwen API
+
+    Header layouts seen before (or recognised by the alias table) are mapped
+    locally without any API call; for a new layout the model is asked once
+    for the column mapping, which is cached in header_mappings.json. Only if
+    that fails are the rows themselves sent, in token-budgeted chunks,
+    several at a time; rows already in response_cache (a ResponseCache)
+    are not sent again. Calls go through a ProviderPool (providers.py):
+    DashScope first, hedged on Volcengine ark when ARK_API_KEY is set.
+    DASHSCOPE_BASE_URL / ARK_BASE_URL can point the run at other
+    OpenAI-compatible endpoints (e.g. local stub servers).
 
-def process_with_qwen(extracted_data):
-    """Process extracted data using Qwen API"""
+    Rows from a multi-sheet extraction are mapped sheet by sheet (each has
+    its own header layout), the sheets needing the API all share one client
+    and rate limit, and every item keeps its SHEET_KEY.
+
+    Material, process, finish and quantity values are then cleaned up by
+    clean_values().
+    """
+    if header_cache is None:
+        header_cache = HeaderMappingCache()
+
+    groups = split_sheets(extracted_data) if extracted_data else [(None, extracted_data)]
+    processed = {}
+    pending = []
+    for sheet, rows in groups:
+        with profiling.span("normalize.local_mapping", rows=len(rows or ()), sheet=sheet):
+            processed[sheet] = map_rows_locally(rows, header_cache) if rows else None
+        if processed[sheet] is None:
+            pending.append((sheet, rows))
+    if not pending:
+        processed_data = merge_sheets(groups, processed)
+        print(f"✅ Processed {len(processed_data)} items without API call")
+        return clean_values(processed_data, response_cache)
     
     # Check for API key
-    if not os.environ.get("DASHSCOPE_API_KEY"):
-        print("❌ DASHSCOPE_API_KEY environment variable not set")
+    if not configured_providers():
+        print("❌ DASHSCOPE_API_KEY (or ARK_API_KEY) environment variable not set")
         return None
-    
-    # Initialize OpenAI client for Qwen
-    client = OpenAI(
-        api_key=os.environ.get("DASHSCOPE_API_KEY"),
-        base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-    )
-    
-    # Create prompt
-    prompt = f"""You must translate and restructure the extracted JSON data into our internal CNC machining company Excel log format:
 
-    Internal format required:
-    - Serial_Number: 
-    - Part_Name: 
-    - Quantity: 
-    - Material: 
-    - Machining_Process: 
-    - Surface_Finish: 
-    - Notes: (or N/A if none)
-    - image_file: (exact file name or null if not present - DO NOT modify filenames)
+    async def run():
+        semaphore = asyncio.Semaphore(concurrency)
+        limiter = RateLimiter(requests_per_second)
+        async with open_pool() as client:
+            return await asyncio.gather(*(
+                process_with_client(
+                    rows,
+                    client,
+                    header_cache,
+                    response_cache=response_cache,
+                    chunk_tokens=chunk_tokens,
+                    concurrency=concurrency,
+                    semaphore=semaphore,
+                    limiter=limiter,
+                )
+                for _, rows in pending
+            ))
+
+    for (sheet, _), items in zip(pending, asyncio.run(run())):
+        if items is None:
+            return None
+        processed[sheet] = items
+    return clean_values(merge_sheets(groups, processed), response_cache)
+
+def clean_values(processed_data, response_cache=None):
+    """Normalize material, process, finish and quantity values, locally where the vocabularies know them
 
-    Instructions to follow:
-    - Translate Chinese keys exactly according to my mapping.
-    - Keep original data values the same.
-    - DON'T modify or lose the "image_file" reference. Pass it along unchanged.
-    - Output structured valid JSON ONLY. NO OTHER TEXT. Don't output empty roles. 
+    Only the distinct values they don't recognise are sent to the model,
+    in one request (answers are kept in response_cache); without an API
+    key those values stay as they were.
+    """
+    with profiling.span("normalize.values", items=len(processed_data)) as stats:
+        unresolved = normalize_values(processed_data)
+        stats.update(unresolved=unresolved_count(unresolved))
+    if not unresolved:
+        return processed_data
+
+    if not configured_providers():
+        print(f"⚠️  {unresolved_count(unresolved)} values not recognised, kept as they are")
+        return processed_data
+
+    async def run():
+        async with open_pool() as client:
+            return await resolve_values_async(processed_data, unresolved, client, DEFAULT_MODEL, response_cache)
+
+    try:
+        with profiling.span("normalize.values_llm", values=unresolved_count(unresolved)):
+            resolved = asyncio.run(run())
+        print(f"✅ {resolved} of {unresolved_count(unresolved)} unrecognised values normalized with Qwen")
+    except Exception as e:
+        print(f"⚠️  Value normalization request failed ({e}), values kept as they are")
+    return processed_data
 
-    Here is the input JSON data:
+def merge_sheets(groups, processed):
+    """Items of every sheet in workbook order, tagged with their sheet again"""
+    merged = []
+    for sheet, _ in groups:
+        for item in processed[sheet]:
+            if sheet is not None:
+                item[SHEET_KEY] = sheet
+            merged.append(item)
+    return merged
 
-    {json.dumps(extracted_data, ensure_ascii=False)}"""
+async def process_with_client(extracted_data, client, header_cache, response_cache=None, **kwargs):
+    """LLM half of process_with_qwen on an already open AsyncOpenAI client or ProviderPool
 
+    Batch runs share one client (and rate limit) across all their files;
+    kwargs are passed on to normalize_rows_async.
+    """
+    try:
+        print("🤖 Asking Qwen for the column mapping...")
+        with profiling.span("normalize.header_mapping_llm"):
+            answer = await request_header_mapping_async(client, mapping_columns(extracted_data), DEFAULT_MODEL)
+        processed_data = map_rows_with_answer(extracted_data, header_cache, answer)
+        if processed_data is not None:
+            print(f"✅ Processed {len(processed_data)} items with cached column mapping")
+            return processed_data
+        print("⚠️  No usable column mapping, sending all rows")
+    except Exception as e:
+        print(f"⚠️  Column mapping request failed ({e}), sending all rows")
+    
     try:
         print("🤖 Processing with Qwen API...")
-        response = client.chat.completions.create(
-            model="qwen-turbo",
-            messages=[{"role": "user", "content": prompt}],
-        )
-        
-        # Get the response content
-        qwen_response = response.choices[0].message.content.strip()
-        
-        # Clean and parse the response
-        if qwen_response.startswith('```json'):
-            qwen_response = qwen_response[7:-3]
-        elif qwen_response.startswith('```'):
-            qwen_response = qwen_response[3:-3]
-        
-        # Parse JSON response
-        processed_data = json.loads(qwen_response)
+        with profiling.span("normalize.rows_llm", rows=len(extracted_data)) as stats:
+            processed_data = await normalize_rows_async(
+                extracted_data,
+                client,
+                model=DEFAULT_MODEL,
+                cache=response_cache,
+                **kwargs,
+            )
+            stats["items"] = len(processed_data or ())
+        if processed_data is None:
+            return None
         print(f"✅ Processed {len(processed_data)} items with Qwen")
         return processed_data
         
-    except json.JSONDecodeError as e:
-        print(f"❌ Error parsing JSON: {e}")
-        print(f"Raw response: {qwen_response}")
-        return None
     except Exception as e:
         print(f"❌ API call failed: {e}")
         return None
 
-def generate_quote_excel(processed_data, output_filename):
-    """Generate beautifully formatted modern quote Excel file (no yellow fills!)"""
+def generate_quote_excel(processed_data, output_filename, images=None, thumbnails=None, dpi_scale=DEFAULT_DPI_SCALE,
+                         write_only=False, images_dir="extracted_images", prices=None):
+    """Generate beautifully formatted modern quote Excel file (no yellow fills!)
+
+    images optionally maps image_file names to bytes already in memory,
+    anything missing is read from images_dir. With a ThumbnailCache
+    in thumbnails, pictures are downscaled to the displayed cell size times
+    dpi_scale before embedding. write_only=True streams the same layout
+    through quote_writer.write_quote_excel (flat memory for large quotes).
+    prices optionally carries known unit prices into column G.
+    """
+    from openpyxl import Workbook
+    from openpyxl.styles import Font, Alignment, PatternFill
+    from openpyxl.utils import get_column_letter
+    from quote_writer import (BRAND_BLUE, LIGHT_GRAY, MEDIUM_GRAY, DARK_GRAY, SUCCESS_GREEN, QUOTE_TITLE,
+                              CUSTOMER_FIELDS, COMPANY_INFO, TABLE_HEADERS, HEADER_WIDTHS, QUOTE_TERMS,
+                              HEADER_ROW, DATA_START_ROW, DATA_ROW_HEIGHT, format_surface_finish, parse_quantity,
+                              quote_row_image, save_workbook, unit_price, write_quote_excel)
+
+    if write_only:
+        return write_quote_excel(processed_data, output_filename, images, thumbnails, dpi_scale, images_dir, prices)
     
     # Create workbook and worksheet
     wb = Workbook()
     ws = wb.active
     ws.title = "Quote"
 
-    # Modern color palette
-    BRAND_BLUE = "2E86AB"      # Professional blue
-    ACCENT_BLUE = "A23B72"     # Accent color
-    LIGHT_GRAY = "F8F9FA"      # Very light background
-    MEDIUM_GRAY = "6C757D"     # Text gray
-    DARK_GRAY = "343A40"       # Dark text
-    SUCCESS_GREEN = "28A745"   # For totals
-    # FILL_YELLOW = "FFF3CD"   # Highlight color (REMOVED, not used)
-
     # Set default font for the entire sheet
     ws.sheet_properties.defaultRowHeight = 18
     
     # Modern header section with clean spacing
     ws.merge_cells('A1:H1')
-    ws['A1'] = "手板报价单"
+    ws['A1'] = QUOTE_TITLE
     ws['A1'].font = Font(name='Microsoft YaHei', size=28, bold=True, color=DARK_GRAY)
     ws['A1'].alignment = Alignment(horizontal='center', vertical='center')
     ws.row_dimensions[1].height = 45
@@ -303,15 +461,7 @@ def generate_quote_excel(processed_data, output_filename):
     ws['A3'].alignment = Alignment(horizontal='left', vertical='center')
     ws.row_dimensions[3].height = 25
     
-    # Fillable customer fields (NO yellow)
-    customer_fields = [
-        "甲方公司: ___________________________",
-        "联系人: ___________________________", 
-        "电话: ___________________________",
-        "邮箱: ___________________________"
-    ]
-    
-    for i, field in enumerate(customer_fields, start=4):
+    for i, field in enumerate(CUSTOMER_FIELDS, start=4):
         ws.merge_cells(f'A{i}:H{i}')
         ws[f'A{i}'] = field
         ws[f'A{i}'].font = Font(name='Microsoft YaHei', size=11, color=DARK_GRAY)
@@ -327,14 +477,7 @@ def generate_quote_excel(processed_data, output_filename):
     ws.row_dimensions[9].height = 25
     
     # Company details in a clean layout
-    company_info = [
-        "乙方公司: 杭州越依模型科技有限公司",
-        "联系人: 傅士勤",
-        "电话: 137 7747 9066", 
-        "地址: 杭州市富阳区东洲工业功能区1号路11号"
-    ]
-    
-    for i, info in enumerate(company_info, start=10):
+    for i, info in enumerate(COMPANY_INFO, start=10):
         ws.merge_cells(f'A{i}:H{i}')
         ws[f'A{i}'] = info
         ws[f'A{i}'].font = Font(name='Microsoft YaHei', size=11, color=DARK_GRAY)
@@ -345,12 +488,9 @@ def generate_quote_excel(processed_data, output_filename):
     ws.row_dimensions[14].height = 25
     
     # Modern table headers with clean design
-    table_headers = ["序号", "零件图片", "零件名称", "表面处理", "材质", "数量", "单价(未税)", "总价(未税)"]
-    header_widths = [6, 12, 20, 12, 15, 8, 15, 15]
-    
     # Create header row with modern styling
-    header_row = 15
-    for col_num, (header, width) in enumerate(zip(table_headers, header_widths), 1):
+    header_row = HEADER_ROW
+    for col_num, (header, width) in enumerate(zip(TABLE_HEADERS, HEADER_WIDTHS), 1):
         cell = ws.cell(row=header_row, column=col_num)
         cell.value = header
         cell.font = Font(name='Microsoft YaHei', size=11, bold=True, color="FFFFFF")
@@ -364,7 +504,8 @@ def generate_quote_excel(processed_data, output_filename):
     ws.row_dimensions[header_row].height = 35
 
     # Add data rows with alternating background and clean styling
-    data_start_row = 16
+    data_start_row = DATA_START_ROW
+    media = {}  # Rows with the same picture share one media part
     
     for idx, row_data in enumerate(processed_data):
         current_row = data_start_row + idx
@@ -373,34 +514,17 @@ def generate_quote_excel(processed_data, output_filename):
         row_fill = PatternFill(start_color=LIGHT_GRAY, end_color=LIGHT_GRAY, fill_type="solid") if idx % 2 == 0 else None
         
         # Set row height for images
-        ws.row_dimensions[current_row].height = 65
-        
-        # Clean surface finish display
-        surface_finish = row_data.get("Surface_Finish", "")
-        if surface_finish is None or surface_finish == "null":
-            surface_display = "—"
-        else:
-            surface_display = str(surface_finish).replace("120#", "").replace("+", " + ")
-        
-        # Extract and format quantity
-        quantity = row_data.get("Quantity", 0)
-        try:
-            if isinstance(quantity, str) and quantity.strip():
-                quantity = float(quantity)
-            elif not isinstance(quantity, (int, float)):
-                quantity = 0
-        except (ValueError, TypeError):
-            quantity = 0
+        ws.row_dimensions[current_row].height = DATA_ROW_HEIGHT
         
         # Clean data values
         row_values = [
             f"{idx + 1:02d}",  # Zero-padded serial number
             "",  # Image placeholder
             row_data.get("Part_Name", "—"),
-            surface_display,
+            format_surface_finish(row_data.get("Surface_Finish", "")),
             row_data.get("Material", "—"),
-            int(quantity) if quantity == int(quantity) else quantity,
-            0,  # Unit price placeholder
+            parse_quantity(row_data.get("Quantity", 0)),
+            unit_price(prices, idx),  # Unit price, 0 is the placeholder
             None,  # Total will be formula
         ]
         
@@ -437,24 +561,16 @@ def generate_quote_excel(processed_data, output_filename):
                 cell.alignment = Alignment(horizontal="left", vertical="center", wrap_text=True)
 
         # Handle image insertion with better positioning
-        if row_data.get("image_file") and row_data["image_file"] != "null":
-            image_path = os.path.join("extracted_images", row_data["image_file"])
-            if os.path.exists(image_path):
-                try:
-                    img = XLImage(image_path)
-                    # Resize image to fit nicely in cell
-                    max_size = 55
-                    if img.width > max_size or img.height > max_size:
-                        ratio = min(max_size/img.width, max_size/img.height)
-                        img.width = int(img.width * ratio)
-                        img.height = int(img.height * ratio)
-                    
-                    # Center the image in the cell
-                    img.anchor = f"B{current_row}"
-                    ws.add_image(img)
-                    
-                except Exception as e:
-                    print(f"⚠️  Error adding image for row {current_row}: {e}")
+        try:
+            with profiling.accumulate("generate.image"):
+                img = quote_row_image(row_data, images, thumbnails, dpi_scale, images_dir, media)
+            if img is not None:
+                # Center the image in the cell
+                img.anchor = f"B{current_row}"
+                ws.add_image(img)
+                
+        except Exception as e:
+            print(f"⚠️  Error adding image for row {current_row}: {e}")
 
     # Modern totals section
     total_row = len(processed_data) + data_start_row + 1
@@ -485,14 +601,7 @@ def generate_quote_excel(processed_data, output_filename):
     ws.row_dimensions[terms_start].height = 25
     
     # Clean terms list with fillable delivery time (NO yellow highlight)
-    terms = [
-        "• 付款方式: 月结30天",
-        "• 交货期: 确认后 (     ) 个工作日内完成",  # Fillable, but NO highlight
-        "• 验收标准: 依据甲方2D、3D图纸及说明文档进行验收",
-        "• 本报价单适用于杭州海康威视科技有限公司及其子公司、关联公司",
-        "• 报价有效期: 30天",
-        "• 所有价格均为人民币不含税价格"
-    ]
+    terms = QUOTE_TERMS
     
     for i, term in enumerate(terms, start=terms_start + 1):
         ws.merge_cells(f'A{i}:H{i}')
@@ -526,21 +635,41 @@ def generate_quote_excel(processed_data, output_filename):
     ws.page_margins.bottom = 1.0
     
     # Save the workbook
-    wb.save(output_filename)
+    with profiling.span("generate.save", rows=len(processed_data)):
+        save_workbook(wb, output_filename)
     print(f"✅ Modern quote Excel generated: {output_filename}")
     return output_filename
     
-     
+
 def main():
     """Main pipeline function"""
     
     # Check command line arguments
-    if len(sys.argv) < 2:
-        print("Usage: python quote_generator.py <input_excel_file>")
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    streaming = "--stream" in sys.argv[1:]
+    sheets = next((arg.partition("=")[2] or "all" for arg in sys.argv[1:]
+                   if arg == "--sheets" or arg.startswith("--sheets=")), None)
+    if sheets not in (None, "all"):
+        sheets = [name.strip() for name in sheets.split(",") if name.strip()]
+    sequential = "--sequential" in sys.argv[1:] or streaming or sheets is not None
+    merge_similar = "--merge-similar-images" in sys.argv[1:]
+    trace = "--trace" in sys.argv[1:]
+    profile = "--profile" in sys.argv[1:] or trace
+    if not args:
+        print("Usage: python quote_generator.py <input_excel_file> [--sequential] [--stream] [--sheets[=A,B]] "
+              "[--merge-similar-images] [--profile] [--trace]")
         print("Example: python quote_generator.py input.xlsx")
+        print("  --sequential  run extract, normalize and generate one after another instead of pipelined")
+        print("  --stream   sequential run reading the workbook row by row (lower memory on large files)")
+        print("  --sheets   quote every visible sheet (or only sheets A and B) instead of the active one,")
+        print("             extracting them in parallel processes (sequential run)")
+        print("  --merge-similar-images  rows whose pictures are the same render resized or re-exported share one")
+        print("             image file (can also merge distinct parts with near-identical renders)")
+        print("  --profile  write stage timings, memory and LLM token counts to profile.jsonl")
+        print("  --trace    also write a Chrome trace to profile_trace.json (implies --profile)")
         sys.exit(1)
     
-    input_file = sys.argv[1]
+    input_file = args[0]
     
     # Check if input file exists
     if not os.path.exists(input_file):
@@ -549,11 +678,44 @@ def main():
     
     print(f"🚀 Starting Excel Quote Generator")
     print(f"📁 Input file: {input_file}")
+    if profile:
+        profiling.enable("profile.jsonl", "profile_trace.json" if trace else None)
+    
+    output_filename = "手板报价单.xlsx"  # Simplified filename without date
     
     try:
+        if not sequential:
+            # All three steps at once, rows flow through as they are ready
+            from pipeline import PipelineError, run_pipeline
+            print("\n=== EXTRACT → PROCESS WITH QWEN → GENERATE (pipelined) ===")
+            response_cache = ResponseCache()
+            thumbnails = ThumbnailCache()
+            try:
+                with profiling.span("pipeline") as stats:
+                    item_count = asyncio.run(run_pipeline(input_file, output_filename, response_cache=response_cache,
+                                                          thumbnails=thumbnails, pricing=PricingEngine(),
+                                                          merge_similar=merge_similar))
+                    stats.update(items=item_count)
+            except PipelineError as e:
+                print(f"❌ {e}")
+                sys.exit(1)
+            finally:
+                response_cache.close()
+            
+            print(f"\n🎉 SUCCESS!")
+            print(f"📊 Processed {item_count} items")
+            print(f"📝 Quote generated: {output_filename}")
+            print(f"💾 LLM response cache: {response_cache.summary()}")
+            print(f"🖼️  Thumbnail cache: {thumbnails.hits} hits, {thumbnails.misses} misses")
+            return
+        
         # Step 1: Extract data and images from customer Excel
         print("\n=== STEP 1: EXTRACTING DATA ===")
-        extracted_data = extract_customer_excel(input_file, "extracted_images")
+        images = {}
+        with profiling.span("extract", streaming=streaming) as stats:
+            extracted_data = extract_customer_excel(input_file, "extracted_images", streaming=streaming, images=images,
+                                                    sheets=sheets, merge_similar=merge_similar)
+            stats.update(rows=len(extracted_data or ()), images=len(images))
         
         if not extracted_data:
             print("❌ No data extracted from Excel file")
@@ -561,7 +723,14 @@ def main():
         
         # Step 2: Process with Qwen API
         print("\n=== STEP 2: PROCESSING WITH QWEN ===")
-        processed_data = process_with_qwen(extracted_data)
+        response_cache = ResponseCache()
+        try:
+            with profiling.span("normalize", rows=len(extracted_data)) as stats:
+                processed_data = process_with_qwen(extracted_data, response_cache=response_cache)
+                stats.update(items=len(processed_data or ()), cache_hits=response_cache.hits,
+                             cache_misses=response_cache.misses)
+        finally:
+            response_cache.close()
         
         if not processed_data:
             print("❌ Failed to process data with Qwen API")
@@ -569,17 +738,30 @@ def main():
         
         # Step 3: Generate quote Excel
         print("\n=== STEP 3: GENERATING QUOTE ===")
-        output_filename = "手板报价单.xlsx"  # Simplified filename without date
         
-        quote_file = generate_quote_excel(processed_data, output_filename)
+        thumbnails = ThumbnailCache()
+        with profiling.span("price", items=len(processed_data)) as stats:
+            prices = PricingEngine().price_items(processed_data)
+            stats.update(priced=sum(price is not None for price in prices))
+        with profiling.span("generate", items=len(processed_data)) as stats:
+            quote_file = generate_quote_excel(processed_data, output_filename, images=images, thumbnails=thumbnails,
+                                              write_only=True, prices=prices)
+            stats.update(thumbnail_hits=thumbnails.hits, thumbnail_misses=thumbnails.misses)
+        print(f"💰 Priced {sum(price is not None for price in prices)} of {len(prices)} items from the rate tables")
         
         print(f"\n🎉 SUCCESS!")
         print(f"📊 Processed {len(processed_data)} items")
         print(f"📝 Quote generated: {quote_file}")
+        print(f"💾 LLM response cache: {response_cache.summary()}")
+        print(f"🖼️  Thumbnail cache: {thumbnails.hits} hits, {thumbnails.misses} misses")
         
     except Exception as e:
         print(f"❌ Pipeline failed: {e}")
         sys.exit(1)
+    finally:
+        if profile:
+            profiling.finish()
+            print(f"⏱️  Profile written to profile.jsonl{' and profile_trace.json' if trace else ''}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+Value normalization layer
+Cleans up material, process, surface finish and quantity values with local
+vocabularies, so only values they can't read are sent to the LLM
+"""
+
+import re
+import unicodedata
+from functools import lru_cache
+
+# Canonical material -> known spellings (matched after canonical_text)
+MATERIAL_ALIASES = {
+    "AL6061": ["6061", "al6061", "6061al", "a6061", "6061t6", "al6061t6", "铝6061", "6061铝", "铝合金6061",
+               "6061铝合金", "6061铝板"],
+    "AL6063": ["6063", "al6063", "6063al", "铝6063", "6063铝", "铝合金6063", "6063铝合金"],
+    "AL7075": ["7075", "al7075", "7075al", "7075t6", "铝7075", "7075铝", "铝合金7075", "7075铝合金", "航空铝"],
+    "AL5052": ["5052", "al5052", "5052al", "铝5052", "5052铝", "铝合金5052", "5052铝合金"],
+    "AL2A12": ["2a12", "al2a12", "ly12", "硬铝", "2a12铝"],
+    "铝合金": ["铝合金", "铝", "aluminum", "aluminium", "al"],
+    "SUS303": ["303", "sus303", "ss303", "303不锈钢", "不锈钢303"],
+    "SUS304": ["304", "sus304", "ss304", "304不锈钢", "不锈钢304", "304l", "sus304l"],
+    "SUS316": ["316", "316l", "sus316", "sus316l", "ss316", "316不锈钢", "不锈钢316", "316l不锈钢"],
+    "SUS420": ["420", "sus420", "420不锈钢", "不锈钢420"],
+    "SUS630": ["630", "sus630", "17-4ph", "174ph"],
+    "不锈钢": ["不锈钢", "stainless", "stainlesssteel"],
+    "45#钢": ["45#", "45#钢", "45钢", "s45c", "c45"],
+    "Q235": ["q235", "a3钢", "a3"],
+    "SKD11": ["skd11", "cr12mov", "d2"],
+    "40Cr": ["40cr"],
+    "钢": ["钢", "碳钢", "steel"],
+    "H59黄铜": ["h59", "h59黄铜", "黄铜h59"],
+    "H62黄铜": ["h62", "h62黄铜", "黄铜h62"],
+    "黄铜": ["黄铜", "brass"],
+    "T2紫铜": ["t2", "t2紫铜", "紫铜", "红铜", "copper"],
+    "TC4": ["tc4", "ti6al4v", "钛合金", "钛", "titanium"],
+    "ABS": ["abs", "abs塑料", "abs料"],
+    "PC": ["pc", "聚碳酸酯", "pc料"],
+    "PC+ABS": ["pc+abs", "abs+pc", "pc/abs", "abs/pc"],
+    "POM": ["pom", "赛钢", "聚甲醛", "delrin"],
+    "PMMA": ["pmma", "亚克力", "有机玻璃", "亚加力", "acrylic"],
+    "PA6": ["pa6", "尼龙6"],
+    "PA66": ["pa66", "尼龙66"],
+    "PA12": ["pa12", "尼龙12"],
+    "PA+GF": ["pa+gf", "pa66+gf", "pa6+gf", "尼龙加纤", "尼龙+玻纤"],
+    "尼龙": ["尼龙", "nylon", "pa"],
+    "PEEK": ["peek"],
+    "PP": ["pp", "聚丙烯"],
+    "PE": ["pe", "聚乙烯", "hdpe", "uhmwpe"],
+    "PTFE": ["ptfe", "铁氟龙", "特氟龙", "teflon", "聚四氟乙烯"],
+    "PVC": ["pvc"],
+    "TPU": ["tpu"],
+    "硅胶": ["硅胶", "silicone"],
+    "电木": ["电木", "bakelite"],
+    "树脂": ["树脂", "光敏树脂", "resin", "白色树脂", "透明树脂"],
+}
+
+# Canonical machining process -> known spellings
+PROCESS_ALIASES = {
+    "CNC": ["cnc", "cnc加工", "数控", "数控加工", "加工中心", "铣", "铣削", "cnc铣", "机加", "机加工", "精雕", "milling"],
+    "车削": ["车", "车削", "车床", "数控车", "车加工", "lathe", "turning"],
+    "SLA": ["sla", "光固化", "sla打印", "sla光固化"],
+    "SLS": ["sls", "sls打印", "粉末烧结"],
+    "MJF": ["mjf", "mjf打印"],
+    "FDM": ["fdm", "fdm打印"],
+    "SLM": ["slm", "slm打印", "金属打印", "金属3d打印"],
+    "3D打印": ["3d打印", "3dp", "打印", "3dprint", "3dprinting"],
+    "复模": ["复模", "硅胶复模", "真空复模", "小批量复模", "vacuumcasting"],
+    "钣金": ["钣金", "钣金加工", "折弯", "sheetmetal"],
+    "激光切割": ["激光切割", "激光切", "lasercutting"],
+    "线切割": ["线切割", "慢走丝", "快走丝", "wireedm"],
+    "电火花": ["电火花", "放电", "edm"],
+    "注塑": ["注塑", "注塑成型", "injectionmolding"],
+    "手工": ["手工", "手工制作"],
+}
+
+# Canonical surface finish -> known spellings
+FINISH_ALIASES = {
+    "喷砂": ["喷砂", "喷沙", "sandblast", "sandblasting", "beadblast"],
+    "阳极氧化": ["阳极氧化", "阳极", "氧化", "普通氧化", "本色氧化", "anodize", "anodizing", "anodized"],
+    "硬质氧化": ["硬质氧化", "硬氧", "硬质阳极", "hardanodize"],
+    "导电氧化": ["导电氧化", "化学氧化", "alodine", "铬酸盐"],
+    "微弧氧化": ["微弧氧化"],
+    "喷漆": ["喷漆", "喷油", "烤漆", "喷涂", "paint", "painting"],
+    "喷粉": ["喷粉", "喷塑", "粉末喷涂", "powdercoat", "powdercoating"],
+    "电泳": ["电泳"],
+    "丝印": ["丝印", "丝网印刷", "silkscreen"],
+    "移印": ["移印", "padprint", "padprinting"],
+    "镭雕": ["镭雕", "激光雕刻", "激光打标", "镭射", "laserengraving", "lasermarking"],
+    "电镀": ["电镀", "水镀", "plating"],
+    "镀铬": ["镀铬", "chrome"],
+    "镀镍": ["镀镍", "nickel"],
+    "镀锌": ["镀锌", "zinc"],
+    "真空镀": ["真空镀", "真空电镀"],
+    "抛光": ["抛光", "polish", "polishing"],
+    "镜面抛光": ["镜面抛光", "镜面"],
+    "拉丝": ["拉丝", "brushed", "brushing"],
+    "打磨": ["打磨", "砂纸打磨", "sanding"],
+    "去毛刺": ["去毛刺", "倒角去毛刺", "deburr", "deburring"],
+    "钝化": ["钝化", "passivation", "passivate"],
+    "发黑": ["发黑", "黑化", "blackoxide"],
+    "皮纹": ["皮纹", "咬花", "texture"],
+    "染色": ["染色", "dyeing"],
+    "UV": ["uv", "光油", "uv光油"],
+    "无": ["无", "无需", "不需要", "不处理", "无处理", "无需处理", "none", "na", "n/a", "/", "-", "—"],
+}
+
+# Canonical color -> known spellings, kept next to finishes and plastics
+COLOR_ALIASES = {
+    "黑色": ["黑色", "黑", "哑黑", "亮黑", "black"],
+    "白色": ["白色", "白", "white"],
+    "银色": ["银色", "银", "silver"],
+    "灰色": ["灰色", "灰", "grey", "gray"],
+    "红色": ["红色", "红", "red"],
+    "蓝色": ["蓝色", "蓝", "blue"],
+    "绿色": ["绿色", "绿", "green"],
+    "金色": ["金色", "金", "gold"],
+    "本色": ["本色", "原色", "natural"],
+    "透明": ["透明", "clear"],
+}
+
+# Words that carry no meaning in these columns
+FILLER_WORDS = ["表面处理", "表面", "处理", "工艺", "材质", "材料", "加工", "颜色", "色"]
+
+QUANTITY_UNITS = ["件", "个", "套", "只", "台", "片", "支", "根", "块", "张", "副", "对", "pcs", "pc", "sets", "set",
+                  "ea", "pieces", "piece"]
+
+VALUE_FIELDS = ("Material", "Machining_Process", "Surface_Finish", "Quantity")
+EMPTY_VALUES = (None, "", "null", "None", "N/A")
+
+_SPACES = re.compile(r"\s+")
+_GRIT = re.compile(r"\d+\s*(?:#|目)")  # Sandpaper / blasting grit, e.g. 120# or 800目
+_FINISH_SEPARATORS = re.compile(r"[+,;、&]|以及|和|及|后|再")
+_NOISE = re.compile(r"[\s\d\W_]+")
+_TEMPER = re.compile(r"(?<![a-z])t\d+")  # Aluminium temper, e.g. -T6 or T651
+_QUANTITY = re.compile(
+    r"(?:[x×*])?(\d+(?:\.\d+)?)(?:" + "|".join(map(re.escape, QUANTITY_UNITS)) + r")?"
+)
+
+
+def canonical_text(value):
+    """Lower-case, half-width, whitespace-free form of a cell value for matching"""
+    return _SPACES.sub("", unicodedata.normalize("NFKC", str(value)).lower())
+
+
+class Vocabulary:
+    """Alias table compiled into a dict for exact values and one regex for scanning longer ones
+
+    The regex tries the longest alias first at every position, so
+    "铝合金6061" is one match rather than "铝" and "6061". Latin and digit
+    aliases only match where they are not glued to more of the same
+    ("pc" does not match inside "pcs", "304" not inside "3045").
+    """
+
+    def __init__(self, aliases):
+        self.lookup = {}
+        for canonical, spellings in aliases.items():
+            for spelling in [canonical, *spellings]:
+                self.lookup.setdefault(canonical_text(spelling), canonical)
+        patterns = []
+        for key in sorted(self.lookup, key=len, reverse=True):
+            pattern = re.escape(key)
+            if key[0].isascii() and key[0].isalnum():
+                pattern = (r"(?<![a-z])" if key[0].isalpha() else r"(?<![0-9])") + pattern
+            if key[-1].isascii() and key[-1].isalnum():
+                pattern += r"(?![a-z])" if key[-1].isalpha() else r"(?![0-9])"
+            patterns.append(pattern)
+        self.pattern = re.compile("|".join(patterns))
+
+    def scan(self, text):
+        """(canonical names found in order, text with the matches blanked out)"""
+        found = []
+
+        def take(match):
+            found.append(self.lookup[match.group()])
+            return " "
+
+        return found, self.pattern.sub(take, text)
+
+
+MATERIALS = Vocabulary(MATERIAL_ALIASES)
+PROCESSES = Vocabulary(PROCESS_ALIASES)
+FINISHES = Vocabulary(FINISH_ALIASES)
+COLORS = Vocabulary(COLOR_ALIASES)
+FILLERS = Vocabulary({word: [] for word in FILLER_WORDS})
+
+
+def is_noise(text):
+    """True if nothing but filler words, digits and punctuation is left"""
+    return not _NOISE.sub("", FILLERS.scan(text)[1])
+
+
+def unique(names):
+    return list(dict.fromkeys(names))
+
+
+def normalize_material(value):
+    """Canonical material, with its color if one is given ("ABS(黑色)"), None if not recognised"""
+    text = canonical_text(value)
+    if text in MATERIALS.lookup:
+        return MATERIALS.lookup[text]
+    found, rest = MATERIALS.scan(text)
+    colors, rest = COLORS.scan(rest)
+    found = unique(found)
+    if len(found) != 1 or len(set(colors)) > 1 or not is_noise(_TEMPER.sub(" ", rest)):
+        return None
+    return f"{found[0]}({colors[0]})" if colors else found[0]
+
+
+def normalize_process(value):
+    """Canonical process, several joined with " + ", None if not recognised"""
+    text = canonical_text(value)
+    if text in PROCESSES.lookup:
+        return PROCESSES.lookup[text]
+    found, rest = PROCESSES.scan(text)
+    if not found or not is_noise(rest):
+        return None
+    return " + ".join(unique(found))
+
+
+def normalize_finish(value):
+    """Canonical finishes joined with " + ", colors in parentheses, None if not recognised
+
+    "120#喷砂+黑色氧化" becomes "喷砂 + 阳极氧化(黑色)"; grit sizes are dropped.
+    """
+    text = _GRIT.sub(" ", canonical_text(value))
+    if text.strip() in FINISHES.lookup:
+        return FINISHES.lookup[text.strip()]
+
+    finishes = []
+    for part in _FINISH_SEPARATORS.split(text):
+        found, rest = FINISHES.scan(part)
+        colors, rest = COLORS.scan(rest)
+        if not is_noise(rest) or len(set(colors)) > 1 or (colors and not found and not finishes):
+            return None
+        if not found:
+            if colors:  # "阳极氧化+黑色": the color belongs to the finish before it
+                finishes[-1] = (finishes[-1][0], colors[0])
+            continue
+        finishes.extend((name, colors[0] if colors else None) for name in found)
+
+    names = unique(f"{name}({color})" if color else name for name, color in finishes)
+    if len(names) > 1 and "无" in names:
+        names.remove("无")
+    return " + ".join(names) if names else None
+
+
+def parse_quantity_value(value):
+    """Number of pieces in a quantity cell ("10", "10件", "x5", "1,000 pcs"), None if not readable"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        quantity = value
+    else:
+        match = _QUANTITY.fullmatch(canonical_text(value).replace(",", ""))
+        if match is None:
+            return None
+        quantity = float(match.group(1))
+    return int(quantity) if quantity == int(quantity) else quantity
+
+
+NORMALIZERS = {
+    "Material": normalize_material,
+    "Machining_Process": normalize_process,
+    "Surface_Finish": normalize_finish,
+    "Quantity": parse_quantity_value,
+}
+
+
+@lru_cache(maxsize=65536)
+def _normalize_value(field, value):
+    return NORMALIZERS[field](value)
+
+
+def normalize_value(field, value):
+    """(resolved, value) for one cell; empty cells count as resolved and stay empty
+
+    Results are memoized per distinct value, so a column with few distinct
+    spellings costs a few lookups however many rows it has.
+    """
+    if value in EMPTY_VALUES:
+        return True, None
+    normalized = _normalize_value(field, value)
+    return (True, normalized) if normalized is not None else (False, value)
+
+
+def normalize_values(items):
+    """Normalize the value fields of items in place, column by column
+
+    Returns {field: {original value: [item indexes]}} for the values that
+    were not recognised; those are left as they were.
+    """
+    unresolved = {}
+    for field in VALUE_FIELDS:
+        missing = {}
+        for idx, item in enumerate(items):
+            if field not in item:
+                continue
+            resolved, value = normalize_value(field, item[field])
+            if resolved:
+                item[field] = value
+            else:
+                missing.setdefault(value, []).append(idx)
+        if missing:
+            unresolved[field] = missing
+    return unresolved
+
+
+def normalize_item(item):
+    """normalize_values() for a single item, True if every value was recognised"""
+    return not normalize_values([item])
+
+
+def unresolved_count(unresolved):
+    return sum(len(values) for values in unresolved.values())
+
+
+async def resolve_values_async(items, unresolved, client, model, cache=None):
+    """Ask the model about the values normalize_values() could not read and fill them in
+
+    Each distinct value is asked about once; with a ResponseCache the
+    answers are kept per value, under the model that gave them. Returns
+    the number of values resolved.
+    """
+    from llm import MODEL_KEY, client_models, request_value_normalization_async, value_fingerprint
+
+    models = client_models(client, model)
+    answers = {}
+    pending = {}
+    for field, values in unresolved.items():
+        for value in values:
+            keys = [value_fingerprint(candidate, field, value) for candidate in models]
+            cached = cache.get_any(keys) if cache is not None else None
+            if cached is not None:
+                answers[(field, value)] = cached["value"]
+            else:
+                pending.setdefault(field, []).append(value)
+
+    if pending:
+        print(f"🤖 Asking Qwen about {unresolved_count(pending)} unrecognised values...")
+        answer = await request_value_normalization_async(client, pending, model)
+        answered_by = answer.pop(MODEL_KEY, model)
+        fresh = []
+        for field, values in pending.items():
+            by_text = {str(key): normalized for key, normalized in (answer.get(field) or {}).items()}
+            for value in values:
+                normalized = by_text.get(str(value))
+                if field == "Quantity" and normalized is not None:
+                    normalized = parse_quantity_value(normalized)
+                if normalized in EMPTY_VALUES:
+                    continue
+                answers[(field, value)] = normalized
+                fresh.append((value_fingerprint(answered_by, field, value), {"value": normalized}))
+        if cache is not None and fresh:
+            cache.put_many(fresh)
+
+    for (field, value), normalized in answers.items():
+        for idx in unresolved[field][value]:
+            items[idx][field] = normalized
+    return len(answers)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Streaming access to the parts of an .xlsx package
+Reads sheet paths, drawing anchors and media bytes straight from the zip
+"""
+
+import posixpath
+from collections import namedtuple
+from xml.etree.ElementTree import iterparse
+
+REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+DOC_REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+XDR_NS = "http://schemas.openxmlformats.org/drawingml/2006/spreadsheetDrawing"
+A_NS = "http://schemas.openxmlformats.org/drawingml/2006/main"
+
+# 1-based rows/cols, same convention as extract_customer_excel
+ImageAnchor = namedtuple("ImageAnchor", "from_row from_col to_row to_col media_path")
+
+
+def _rels_path(part_path):
+    """Path of the .rels part that belongs to a package part"""
+    folder, name = posixpath.split(part_path)
+    return posixpath.join(folder, "_rels", f"{name}.rels")
+
+
+def read_rels(zf, part_path):
+    """Map relationship id -> (type, absolute target) for a package part"""
+    rels_path = _rels_path(part_path)
+    if rels_path not in zf.namelist():
+        return {}
+
+    folder = posixpath.dirname(part_path)
+    rels = {}
+    with zf.open(rels_path) as src:
+        for _, elem in iterparse(src):
+            if elem.tag == f"{{{REL_NS}}}Relationship":
+                target = elem.get("Target")
+                if elem.get("TargetMode") != "External":
+                    if target.startswith("/"):
+                        target = target.lstrip("/")
+                    else:
+                        target = posixpath.normpath(posixpath.join(folder, target))
+                rels[elem.get("Id")] = (elem.get("Type", "").rsplit("/", 1)[-1], target)
+    return rels
+
+
+def sheet_parts(zf):
+    """Ordered list of (sheet name, worksheet part path) from workbook.xml"""
+    rels = read_rels(zf, "xl/workbook.xml")
+    sheets = []
+    with zf.open("xl/workbook.xml") as src:
+        for _, elem in iterparse(src):
+            if elem.tag == f"{{{MAIN_NS}}}sheet":
+                rel_id = elem.get(f"{{{DOC_REL_NS}}}id")
+                if rel_id in rels:
+                    sheets.append((elem.get("name"), rels[rel_id][1]))
+    return sheets
+
+
+def worksheet_names(zf):
+    """Names of the visible worksheets in workbook order (no chartsheets or hidden sheets)"""
+    rels = read_rels(zf, "xl/workbook.xml")
+    names = []
+    with zf.open("xl/workbook.xml") as src:
+        for _, elem in iterparse(src):
+            if elem.tag == f"{{{MAIN_NS}}}sheet":
+                kind = rels.get(elem.get(f"{{{DOC_REL_NS}}}id"), ("", ""))[0]
+                if kind == "worksheet" and elem.get("state", "visible") == "visible":
+                    names.append(elem.get("name"))
+    return names
+
+
+def _read_marker(marker):
+    """(row, col) of an xdr:from / xdr:to marker, converted to 1-based"""
+    row = int(marker.findtext(f"{{{XDR_NS}}}row", "0")) + 1
+    col = int(marker.findtext(f"{{{XDR_NS}}}col", "0")) + 1
+    return row, col
+
+
+def iter_image_anchors(zf, sheet_path):
+    """Yield an ImageAnchor for every picture anchored to cells on a sheet
+
+    Anchors come out in the same order openpyxl puts them in ws._images
+    (oneCellAnchor before twoCellAnchor). Absolute anchors have no cell
+    position and are skipped.
+    """
+    drawings = [target for kind, target in read_rels(zf, sheet_path).values() if kind == "drawing"]
+
+    for drawing_path in drawings:
+        media = {
+            rel_id: target
+            for rel_id, (kind, target) in read_rels(zf, drawing_path).items()
+            if kind == "image"
+        }
+        anchors = {"oneCellAnchor": [], "twoCellAnchor": []}
+
+        with zf.open(drawing_path) as src:
+            for _, elem in iterparse(src):
+                kind = elem.tag.rsplit("}", 1)[-1]
+                if elem.tag.startswith(f"{{{XDR_NS}}}") and kind in anchors:
+                    blip = elem.find(f".//{{{A_NS}}}blip")
+                    rel_id = blip.get(f"{{{DOC_REL_NS}}}embed") if blip is not None else None
+                    marker_from = elem.find(f"{{{XDR_NS}}}from")
+                    if rel_id in media and marker_from is not None:
+                        from_row, from_col = _read_marker(marker_from)
+                        marker_to = elem.find(f"{{{XDR_NS}}}to")
+                        if marker_to is not None:
+                            to_row, to_col = _read_marker(marker_to)
+                        else:
+                            # Use image size to estimate end position
+                            to_row, to_col = from_row + 2, from_col + 1
+                        anchors[kind].append(
+                            ImageAnchor(from_row, from_col, to_row, to_col, media[rel_id])
+                        )
+                    elem.clear()
+
+        yield from anchors["oneCellAnchor"]
+        yield from anchors["twoCellAnchor"]
+